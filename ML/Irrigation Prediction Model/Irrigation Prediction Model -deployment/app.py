@@ -0,0 +1,423 @@
+"""Flask app serving the irrigation and soil health models (run by app.ipynb, or serve.py in production)."""
+from flask import Flask, request, render_template, jsonify, Response, stream_with_context
+import pandas as pd
+import numpy as np
+import pickle
+import hmac
+import json
+import os
+import threading
+import time
+from fast_predict import FastPredictor, FEATURES
+from micro_batcher import MicroBatcher
+from prediction_cache import PredictionCache, parse_resolutions
+from model_registry import ModelRegistry
+from feature_store import FeatureStore
+import metrics
+from soil_pipeline import SoilHealthPipeline, condition
+
+app = Flask(__name__)
+
+MODEL_PATH = os.environ.get(
+    "IRRIGATION_MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "irrigation_model.pkl")
+)
+
+# with a registry, the model is its current "irrigation" version and new versions are hot-swapped in
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR")
+MODEL_NAME = "irrigation"
+MODEL_RELOAD_INTERVAL = float(os.environ.get("MODEL_RELOAD_INTERVAL", "5"))
+# POST /reload needs "Authorization: Bearer <token>" with this token, and is disabled without one
+RELOAD_TOKEN = os.environ.get("RELOAD_TOKEN")
+registry = ModelRegistry(MODEL_REGISTRY_DIR) if MODEL_REGISTRY_DIR else None
+# booster parameters applied to every loaded model (serve.py pins nthread per worker)
+BOOSTER_PARAMS = {}
+
+class LoadedModel:
+    """A model plus everything derived from it, swapped in as one object on reload."""
+
+    def __init__(self, model, version):
+        self.model = model
+        self.version = version
+        if BOOSTER_PARAMS:
+            model.get_booster().set_param(BOOSTER_PARAMS)
+        # single readings skip pandas: validated into a float32 row and scored in place
+        self.fast = FastPredictor(model)
+
+    def warm_up(self):
+        """Run both prediction paths once so the first real request doesn't pay for lazy setup."""
+        X = np.zeros((8, len(FEATURES)), dtype=np.float32)
+        self.fast.predict_proba_rows(X[:1])
+        self.model.predict_proba(pd.DataFrame(X, columns=FEATURES))
+        return self
+
+def load_model(path=MODEL_PATH, version=None):
+    with open(path, "rb") as f:
+        model = pickle.load(f)
+    return LoadedModel(model, version or str(os.path.getmtime(path))).warm_up()
+
+def load_current():
+    """The registry's current version if there is one, otherwise MODEL_PATH."""
+    version = registry.current(MODEL_NAME) if registry is not None else None
+    if version is None:
+        return load_model()
+    return load_model(registry.model_path(MODEL_NAME, version), version)
+
+# loaded at import: under serve.py this happens once in the master, before the workers fork
+current = load_current()
+
+SOIL_HEALTH_PIPELINE_PATH = os.environ.get(
+    "SOIL_HEALTH_PIPELINE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "soil_health_pipeline.pkl")
+)
+# encoders, scaler and forest in one file (built with `python soil_pipeline.py fuse`);
+# the soil health routes answer 503 until it exists
+soil_health = SoilHealthPipeline.load(SOIL_HEALTH_PIPELINE_PATH) if os.path.exists(SOIL_HEALTH_PIPELINE_PATH) else None
+
+# libpq connection string of the Postgres database the stream writes farm_features to;
+# /features answers 503 without it
+FEATURE_STORE_DSN = os.environ.get("FEATURE_STORE_DSN")
+feature_store = FeatureStore(FEATURE_STORE_DSN) if FEATURE_STORE_DSN else None
+
+# optional cache of predictions keyed on the features rounded to per-feature resolutions
+PREDICTION_CACHE = os.environ.get("PREDICTION_CACHE", "0") == "1"
+cache = PredictionCache(
+    resolutions=parse_resolutions(os.environ.get("PREDICTION_CACHE_RESOLUTIONS")),
+    max_entries=int(os.environ.get("PREDICTION_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.environ.get("PREDICTION_CACHE_TTL", "300"))
+)
+
+_swap_lock = threading.Lock()
+
+def swap_model(loaded):
+    """Make an already loaded and warmed-up model the one that serves requests.
+
+    Requests take one reference to `current` and use it throughout, so they
+    finish on the model they started with; cached predictions of the old
+    model are dropped."""
+    global current
+    with _swap_lock:
+        current = loaded
+        cache.clear()
+    return loaded
+
+def reload_model(path=MODEL_PATH, version=None):
+    """Load the model file again and swap it in."""
+    return swap_model(load_model(path, version))
+
+class ModelWatcher:
+    """Polls the registry's CURRENT version and hot-swaps the model when it changes.
+
+    New versions are loaded and warmed up on the watcher's thread while the old
+    model keeps serving. A version that fails to load is not retried until
+    CURRENT changes again. Promoting an older version (a rollback) is picked up
+    the same way."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.failed = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_running(self):
+        # threads do not survive fork, so each gunicorn worker starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    threading.Thread(target=self._loop, name="model-watcher", daemon=True).start()
+                    self._pid = os.getpid()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                app.logger.exception("loading a new model version failed; still serving %s", current.version)
+
+    def check(self):
+        """Swap in the registry's current version if it is not the one being served."""
+        version = registry.current(MODEL_NAME)
+        if version is None or version == current.version or version == self.failed:
+            return False
+        try:
+            loaded = load_model(registry.model_path(MODEL_NAME, version), version)
+        except Exception:
+            self.failed = version
+            raise
+        swap_model(loaded)
+        app.logger.info("now serving %s %s", MODEL_NAME, version)
+        return True
+
+watcher = ModelWatcher(MODEL_RELOAD_INTERVAL)
+
+# optional request coalescing: concurrent /predict calls are scored together.
+# Only useful when requests are served concurrently (threaded server, serve.py --threads)
+MICRO_BATCHING = os.environ.get("MICRO_BATCHING", "0") == "1"
+def score_micro_batch(X):
+    metrics.BATCH_ROWS.labels("micro_batch").observe(len(X))
+    return current.fast.predict_proba_rows(X)
+
+batcher = MicroBatcher(
+    score_micro_batch,
+    n_features=len(FEATURES),
+    max_batch_size=int(os.environ.get("MICRO_BATCH_MAX_SIZE", "64")),
+    max_delay_ms=float(os.environ.get("MICRO_BATCH_MAX_DELAY_MS", "2"))
+)
+# identifiers copied from each reading to its result so callers can match them up
+PASSTHROUGH_KEYS = ["sensor_id", "farm_id", "timestamp"]
+# results serialized per chunk while streaming the response
+STREAM_CHUNK_SIZE = 1000
+
+def endpoint_label():
+    # the route pattern, not the raw path, keeps the label set small
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+@app.before_request
+def start_request():
+    if registry is not None:
+        watcher.ensure_running()
+    metrics.report_model(MODEL_NAME, current.version)
+    request.started = time.perf_counter()
+    request.in_flight = True
+    metrics.IN_FLIGHT.inc()
+
+@app.after_request
+def count_request(response):
+    endpoint = endpoint_label()
+    metrics.REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+    metrics.REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - request.started)
+    return response
+
+@app.teardown_request
+def finish_request(exc):
+    # runs after a streamed body has been sent, and a second time for
+    # stream_with_context responses, hence the flag
+    if getattr(request, "in_flight", False):
+        request.in_flight = False
+        metrics.IN_FLIGHT.dec()
+
+@app.route("/")
+def home():
+    return render_template("index.html")
+
+@app.route("/predict", methods=["POST"])
+def predict():
+    loaded = current
+    with metrics.phase("/predict", "parse"):
+        if request.is_json:
+            data = request.get_json()
+        else:
+            # form fields are strings; features() converts and validates them as for JSON
+            data = {name: request.form[name] for name in FEATURES if name in request.form}
+        try:
+            row = loaded.fast.features(data)[0]
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not request.is_json:
+            data = {name: float(value) for name, value in data.items()}
+
+    with metrics.phase("/predict", "predict"):
+        key = cache.key(row, loaded.version) if PREDICTION_CACHE else None
+        proba = cache.get(key) if key is not None else None
+        if key is not None:
+            metrics.CACHE_LOOKUPS.labels("hit" if proba is not None else "miss").inc()
+        if proba is None:
+            if MICRO_BATCHING:
+                proba = float(batcher.predict(row.copy()))
+            else:
+                proba = float(loaded.fast.predict_proba_rows(row[None, :])[0])
+            if key is not None:
+                cache.put(key, proba)
+        prediction = int(proba > 0.5)  # same threshold as model.predict
+
+    result = "Irrigation Needed" if prediction == 1 else "No Irrigation"
+
+    with metrics.phase("/predict", "serialize"):
+        if request.is_json:
+            return jsonify({
+                "prediction": result,
+                "prediction_code": int(prediction),
+                "input_data": data
+            })
+        else:
+            return render_template("result.html", input=data, prediction=result)
+
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonlines")
+
+def parse_batch(body, mimetype):
+    """Readings from a JSON array or from NDJSON (one JSON object per line).
+    Returns (records, is_ndjson); results are sent back in the same format.
+    A body is read as NDJSON when sent as such, or when it isn't one JSON value."""
+    ndjson = mimetype in NDJSON_MIMETYPES
+    if not ndjson:
+        try:
+            records = json.loads(body)
+        except ValueError:
+            ndjson = True
+        else:
+            if not isinstance(records, list):
+                raise ValueError(f"expected a JSON array of readings, got {type(records).__name__}")
+    if ndjson:
+        records = [json.loads(line) for line in body.splitlines() if line.strip()]
+    if not records:
+        raise ValueError("no readings in the request body")
+    return records, ndjson
+
+def batch_features(records):
+    """Feature matrix (n_rows x 6, float32) built in one pass over the readings."""
+    X = np.empty((len(records), len(FEATURES)), dtype=np.float32)
+    for i, record in enumerate(records):
+        try:
+            X[i] = [float(record[name]) for name in FEATURES]
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"row {i}: missing or invalid feature ({e})")
+    return X
+
+@app.route("/predict_batch", methods=["POST"])
+def predict_batch():
+    with metrics.phase("/predict_batch", "parse"):
+        try:
+            records, ndjson = parse_batch(request.get_data(as_text=True), request.mimetype)
+            X = batch_features(records)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    metrics.BATCH_ROWS.labels("/predict_batch").observe(len(X))
+    with metrics.phase("/predict_batch", "predict"):
+        # one vectorized call for the whole batch
+        proba = current.model.predict_proba(pd.DataFrame(X, columns=FEATURES))[:, 1]
+        codes = (proba > 0.5).astype(int)  # same threshold as model.predict
+
+    def result(i):
+        return {
+            "prediction": "Irrigation Needed" if codes[i] == 1 else "No Irrigation",
+            "prediction_code": int(codes[i]),
+            "probability": round(float(proba[i]), 4)
+        }
+
+    return stream_results(records, result, ndjson, "/predict_batch")
+
+def stream_results(records, result, ndjson, endpoint):
+    """Streamed response with result(i) for every record, in the request's format.
+    The serialize phase is timed over the whole body, pauses for the client included."""
+    def serialize(i):
+        row = {key: records[i][key] for key in PASSTHROUGH_KEYS if key in records[i]}
+        row.update(result(i))
+        return json.dumps(row)
+
+    def generate():
+        with metrics.phase(endpoint, "serialize"):
+            yield "" if ndjson else "["
+            for start in range(0, len(records), STREAM_CHUNK_SIZE):
+                chunk = [serialize(i) for i in range(start, min(start + STREAM_CHUNK_SIZE, len(records)))]
+                if ndjson:
+                    yield "\n".join(chunk) + "\n"
+                else:
+                    yield ("," if start else "") + ",".join(chunk)
+            yield "" if ndjson else "]"
+
+    mimetype = "application/x-ndjson" if ndjson else "application/json"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+def soil_health_unavailable():
+    return jsonify({"error": f"soil health pipeline not found at {SOIL_HEALTH_PIPELINE_PATH}"}), 503
+
+@app.route("/soil_health/predict", methods=["POST"])
+def predict_soil_health():
+    if soil_health is None:
+        return soil_health_unavailable()
+    with metrics.phase("/soil_health/predict", "parse"):
+        data = request.get_json()
+    with metrics.phase("/soil_health/predict", "predict"):
+        try:
+            score = float(soil_health.predict([data])[0])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    with metrics.phase("/soil_health/predict", "serialize"):
+        return jsonify({
+            "soil_health": round(score, 4),
+            "condition": condition(score),
+            "input_data": data
+        })
+
+@app.route("/soil_health/predict_batch", methods=["POST"])
+def predict_soil_health_batch():
+    if soil_health is None:
+        return soil_health_unavailable()
+    try:
+        with metrics.phase("/soil_health/predict_batch", "parse"):
+            records, ndjson = parse_batch(request.get_data(as_text=True), request.mimetype)
+        metrics.BATCH_ROWS.labels("/soil_health/predict_batch").observe(len(records))
+        with metrics.phase("/soil_health/predict_batch", "predict"):
+            # encoding, scaling and the forest in one vectorized call
+            scores = soil_health.predict(records)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def result(i):
+        return {"soil_health": round(float(scores[i]), 4), "condition": condition(scores[i])}
+
+    return stream_results(records, result, ndjson, "/soil_health/predict_batch")
+
+@app.route("/features/<farm_id>")
+def farm_features(farm_id):
+    """Rolling features of a farm as of its newest streamed reading (one primary-key lookup)."""
+    if feature_store is None:
+        return jsonify({"error": "no feature store configured (FEATURE_STORE_DSN)"}), 503
+    # imported here: only a configured feature store needs psycopg2
+    import psycopg2
+    try:
+        with metrics.phase("/features/<farm_id>", "lookup"):
+            features = feature_store.get(farm_id)
+    except (TimeoutError, psycopg2.Error):
+        # no free connection in time, or Postgres down: the details go to the log, not the client
+        app.logger.exception("feature lookup for farm %s failed", farm_id)
+        return jsonify({"error": "feature store unavailable, try again later"}), 503
+    if features is None:
+        return jsonify({"error": f"no features for farm {farm_id}"}), 404
+    return jsonify(features)
+
+@app.route("/cache/stats")
+def cache_stats():
+    """Hit/miss/eviction counters of the prediction cache (this process only)."""
+    return jsonify({"enabled": PREDICTION_CACHE, "model_version": current.version, **cache.stats()})
+
+@app.route("/reload", methods=["POST"])
+def reload():
+    """Reload the model (the registry's current version, or the model file) in this process now.
+
+    Under serve.py only the worker that receives the request reloads; promoting
+    a version in the registry is what reaches every worker (ModelWatcher)."""
+    if not RELOAD_TOKEN:
+        return jsonify({"error": "reload is disabled (RELOAD_TOKEN is not set)"}), 403
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(supplied.encode(), RELOAD_TOKEN.encode()):
+        return jsonify({"error": "invalid reload token"}), 401
+    loaded = swap_model(load_current())
+    return jsonify({"model_version": loaded.version, "pid": os.getpid()})
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint (all workers' values under serve.py)."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+@app.route("/model")
+def model_info():
+    """Version being served by this process, with its registry metadata when there is a registry."""
+    loaded = current
+    info = {"name": MODEL_NAME, "version": loaded.version}
+    if registry is not None and loaded.version in registry.versions(MODEL_NAME):
+        info["metadata"] = registry.metadata(MODEL_NAME, loaded.version)
+        info["registry_current"] = registry.current(MODEL_NAME)
+    return jsonify(info)
+
+@app.route("/batcher/stats")
+def batcher_stats():
+    """Batch size and queueing delay histograms of the micro-batcher (this process only)."""
+    return jsonify({"enabled": MICRO_BATCHING, **batcher.stats()})
+
+if __name__ == "__main__":
+    app.run(debug=True, use_reloader=False)
+    
@@ -0,0 +1,63 @@
+"""Per-call latency of a single irrigation prediction: pandas path vs fast path.
+
+    python benchmark_predict.py
+    python benchmark_predict.py --calls 20000 --model irrigation_model.pkl
+"""
+import argparse
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from fast_predict import FastPredictor
+
+SAMPLE = {
+    "soil_moisture": 24,
+    "temperature": 34,
+    "humidity": 30,
+    "rainfall": 0,
+    "sunlight_intensity": 900,
+    "soil_pH": 6.2
+}
+
+
+def time_calls(func, calls, warmup=200):
+    for _ in range(warmup):
+        func()
+    latencies = np.empty(calls)
+    for i in range(calls):
+        started = time.perf_counter()
+        func()
+        latencies[i] = time.perf_counter() - started
+    return latencies * 1e6  # microseconds
+
+
+def summary(name, latencies):
+    p50, p99 = np.percentile(latencies, [50, 99])
+    print(f"{name:<34}{latencies.mean():>10.1f}{p50:>10.1f}{p99:>10.1f}")
+    return latencies.mean()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="irrigation_model.pkl")
+    parser.add_argument("--calls", type=int, default=5000)
+    args = parser.parse_args()
+
+    with open(args.model, "rb") as f:
+        model = pickle.load(f)
+    fast = FastPredictor(model)
+
+    # both paths must agree before their speed is compared
+    assert int(model.predict(pd.DataFrame([SAMPLE]))[0]) == fast.predict(SAMPLE)
+
+    print(f"{args.calls} calls, latency in microseconds")
+    print(f"{'path':<34}{'mean':>10}{'p50':>10}{'p99':>10}")
+    before = summary("DataFrame + model.predict", time_calls(lambda: model.predict(pd.DataFrame([SAMPLE]))[0], args.calls))
+    after = summary("FastPredictor.predict", time_calls(lambda: fast.predict(SAMPLE), args.calls))
+    print(f"\nspeedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Single-reading fast path for the irrigation model.
+
+model.predict(pd.DataFrame([data])) spends most of its time building and
+validating a one-row DataFrame. Here the six features are validated straight
+into a preallocated float32 row and scored with the booster's inplace_predict.
+
+    python fast_predict.py check     # malformed readings are rejected with 400, not 500
+"""
+import argparse
+import json
+import math
+import os
+import pickle
+import threading
+
+import numpy as np
+
+# model input columns, in training order
+FEATURES = ["soil_moisture", "temperature", "humidity", "rainfall", "sunlight_intensity", "soil_pH"]
+
+
+class FastPredictor:
+    """Wraps a fitted binary XGBClassifier for one-reading-at-a-time scoring."""
+
+    def __init__(self, model):
+        self.booster = model.get_booster()
+        names = self.booster.feature_names
+        if names is not None and list(names) != FEATURES:
+            raise ValueError(f"model features {names} do not match {FEATURES}")
+        # same trees as model.predict when the model was trained with early stopping
+        try:
+            self.iteration_range = (0, model.best_iteration + 1)
+        except AttributeError:
+            self.iteration_range = (0, 0)
+        # one preallocated row per thread (Flask serves requests on several threads)
+        self._local = threading.local()
+
+    def _row(self):
+        row = getattr(self._local, "row", None)
+        if row is None:
+            row = self._local.row = np.empty((1, len(FEATURES)), dtype=np.float32)
+        return row
+
+    def features(self, data):
+        """Validate a reading (dict of numbers or numeric strings) into the thread's row."""
+        if not isinstance(data, dict):
+            raise ValueError(f"a reading must be a JSON object of features, got {type(data).__name__}")
+        row = self._row()
+        for i, name in enumerate(FEATURES):
+            try:
+                raw = data[name]
+            except KeyError:
+                raise ValueError(f"missing feature '{name}'")
+            try:
+                value = float(raw)
+            except (TypeError, ValueError):
+                raise ValueError(f"feature '{name}' must be a number, got {raw!r}")
+            if math.isinf(value):
+                raise ValueError(f"feature '{name}' must be finite")
+            row[0, i] = value
+        return row
+
+    def predict_proba(self, data):
+        """Probability that irrigation is needed."""
+        out = self.booster.inplace_predict(
+            self.features(data), iteration_range=self.iteration_range, validate_features=False)
+        return float(out[0])
+
+    def predict_proba_rows(self, X):
+        """Probabilities for an (n, 6) float32 array of already validated rows."""
+        return self.booster.inplace_predict(X, iteration_range=self.iteration_range, validate_features=False)
+
+    def predict(self, data):
+        """Same 0/1 decision as XGBClassifier.predict (probability > 0.5)."""
+        return int(self.predict_proba(data) > 0.5)
+
+
+# bodies /predict must answer with 400 and a message
+INVALID_BODIES = ["null", "[1, 2]", '"x"', "3", "{}", '{"soil_moisture": null}',
+                  '{"soil_moisture": [1], "temperature": 1, "humidity": 1, "rainfall": 0, '
+                  '"sunlight_intensity": 1, "soil_pH": 7}']
+# fields overriding a valid form post
+INVALID_FORMS = [{"soil_moisture": "abc"}, {"temperature": ""}]
+
+
+def check(model_path):
+    """Every body of INVALID_BODIES is a ValueError here and a 400 from /predict; a valid one is scored."""
+    with open(model_path, "rb") as f:
+        predictor = FastPredictor(pickle.load(f))
+    import app
+
+    client = app.app.test_client()
+    failures = []
+    for body in INVALID_BODIES:
+        try:
+            predictor.features(json.loads(body))
+            failures.append(f"{body}: accepted")
+        except ValueError:
+            pass
+        response = client.post("/predict", data=body, content_type="application/json")
+        if response.status_code != 400:
+            failures.append(f"{body}: /predict returned {response.status_code}")
+    valid = {"soil_moisture": 30, "temperature": 25, "humidity": 60, "rainfall": 0, "sunlight_intensity": 5,
+             "soil_pH": 6.5}
+    # the HTML form goes through the same validation
+    for form in INVALID_FORMS:
+        response = client.post("/predict", data={**{k: str(v) for k, v in valid.items()}, **form})
+        if response.status_code != 400:
+            failures.append(f"form {form}: /predict returned {response.status_code}")
+    missing = {k: str(v) for k, v in valid.items() if k != "soil_pH"}
+    if client.post("/predict", data=missing).status_code != 400:
+        failures.append("form without soil_pH: accepted")
+    if client.post("/predict", json=valid).status_code != 200:
+        failures.append("valid reading: not scored")
+    if client.post("/predict", data={k: str(v) for k, v in valid.items()}).status_code != 200:
+        failures.append("valid form: not scored")
+    if failures:
+        raise SystemExit("\n".join(failures))
+    print(f"{len(INVALID_BODIES)} invalid bodies and {len(INVALID_FORMS) + 1} invalid forms rejected with 400, "
+          "valid reading and form scored")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    chk = sub.add_parser("check", help="send malformed readings to the predictor and to /predict")
+    chk.add_argument("--model", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "irrigation_model.pkl"))
+    args = parser.parse_args(argv)
+    check(args.model)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Mergeable sketches of the irrigation model's input distributions, and drift scores between them.
+
+A Sketch counts one feature's values in logarithmic bins: a value x lands in
+bin ceil(log(|x|) / log(GAMMA)), signed like x, and values closer to 0 than
+MIN_VALUE share bin 0. Every value of a bin is within RELATIVE_ACCURACY of the
+bin's representative, so quantiles read from a sketch are accurate to 1% of
+the value whatever the range, and the bins need no fitting to the data.
+Since all sketches share the same bins, two sketches merge by adding their
+counts: days into weeks, farms into regions, stream batches into a total.
+
+Training saves a sketch of every feature next to the model
+(irrigation_model.pkl -> irrigation_model.baseline.json). Serving-side
+sketches are compared against it with PSI and the Kolmogorov-Smirnov
+statistic, computed from the counts alone.
+
+    python feature_sketch.py show irrigation_model.baseline.json
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# model input columns, in training order (as in irrigation_scoring.FEATURES)
+FEATURES = ["soil_moisture", "temperature", "humidity", "rainfall", "sunlight_intensity", "soil_pH"]
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = float(np.log(GAMMA))
+MIN_VALUE = 1e-3
+# bin index of MIN_VALUE: bins of |x| >= MIN_VALUE are shifted to start at 1
+OFFSET = int(np.ceil(np.log(MIN_VALUE) / LOG_GAMMA)) - 1
+# PSI above this is read as a significant shift (the usual rule of thumb; 0.1-0.2 is moderate)
+PSI_THRESHOLD = 0.2
+
+
+def bins(values):
+    """Bin index of every value (order-preserving); NaN values are dropped."""
+    x = np.asarray(values, dtype=np.float64)
+    x = x[~np.isnan(x)]
+    magnitude = np.abs(x)
+    index = np.zeros(len(x), dtype=np.int64)
+    large = magnitude >= MIN_VALUE
+    index[large] = np.ceil(np.log(magnitude[large]) / LOG_GAMMA).astype(np.int64) - OFFSET
+    return np.where(x < 0, -index, index)
+
+
+def bin_value(index):
+    """The value a bin stands for: within RELATIVE_ACCURACY of every value in it."""
+    index = np.asarray(index, dtype=np.int64)
+    magnitude = np.where(index == 0, 0.0, 2 * GAMMA ** (np.abs(index) + OFFSET) / (GAMMA + 1))
+    return np.sign(index) * magnitude
+
+
+class Sketch:
+    """Counts of a feature's values by bin, as sorted bin indexes and their counts."""
+
+    def __init__(self, index=(), counts=()):
+        self.index = np.asarray(index, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+    @classmethod
+    def of(cls, values):
+        index, counts = np.unique(bins(values), return_counts=True)
+        return cls(index, counts)
+
+    @classmethod
+    def merged(cls, sketches):
+        sketches = list(sketches)
+        if not sketches:
+            return cls()
+        index, inverse = np.unique(np.concatenate([s.index for s in sketches]), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([s.counts for s in sketches]), minlength=len(index))
+        return cls(index, counts.astype(np.int64))
+
+    def __add__(self, other):
+        return Sketch.merged([self, other])
+
+    def add(self, values):
+        """This sketch with values counted in."""
+        return self + Sketch.of(values)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def cdf(self, index):
+        """Share of the values in bins <= index."""
+        total = len(self)
+        if not total:
+            return np.zeros(len(np.atleast_1d(index)))
+        cumulative = np.concatenate([[0], np.cumsum(self.counts)])
+        return cumulative[np.searchsorted(self.index, index, side="right")] / total
+
+    def quantile(self, q):
+        """The q-quantile(s), to within RELATIVE_ACCURACY; NaN for an empty sketch."""
+        q = np.asarray(q, dtype=np.float64)
+        if not len(self):
+            return np.full(q.shape, np.nan)
+        # rank of the value, then the bin holding it (as numpy's "lower" quantile)
+        rank = np.floor(q * (len(self) - 1))
+        position = np.searchsorted(np.cumsum(self.counts), rank, side="right")
+        return bin_value(self.index[np.minimum(position, len(self.index) - 1)])
+
+    def to_dict(self):
+        return {"index": self.index.tolist(), "counts": self.counts.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["index"], data["counts"])
+
+
+def sketch_frame(frame, features=FEATURES):
+    """One Sketch per feature of a DataFrame's rows."""
+    return {feature: Sketch.of(frame[feature].to_numpy(dtype=np.float64, na_value=np.nan))
+            for feature in features}
+
+
+def merge_sketches(a, b):
+    """Feature-wise sum of two {feature: Sketch} dicts."""
+    return {feature: a.get(feature, Sketch()) + b.get(feature, Sketch()) for feature in {**a, **b}}
+
+
+def psi(expected, actual, buckets=10):
+    """Population stability index of actual against expected.
+
+    The buckets are expected's deciles (for buckets=10), rounded to whole bins,
+    so a feature with a spike (rainfall is 0 most of the time) gets fewer."""
+    if not len(expected) or not len(actual):
+        return np.nan
+    edges = np.unique(expected.index[np.minimum(
+        np.searchsorted(np.cumsum(expected.counts), np.arange(1, buckets) / buckets * len(expected)),
+        len(expected.index) - 1)])
+    e = np.diff(np.concatenate([[0], expected.cdf(edges), [1]]))
+    a = np.diff(np.concatenate([[0], actual.cdf(edges), [1]]))
+    # an empty bucket would make the index infinite
+    e, a = np.maximum(e, 1e-4), np.maximum(a, 1e-4)
+    return float(np.sum((a - e) * np.log(a / e)))
+
+
+def ks(expected, actual):
+    """Kolmogorov-Smirnov statistic: the largest gap between the two distribution functions, over all bins."""
+    if not len(expected) or not len(actual):
+        return np.nan
+    index = np.union1d(expected.index, actual.index)
+    return float(np.max(np.abs(expected.cdf(index) - actual.cdf(index))))
+
+
+def drift(expected, actual, features=FEATURES):
+    """Per feature: readings, PSI, KS and the medians of both sides."""
+    rows = []
+    for feature in features:
+        e, a = expected.get(feature, Sketch()), actual.get(feature, Sketch())
+        score = psi(e, a)
+        rows.append({"feature": feature, "readings": len(a), "psi": score, "ks": ks(e, a),
+                     "baseline_median": float(e.quantile(0.5)), "median": float(a.quantile(0.5)),
+                     "drifted": bool(score > PSI_THRESHOLD)})
+    return pd.DataFrame(rows)
+
+
+def baseline_path(model_path):
+    """Where the baseline of a model file is kept: irrigation_model.pkl -> irrigation_model.baseline.json."""
+    return os.path.splitext(model_path)[0] + ".baseline.json"
+
+
+def save_baseline(sketches, path, **info):
+    """Write {feature: Sketch} as JSON, with the bin parameters and any extra info (rows, source, ...)."""
+    data = {"relative_accuracy": RELATIVE_ACCURACY, "min_value": MIN_VALUE, **info,
+            "features": {feature: sketch.to_dict() for feature, sketch in sketches.items()}}
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return path
+
+
+def load_baseline(path):
+    """{feature: Sketch} of a saved baseline."""
+    with open(path) as f:
+        data = json.load(f)
+    if data["relative_accuracy"] != RELATIVE_ACCURACY or data["min_value"] != MIN_VALUE:
+        raise ValueError(f"{path} was sketched with relative accuracy {data['relative_accuracy']} and "
+                         f"min value {data['min_value']}, not {RELATIVE_ACCURACY} and {MIN_VALUE}")
+    return {feature: Sketch.from_dict(sketch) for feature, sketch in data["features"].items()}
+
+
+def describe(sketches):
+    """Readings and quartiles of every feature."""
+    return pd.DataFrame([{"feature": feature, "readings": len(sketch),
+                          **dict(zip(["p01", "p25", "p50", "p75", "p99"],
+                                     sketch.quantile([0.01, 0.25, 0.5, 0.75, 0.99])))}
+                         for feature, sketch in sketches.items()])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="quantiles of a saved baseline")
+    show.add_argument("path")
+    compare = commands.add_parser("compare", help="drift of one saved sketch against another")
+    compare.add_argument("baseline")
+    compare.add_argument("path")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "show":
+        print(describe(load_baseline(args.path)).to_string(index=False))
+    else:
+        print(drift(load_baseline(args.baseline), load_baseline(args.path)).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Online lookups of the rolling per-farm features.
+
+The streaming job keeps one row per farm in the Postgres table farm_features
+(scripts/farm_features.py: rain over the last 24 hours, moisture slope over
+the last hour, ...). Fetching a farm's features is a single primary-key
+lookup, so no window is recomputed per request.
+
+    store = FeatureStore("dbname=smart_farming user=admin password=password host=postgres")
+    store.get("farm_3")   # {"farm_id": "farm_3", "as_of": "...", "rain_24h": 12.5, ...} or None
+"""
+import datetime
+import os
+import threading
+
+TABLE = "farm_features"
+QUERY = f"SELECT * FROM {TABLE} WHERE farm_id = %s"
+
+
+class FeatureStore:
+    """A small connection pool per process (pools are not shared across serve.py's forked workers).
+
+    ThreadedConnectionPool raises PoolError when all its connections are in
+    use, so lookups wait for one on a semaphore of the same size instead: more
+    concurrent requests than max_connections queue rather than fail. serve.py
+    sizes it to the worker's thread count.
+    """
+
+    def __init__(self, dsn, max_connections=4, wait=10.0):
+        self.dsn = dsn
+        self.max_connections = max_connections
+        self.wait = wait
+        self._pool = None
+        self._slots = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def pool(self):
+        """(pool, semaphore) of this process, created on first use."""
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                from psycopg2.pool import ThreadedConnectionPool
+                self._pool = ThreadedConnectionPool(1, self.max_connections, self.dsn)
+                self._slots = threading.BoundedSemaphore(self.max_connections)
+                self._pid = os.getpid()
+            return self._pool, self._slots
+
+    def get(self, farm_id):
+        """The farm's features as of its newest streamed reading, or None for an unknown farm."""
+        pool, slots = self.pool()
+        if not slots.acquire(timeout=self.wait):
+            raise TimeoutError(f"no feature store connection free after {self.wait}s")
+        try:
+            return self._get(pool, farm_id)
+        finally:
+            slots.release()
+
+    def _get(self, pool, farm_id):
+        conn = pool.getconn()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(QUERY, (farm_id,))
+                row = cur.fetchone()
+                names = [d[0] for d in cur.description]
+        except Exception:
+            pool.putconn(conn, close=True)
+            raise
+        pool.putconn(conn)
+        if row is None:
+            return None
+        return {name: value.isoformat() if isinstance(value, datetime.datetime) else value
+                for name, value in zip(names, row)}
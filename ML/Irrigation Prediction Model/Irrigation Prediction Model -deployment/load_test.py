@@ -0,0 +1,110 @@
+"""Local load test: requests/sec of /predict as gunicorn workers scale.
+
+For every worker count a server is started with serve.py, hammered by
+concurrent client processes for a fixed duration, and stopped again.
+
+    python load_test.py --workers 1,2,4,8 --clients 16 --duration 15
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+READING = {
+    "soil_moisture": 24,
+    "temperature": 34,
+    "humidity": 30,
+    "rainfall": 0,
+    "sunlight_intensity": 900,
+    "soil_pH": 6.2
+}
+
+
+def client(port, duration, results):
+    """One client: back-to-back requests until the duration is over."""
+    body = json.dumps(READING)
+    headers = {"Content-Type": "application/json"}
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            conn.request("POST", "/predict", body, headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+    results.put((latencies, errors))
+
+
+def wait_until_up(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def run_level(workers, clients, duration, port):
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "serve.py"), "--workers", str(workers), "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(port)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=client, args=(port, duration, results)) for _ in range(clients)]
+        for p in procs:
+            p.start()
+        outcomes = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = np.array([lat for lats, _ in outcomes for lat in lats]) * 1000
+    errors = sum(e for _, e in outcomes)
+    return {
+        "workers": workers,
+        "requests_per_sec": len(latencies) / duration,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts to test")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent client processes")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per level")
+    parser.add_argument("--port", type=int, default=5055)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        r = run_level(workers, args.clients, args.duration, args.port)
+        p50 = f"{r['p50_ms']:.1f}" if r["p50_ms"] is not None else "-"
+        p99 = f"{r['p99_ms']:.1f}" if r["p99_ms"] is not None else "-"
+        print(f"{r['workers']:>8}{r['requests_per_sec']:>10.0f}{p50:>10}{p99:>10}{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Prometheus metrics of the prediction service, served by app.py at /metrics.
+
+Under serve.py every gunicorn worker is its own process, so the metrics go
+through prometheus_client's multiprocess mode: each process writes its values
+to files in PROMETHEUS_MULTIPROC_DIR (set up by serve.py) and /metrics adds
+them up, whichever worker answers the scrape.
+"""
+import os
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BATCH_ROWS_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536)
+
+REQUESTS = Counter(
+    "prediction_http_requests_total", "HTTP requests handled", ["endpoint", "method", "status"])
+REQUEST_SECONDS = Histogram(
+    "prediction_http_request_duration_seconds", "Time to the response being returned (streamed bodies excluded)",
+    ["endpoint"], buckets=LATENCY_BUCKETS)
+PHASE_SECONDS = Histogram(
+    "prediction_phase_duration_seconds", "Time per request phase (parse, predict, serialize)",
+    ["endpoint", "phase"], buckets=LATENCY_BUCKETS)
+IN_FLIGHT = Gauge(
+    "prediction_http_requests_in_flight", "Requests being handled, streamed responses included",
+    multiprocess_mode="livesum")
+BATCH_ROWS = Histogram(
+    "prediction_batch_rows", "Rows scored per model call, by batch endpoint or micro-batcher",
+    ["source"], buckets=BATCH_ROWS_BUCKETS)
+CACHE_LOOKUPS = Counter(
+    "prediction_cache_lookups_total", "Prediction cache lookups", ["result"])
+MODEL_INFO = Gauge(
+    "prediction_model_info", "1 for the model version a process serves, 0 for versions it served before",
+    ["model", "version"], multiprocess_mode="liveall")
+
+# (pid, model, version) last reported by this process
+_reported_model = None
+
+
+def phase(endpoint, name):
+    """Context manager timing one phase of a request."""
+    return PHASE_SECONDS.labels(endpoint, name).time()
+
+
+def report_model(model, version):
+    """Point prediction_model_info at the version this process serves now."""
+    global _reported_model
+    reported = (os.getpid(), model, version)
+    if reported == _reported_model:
+        return
+    if _reported_model is not None and _reported_model[0] == reported[0]:
+        MODEL_INFO.labels(*_reported_model[1:]).set(0)
+    MODEL_INFO.labels(model, version).set(1)
+    _reported_model = reported
+
+
+def render():
+    """(body, content type) of the /metrics response."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Drop the live gauges of a worker that exited (gunicorn child_exit hook)."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,137 @@
+"""Request coalescing for concurrent single predictions.
+
+Request threads put their feature row on a queue and wait. A background thread
+takes the first waiting row, keeps collecting until max_batch_size rows are
+queued or max_delay_ms has passed since that first row arrived, scores them all
+in one model call and hands each request its own result.
+"""
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import Future
+
+import numpy as np
+
+# histogram bucket upper bounds
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+DELAY_MS_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50, 100]
+
+
+class Histogram:
+    """Counts per bucket (value <= bound), with an overflow bucket at the end."""
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def snapshot(self):
+        labels = [str(b) for b in self.bounds] + ["+Inf"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.total,
+            "mean": self.sum / self.total if self.total else None,
+        }
+
+
+class _Pending:
+    __slots__ = ("row", "future", "enqueued")
+
+    def __init__(self, row):
+        self.row = row
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class MicroBatcher:
+    """Coalesces concurrent predict calls into batched model calls.
+
+    predict_batch takes an (n, n_features) float32 array and returns n results.
+    """
+
+    def __init__(self, predict_batch, n_features, max_batch_size=64, max_delay_ms=2.0):
+        self.predict_batch = predict_batch
+        self.n_features = n_features
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_delays_ms = Histogram(DELAY_MS_BUCKETS)
+
+    def _ensure_worker(self):
+        # threads do not survive fork, so each gunicorn worker starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    threading.Thread(target=self._loop, name="micro-batcher", daemon=True).start()
+                    self._pid = os.getpid()
+
+    def submit(self, row):
+        """Queue one feature row; returns a Future for its result."""
+        self._ensure_worker()
+        pending = _Pending(row)
+        self._queue.put(pending)
+        return pending.future
+
+    def predict(self, row, timeout=None):
+        return self.submit(row).result(timeout)
+
+    def _collect(self, q):
+        batch = [q.get()]
+        deadline = batch[0].enqueued + self.max_delay
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # take whatever is already waiting without blocking
+                try:
+                    while len(batch) < self.max_batch_size:
+                        batch.append(q.get_nowait())
+                except queue.Empty:
+                    pass
+                break
+            try:
+                batch.append(q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        q = self._queue
+        while True:
+            batch = self._collect(q)
+            dispatched = time.perf_counter()
+            X = np.empty((len(batch), self.n_features), dtype=np.float32)
+            for i, pending in enumerate(batch):
+                X[i] = pending.row
+            try:
+                results = self.predict_batch(X)
+            except Exception as e:
+                for pending in batch:
+                    pending.future.set_exception(e)
+            else:
+                for pending, result in zip(batch, results):
+                    pending.future.set_result(result)
+            with self._lock:
+                self.batch_sizes.observe(len(batch))
+                for pending in batch:
+                    self.queue_delays_ms.observe((dispatched - pending.enqueued) * 1000)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_delay_ms": self.max_delay * 1000,
+                "batch_size": self.batch_sizes.snapshot(),
+                "queue_delay_ms": self.queue_delays_ms.snapshot(),
+            }
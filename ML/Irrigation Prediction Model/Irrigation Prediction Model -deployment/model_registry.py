@@ -0,0 +1,187 @@
+"""Small file-based model registry.
+
+    registry/
+      irrigation/
+        versions/
+          v0001/  model.pkl  metadata.json
+          v0002/  ...
+        CURRENT          name of the version being served
+        history.jsonl    one line per promotion or rollback
+
+Versions are immutable once registered. Promoting a version only rewrites
+CURRENT (atomically, with os.replace), so a serving process that polls it
+either sees the old version or the new one, never a half-written file.
+
+    python model_registry.py register irrigation irrigation_model.pkl --metrics '{"accuracy": 0.97}' --promote
+    python model_registry.py list irrigation
+    python model_registry.py rollback irrigation
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+MODEL_FILE = "model.pkl"
+METADATA_FILE = "metadata.json"
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def _write_atomic(path, text):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    def __init__(self, root):
+        self.root = root
+
+    def _dir(self, name):
+        return os.path.join(self.root, name)
+
+    def _versions_dir(self, name):
+        return os.path.join(self._dir(name), "versions")
+
+    def model_path(self, name, version):
+        return os.path.join(self._versions_dir(name), version, MODEL_FILE)
+
+    def versions(self, name):
+        """Version names, oldest first."""
+        try:
+            return sorted(v for v in os.listdir(self._versions_dir(name)) if v.startswith("v"))
+        except FileNotFoundError:
+            return []
+
+    def metadata(self, name, version):
+        with open(os.path.join(self._versions_dir(name), version, METADATA_FILE)) as f:
+            return json.load(f)
+
+    def register(self, name, model_file, metrics=None, params=None, description=""):
+        """Copy model_file in as the next version; returns the version name."""
+        os.makedirs(self._versions_dir(name), exist_ok=True)
+        # build the version in a temporary directory and rename it into place,
+        # so readers never see a version without its model or metadata
+        staging = tempfile.mkdtemp(dir=self._versions_dir(name), prefix=".tmp-")
+        shutil.copyfile(model_file, os.path.join(staging, MODEL_FILE))
+        while True:
+            existing = self.versions(name)
+            version = f"v{int(existing[-1][1:]) + 1 if existing else 1:04d}"
+            metadata = {
+                "name": name,
+                "version": version,
+                "created_at": _now(),
+                "source": os.path.abspath(model_file),
+                "sha256": _sha256(model_file),
+                "metrics": metrics or {},
+                "params": params or {},
+                "description": description,
+            }
+            with open(os.path.join(staging, METADATA_FILE), "w") as f:
+                json.dump(metadata, f, indent=2)
+            try:
+                os.rename(staging, os.path.join(self._versions_dir(name), version))
+                return version
+            except OSError:
+                # another process registered the same version number first
+                if not os.path.isdir(os.path.join(self._versions_dir(name), version)):
+                    raise
+
+    def current(self, name):
+        """Version currently promoted, or None."""
+        try:
+            with open(os.path.join(self._dir(name), "CURRENT")) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def history(self, name):
+        try:
+            with open(os.path.join(self._dir(name), "history.jsonl")) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _set_current(self, name, version, action):
+        if version not in self.versions(name):
+            raise ValueError(f"{name} has no version '{version}'")
+        previous = self.current(name)
+        _write_atomic(os.path.join(self._dir(name), "CURRENT"), version + "\n")
+        with open(os.path.join(self._dir(name), "history.jsonl"), "a") as f:
+            f.write(json.dumps({"at": _now(), "action": action, "version": version, "previous": previous}) + "\n")
+
+    def promote(self, name, version):
+        self._set_current(name, version, "promote")
+
+    def rollback(self, name):
+        """Go back to the version that was current before the latest promotion."""
+        current = self.current(name)
+        for entry in reversed(self.history(name)):
+            if entry["version"] == current and entry["action"] == "promote" and entry["previous"]:
+                self._set_current(name, entry["previous"], "rollback")
+                return entry["previous"]
+        raise ValueError(f"{name} has nothing to roll back to")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", default=os.environ.get("MODEL_REGISTRY_DIR", "registry"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    register = sub.add_parser("register", help="add a model file as a new version")
+    register.add_argument("name")
+    register.add_argument("model_file")
+    register.add_argument("--metrics", default="{}", help="JSON object of training/validation metrics")
+    register.add_argument("--params", default="{}", help="JSON object of training parameters")
+    register.add_argument("--description", default="")
+    register.add_argument("--promote", action="store_true", help="also make it the current version")
+    listing = sub.add_parser("list", help="show versions and which one is current")
+    listing.add_argument("name")
+    promote = sub.add_parser("promote", help="make a version current")
+    promote.add_argument("name")
+    promote.add_argument("version")
+    rollback = sub.add_parser("rollback", help="go back to the previously promoted version")
+    rollback.add_argument("name")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    registry = ModelRegistry(args.root)
+    if args.command == "register":
+        version = registry.register(args.name, args.model_file, json.loads(args.metrics),
+                                    json.loads(args.params), args.description)
+        print(f"Registered {args.name} {version}")
+        if args.promote:
+            registry.promote(args.name, version)
+            print(f"Promoted {args.name} {version}")
+    elif args.command == "list":
+        current = registry.current(args.name)
+        for version in registry.versions(args.name):
+            meta = registry.metadata(args.name, version)
+            marker = "*" if version == current else " "
+            print(f"{marker} {version}  {meta['created_at']}  {json.dumps(meta['metrics'])}  {meta['description']}")
+    elif args.command == "promote":
+        registry.promote(args.name, args.version)
+        print(f"Promoted {args.name} {args.version}")
+    else:
+        print(f"Rolled {args.name} back to {registry.rollback(args.name)}")
+
+
+if __name__ == "__main__":
+    main()
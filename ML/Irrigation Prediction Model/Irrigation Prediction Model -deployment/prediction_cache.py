@@ -0,0 +1,108 @@
+"""Bounded LRU/TTL cache of irrigation predictions keyed on quantized features.
+
+Readings from the same farm barely change minute to minute, so each feature is
+rounded to a configurable resolution before it becomes part of the key and
+near-identical readings share one cached probability.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from fast_predict import FEATURES
+
+# default rounding step per feature, in the feature's own unit
+DEFAULT_RESOLUTIONS = {
+    "soil_moisture": 0.5,
+    "temperature": 0.5,
+    "humidity": 1.0,
+    "rainfall": 0.5,
+    "sunlight_intensity": 10.0,
+    "soil_pH": 0.05,
+}
+
+
+def parse_resolutions(text):
+    """'soil_moisture=1,temperature=0.25' -> defaults overridden by those values."""
+    resolutions = dict(DEFAULT_RESOLUTIONS)
+    for item in filter(None, (text or "").split(",")):
+        name, value = item.split("=")
+        if name.strip() not in resolutions:
+            raise ValueError(f"unknown feature '{name.strip()}'")
+        step = float(value)
+        # a zero step divides by zero in key(), a negative one mirrors the buckets
+        if not (step > 0 and math.isfinite(step)):
+            raise ValueError(f"resolution of '{name.strip()}' must be a positive number, got {value.strip()}")
+        resolutions[name.strip()] = step
+    return resolutions
+
+
+class PredictionCache:
+    def __init__(self, resolutions=None, max_entries=10000, ttl_seconds=300.0):
+        resolutions = resolutions or DEFAULT_RESOLUTIONS
+        self.steps = [resolutions[name] for name in FEATURES]
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def key(self, row, model_version):
+        """Key for a feature row (in FEATURES order) scored by model_version.
+
+        None for rows with missing (NaN) values, which are not cached."""
+        try:
+            return (model_version,) + tuple(round(float(v) / step) for v, step in zip(row, self.steps))
+        except ValueError:
+            return None
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires < now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop everything, e.g. because a new model was loaded."""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "resolutions": dict(zip(FEATURES, self.steps)),
+            }
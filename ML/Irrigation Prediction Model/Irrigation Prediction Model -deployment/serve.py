@@ -0,0 +1,109 @@
+"""Production launcher for the irrigation API: pre-fork gunicorn with a preloaded model.
+
+app.py (and irrigation_model.pkl) is imported once in the master process.
+The workers are forked from it afterwards and share the loaded model pages
+copy-on-write instead of each unpickling their own copy.
+
+    python serve.py                          # workers per core from WORKERS_PER_CORE (default 2)
+    python serve.py --workers 4 --timeout 10 --port 8000
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from gunicorn.app.base import BaseApplication
+
+DEFAULT_WORKERS_PER_CORE = 2
+
+
+def default_workers(per_core=None):
+    per_core = per_core or float(os.environ.get("WORKERS_PER_CORE", DEFAULT_WORKERS_PER_CORE))
+    return max(1, int(per_core * multiprocessing.cpu_count()))
+
+
+def post_fork(server, worker):
+    # XGBoost's OpenMP pool must not be shared across fork, and one thread per
+    # worker avoids oversubscribing the cores that the other workers use
+    # (models hot-swapped in later get the same setting through BOOSTER_PARAMS)
+    import app
+    app.BOOSTER_PARAMS["nthread"] = 1
+    app.current.model.get_booster().set_param(app.BOOSTER_PARAMS)
+    # one feature store connection per request thread; its pool is created in the worker on first use
+    if app.feature_store is not None:
+        app.feature_store.max_connections = max(server.cfg.threads, 1)
+
+
+def child_exit(server, worker):
+    # the in-flight gauge of a dead worker must not linger in /metrics
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+class IrrigationServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app import app
+        # objects created so far (the model above all) are moved out of the
+        # collector's generations so GC passes in the workers do not write to
+        # their pages and break copy-on-write sharing
+        gc.freeze()
+        return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the irrigation API with gunicorn.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: per core)")
+    parser.add_argument("--workers-per-core", type=float, help="workers per CPU core when --workers is not given")
+    parser.add_argument("--threads", type=int, default=1, help="threads per worker")
+    parser.add_argument("--timeout", type=int, default=30, help="seconds before a stuck request's worker is restarted")
+    parser.add_argument("--graceful-timeout", type=int, default=30)
+    parser.add_argument("--keepalive", type=int, default=5)
+    parser.add_argument("--max-requests", type=int, default=0, help="recycle workers after this many requests (0 = never)")
+    parser.add_argument("--access-log", action="store_true", help="log every request to stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    # workers write their metrics here and /metrics aggregates them; it has to
+    # be set before app.py (and prometheus_client) is imported, and start empty
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir)
+    else:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="irrigation-metrics-")
+    options = {
+        "bind": f"{args.host}:{args.port}",
+        "workers": args.workers or default_workers(args.workers_per_core),
+        "threads": args.threads,
+        "worker_class": "gthread" if args.threads > 1 else "sync",
+        "preload_app": True,
+        "timeout": args.timeout,
+        "graceful_timeout": args.graceful_timeout,
+        "keepalive": args.keepalive,
+        "max_requests": args.max_requests,
+        "max_requests_jitter": args.max_requests // 10,
+        "post_fork": post_fork,
+        "child_exit": child_exit,
+        "accesslog": "-" if args.access_log else None,
+    }
+    print(f"Serving on {options['bind']} with {options['workers']} workers")
+    IrrigationServer(options).run()
+
+
+if __name__ == "__main__":
+    main()
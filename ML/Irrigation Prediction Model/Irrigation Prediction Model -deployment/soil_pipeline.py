@@ -0,0 +1,172 @@
+"""Soil health model fused with its preprocessing into one artifact.
+
+Soil_Health_Index_Model.ipynb saves the forest, the StandardScaler and two
+LabelEncoders separately. SoilHealthPipeline keeps what those encoders and the
+scaler learned (category vocabularies, means, scales) next to the forest, so a
+whole batch of raw readings is encoded, scaled and scored in one call.
+
+    python soil_pipeline.py fuse --model soil_health_model.pkl --scaler soil_scaler.pkl \
+        --crop-encoder crop_encoder.pkl --region-encoder region_encoder.pkl \
+        --output soil_health_pipeline.pkl
+    python soil_pipeline.py check     # fuse small artifacts, load the file as app.py does
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import joblib
+import numpy as np
+import pandas as pd
+
+# model input columns, in training order
+NUMERIC_FEATURES = ["soil_pH", "soil_moisture", "temperature", "humidity", "rainfall", "pesticide_usage_ml"]
+CATEGORICAL_FEATURES = ["crop_type", "region"]
+FEATURES = NUMERIC_FEATURES + CATEGORICAL_FEATURES
+
+
+def condition(score):
+    """The notebook's reading of a soil health index."""
+    if score > 0.7:
+        return "Healthy"
+    if score > 0.4:
+        return "Moderate"
+    return "Poor"
+
+
+class SoilHealthPipeline:
+    """Label encoding + standard scaling + RandomForestRegressor as one object."""
+
+    def __init__(self, model, mean, scale, categories):
+        self.model = model
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        # sorted vocabularies, as in LabelEncoder.classes_: a value's code is its index
+        self.categories = {name: np.asarray(categories[name]) for name in CATEGORICAL_FEATURES}
+
+    @classmethod
+    def from_artifacts(cls, model, scaler, crop_encoder, region_encoder):
+        return cls(model, scaler.mean_, scaler.scale_,
+                   {"crop_type": crop_encoder.classes_, "region": region_encoder.classes_})
+
+    def save(self, path):
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path):
+        pipeline = joblib.load(path)
+        if not isinstance(pipeline, SoilHealthPipeline):
+            raise TypeError(f"{path} does not contain a SoilHealthPipeline")
+        return pipeline
+
+    def _column(self, records, name):
+        if isinstance(records, pd.DataFrame):
+            if name not in records:
+                raise ValueError(f"missing feature '{name}'")
+            return records[name].to_numpy()
+        values = []
+        for i, record in enumerate(records):
+            try:
+                values.append(record[name])
+            except (KeyError, TypeError):
+                raise ValueError(f"row {i}: missing feature '{name}'")
+        return np.asarray(values, dtype=object)
+
+    def _encode(self, values, name):
+        classes = self.categories[name]
+        values = values.astype(str)
+        codes = np.searchsorted(classes, values)
+        codes[codes == len(classes)] = 0
+        unknown = classes[codes] != values
+        if unknown.any():
+            i = int(np.argmax(unknown))
+            raise ValueError(f"row {i}: unknown {name} '{values[i]}' (expected one of {', '.join(classes)})")
+        return codes
+
+    def transform(self, records):
+        """Model input (n x 8) for a DataFrame or a list of reading dicts."""
+        X = np.empty((len(records), len(FEATURES)), dtype=np.float64)
+        for j, name in enumerate(NUMERIC_FEATURES):
+            try:
+                X[:, j] = self._column(records, name).astype(np.float64)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"feature '{name}' must be numeric ({e})")
+        X[:, :len(NUMERIC_FEATURES)] -= self.mean
+        X[:, :len(NUMERIC_FEATURES)] /= self.scale
+        for j, name in enumerate(CATEGORICAL_FEATURES, start=len(NUMERIC_FEATURES)):
+            X[:, j] = self._encode(self._column(records, name), name)
+        return X
+
+    def predict(self, records):
+        """Soil health index (0-1) for each reading."""
+        if not len(records):
+            return np.empty(0)
+        # the forest was fitted on a DataFrame, so it is given the same column names
+        return self.model.predict(pd.DataFrame(self.transform(records), columns=FEATURES))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    fuse = sub.add_parser("fuse", help="combine the notebook's four artifacts into one pipeline file")
+    fuse.add_argument("--model", default="soil_health_model.pkl")
+    fuse.add_argument("--scaler", default="soil_scaler.pkl")
+    fuse.add_argument("--crop-encoder", default="crop_encoder.pkl")
+    fuse.add_argument("--region-encoder", default="region_encoder.pkl")
+    fuse.add_argument("--output", default="soil_health_pipeline.pkl")
+    sub.add_parser("check", help="run fuse on small fitted artifacts and load the result through the module")
+    return parser.parse_args(argv)
+
+
+def fuse(model, scaler, crop_encoder, region_encoder, output):
+    # run as a script this module is __main__, and a pickle of __main__.SoilHealthPipeline
+    # can't be loaded by app.py or score_soil_health.py: pickle the importable module's class
+    from soil_pipeline import SoilHealthPipeline as Pipeline
+
+    Pipeline.from_artifacts(joblib.load(model), joblib.load(scaler),
+                            joblib.load(crop_encoder), joblib.load(region_encoder)).save(output)
+
+
+def check():
+    """Fit small artifacts, fuse them with the command line, load the file as the deployment does."""
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.uniform(0, 10, (200, len(NUMERIC_FEATURES))), columns=NUMERIC_FEATURES)
+    df["crop_type"] = rng.choice(["Rice", "Wheat"], len(df))
+    df["region"] = rng.choice(["NileDelta", "Sinai"], len(df))
+    X = df[FEATURES].copy()
+    crop, region, scaler = LabelEncoder(), LabelEncoder(), StandardScaler()
+    X["crop_type"] = crop.fit_transform(X["crop_type"])
+    X["region"] = region.fit_transform(X["region"])
+    X[NUMERIC_FEATURES] = scaler.fit_transform(X[NUMERIC_FEATURES])
+    model = RandomForestRegressor(n_estimators=5, max_depth=3, random_state=0).fit(X, rng.random(len(df)))
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {name: os.path.join(tmp, f"{name}.pkl") for name in ["model", "scaler", "crop", "region", "output"]}
+        for name, artifact in zip(paths, [model, scaler, crop, region]):
+            joblib.dump(artifact, paths[name])
+        subprocess.run([sys.executable, os.path.abspath(__file__), "fuse", "--model", paths["model"],
+                        "--scaler", paths["scaler"], "--crop-encoder", paths["crop"],
+                        "--region-encoder", paths["region"], "--output", paths["output"]], check=True)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import soil_pipeline
+
+        pipeline = soil_pipeline.SoilHealthPipeline.load(paths["output"])
+    if not np.allclose(pipeline.predict(df), model.predict(X)):
+        raise SystemExit("fused pipeline does not predict like its artifacts")
+    print(f"Loaded {type(pipeline).__module__}.{type(pipeline).__name__}; predictions match the artifacts")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "check":
+        check()
+        return
+    fuse(args.model, args.scaler, args.crop_encoder, args.region_encoder, args.output)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Vectorized irrigation labels for pandas and Spark DataFrames.
+
+Same rule as determine_irrigation_need in Irrigation_Prediction_Model.ipynb
+(a per-crop moisture threshold, raised in hot, dry or sunny weather, and no
+irrigation after rain), but computed a column at a time: the crop thresholds
+are an array lookup and the weather adjustments are masks, instead of a
+Python call per row.
+
+    from irrigation_labels import label_irrigation
+    final_df["irrigation_needed"] = label_irrigation(final_df)      # pandas
+    df = df.withColumn("irrigation_needed", label_irrigation(df))   # Spark
+
+`python irrigation_labels.py check` compares both with the notebook's own
+function, row for row, and times them.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+NOTEBOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Irrigation_Prediction_Model.ipynb")
+
+# base soil moisture thresholds per crop (in %)
+CROP_THRESHOLDS = {
+    "Potato": 60,
+    "Olive": 25,
+    "Barley": 25,
+    "Wheat": 20,
+    "Tomato": 30,
+    "Onion": 25,
+    "Corn": 25,
+    "Dates": 20,
+    "Peanuts": 30,
+    "Rice": 40,
+}
+DEFAULT_THRESHOLD = 25
+# (column, above/below, limit, added points); more water is needed when the condition holds
+ADJUSTMENTS = [
+    ("temperature", ">", 30, 3),          # hotter
+    ("humidity", "<", 40, 2),             # drier
+    ("sunlight_intensity", ">", 800, 2),  # high solar
+]
+RAIN_LIMIT = 2  # mm; no irrigation after more rain than this
+COLUMNS = ["crop_type", "soil_moisture", "rainfall", "temperature", "humidity", "sunlight_intensity"]
+
+_CROPS = pd.Index(list(CROP_THRESHOLDS))
+# thresholds by crop position, the default last for crops get_indexer does not find (-1)
+_THRESHOLDS = np.array(list(CROP_THRESHOLDS.values()) + [DEFAULT_THRESHOLD], dtype=np.float64)
+
+
+def _numbers(df, name):
+    return pd.to_numeric(df[name]).to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def label_pandas(df):
+    """irrigation_needed (0/1, int64) for every row of a pandas DataFrame, aligned with its index."""
+    threshold = _THRESHOLDS[_CROPS.get_indexer(df["crop_type"])]
+    # comparisons with NaN are False, as in the row-wise function
+    for name, op, limit, points in ADJUSTMENTS:
+        values = _numbers(df, name)
+        threshold += np.where(values > limit if op == ">" else values < limit, points, 0)
+    needed = (_numbers(df, "soil_moisture") < threshold) & ~(_numbers(df, "rainfall") > RAIN_LIMIT)
+    return pd.Series(needed.astype(np.int64), index=df.index, name="irrigation_needed")
+
+
+def label_column():
+    """irrigation_needed as a Spark Column expression over the input columns."""
+    from pyspark.sql import functions as F
+
+    def number(name):
+        # Spark orders NaN above every number; Python compares it as False, like a null here
+        c = F.col(name).cast("double")
+        return F.when(~F.isnan(c), c)
+
+    crop_map = F.create_map(*[F.lit(x) for kv in CROP_THRESHOLDS.items() for x in kv])
+    threshold = F.coalesce(crop_map[F.col("crop_type")], F.lit(DEFAULT_THRESHOLD))
+    for name, op, limit, points in ADJUSTMENTS:
+        value = number(name)
+        threshold = threshold + F.when(value > limit if op == ">" else value < limit, points).otherwise(0)
+    needed = F.coalesce(number("soil_moisture") < threshold, F.lit(False))
+    return F.when(number("rainfall") > RAIN_LIMIT, F.lit(0)).otherwise(needed.cast("int")).alias("irrigation_needed")
+
+
+def label_irrigation(df):
+    """Labels of a pandas DataFrame (as a Series) or of a Spark DataFrame (as a Column)."""
+    if isinstance(df, pd.DataFrame):
+        return label_pandas(df)
+    return label_column()
+
+
+def notebook_labeller(path=NOTEBOOK):
+    """determine_irrigation_need, taken from the notebook cell that defines it."""
+    with open(path, encoding="utf-8") as f:
+        cells = json.load(f)["cells"]
+    for cell in cells:
+        source = "".join(cell["source"])
+        if cell["cell_type"] == "code" and "def determine_irrigation_need" in source:
+            namespace = {}
+            exec(source, namespace)
+            return namespace["determine_irrigation_need"]
+    raise ValueError(f"{path} does not define determine_irrigation_need")
+
+
+def sample_readings(n_rows, seed=0):
+    """Readings around every edge of the rule: thresholds, limits, NaN and unknown crops."""
+    rng = np.random.default_rng(seed)
+    crops = list(CROP_THRESHOLDS) + ["Cotton", "potato", " Rice", None, np.nan]
+    weights = np.r_[np.full(len(CROP_THRESHOLDS), 0.9 / len(CROP_THRESHOLDS)), np.full(5, 0.02)]
+
+    def column(low, high, edges):
+        values = rng.uniform(low, high, n_rows)
+        values = np.where(rng.random(n_rows) < 0.3, rng.choice(edges, n_rows), values)
+        return np.where(rng.random(n_rows) < 0.02, np.nan, values)
+
+    moisture_edges = sorted({t + a for t in _THRESHOLDS for a in (0, 2, 3, 4, 5, 7)})
+    moisture_edges += [np.nextafter(x, -np.inf) for x in moisture_edges]
+    return pd.DataFrame({
+        "crop_type": rng.choice(np.array(crops, dtype=object), n_rows, p=weights),
+        "soil_moisture": column(0, 80, moisture_edges),
+        "rainfall": column(0, 10, [2, np.nextafter(2, np.inf), 0]),
+        "temperature": column(10, 45, [30, np.nextafter(30, np.inf)]),
+        "humidity": column(10, 90, [40, np.nextafter(40, -np.inf)]),
+        "sunlight_intensity": column(100, 1200, [800, np.nextafter(800, np.inf)]),
+    })
+
+
+def check(df, spark=None):
+    """Compare label_pandas (and label_column, given a SparkSession) with the notebook's function."""
+    reference = notebook_labeller()
+    start = time.perf_counter()
+    expected = df.apply(reference, axis=1).to_numpy(dtype=np.int64)
+    report = {"rows": len(df), "row_wise_seconds": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    labels = label_pandas(df).to_numpy()
+    report["pandas_seconds"] = time.perf_counter() - start
+    report["pandas_mismatches"] = int((labels != expected).sum())
+
+    if spark is not None:
+        crops = df["crop_type"].astype(object)
+        frame = df[COLUMNS].assign(crop_type=crops.where(crops.map(lambda v: isinstance(v, str)), None),
+                                   _row=np.arange(len(df)))
+        schema = ", ".join(["crop_type string"] + [f"{c} double" for c in COLUMNS[1:]] + ["_row long"])
+        sdf = spark.createDataFrame(frame, schema=schema)
+        start = time.perf_counter()
+        rows = sdf.select("_row", label_column()).toPandas().sort_values("_row")
+        report["spark_seconds"] = time.perf_counter() - start
+        report["spark_mismatches"] = int((rows["irrigation_needed"].to_numpy() != expected).sum())
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    chk = sub.add_parser("check", help="compare with the notebook's determine_irrigation_need")
+    chk.add_argument("--csv", help="readings to label (default: generated edge cases)")
+    chk.add_argument("--rows", type=int, default=200000, help="generated readings")
+    chk.add_argument("--seed", type=int, default=0)
+    chk.add_argument("--spark", action="store_true", help="also check the Spark expression (local[*])")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    df = pd.read_csv(args.csv) if args.csv else sample_readings(args.rows, args.seed)
+    spark = None
+    if args.spark:
+        from pyspark.sql import SparkSession
+        spark = SparkSession.builder.master("local[*]").appName("irrigation_labels_check").getOrCreate()
+    report = check(df, spark)
+    for key, value in report.items():
+        print(f"{key:>20}: {value:.3f}" if isinstance(value, float) else f"{key:>20}: {value}")
+    print(f"{'speedup (pandas)':>20}: {report['row_wise_seconds'] / report['pandas_seconds']:.0f}x")
+    if report["pandas_mismatches"] or report.get("spark_mismatches"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""The soil health index as a formula: NumPy, Spark and SQL.
+
+Soil_Health_Index_Model.ipynb defines the index it trains the forest on in
+closed form:
+
+    soil_health = clip(1 - (|soil_pH - 6.5| / 2 + pesticide_usage_ml / 100 + |soil_moisture - 50| / 50), 0, 1)
+
+so it can be computed exactly instead of approximated by 200 trees. The same
+expression is provided for NumPy/pandas, as a Spark Column (the stream and the
+ETL add it to every reading) and as a SQL function for Postgres and MySQL.
+A missing input gives a missing index (NaN, null or NULL).
+
+    python soil_health_index.py sql mysql | mysql -h mysql -u root -p farm_dwh
+    python soil_health_index.py check [--spark]          # exact against the notebook's cells
+    python soil_health_index.py compare soil_health_pipeline.pkl farming_data.csv
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+NOTEBOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Soil_Health_Index_Model.ipynb")
+INPUTS = ["soil_pH", "pesticide_usage_ml", "soil_moisture"]
+
+PH_OPTIMUM, PH_RANGE = 6.5, 2
+PESTICIDE_RANGE = 100
+MOISTURE_OPTIMUM, MOISTURE_RANGE = 50, 50
+
+# the terms are added in the notebook's order, so results match it bit for bit
+SQL_FUNCTIONS = {
+    # STRICT: NULL for a NULL input (Postgres' GREATEST and LEAST skip NULLs)
+    "postgres": f"""
+CREATE OR REPLACE FUNCTION soil_health_index(soil_ph DOUBLE PRECISION, pesticide_usage_ml DOUBLE PRECISION,
+                                             soil_moisture DOUBLE PRECISION)
+RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+AS $$
+    SELECT GREATEST(0, LEAST(1, 1 - (ABS(soil_ph - {PH_OPTIMUM}) / {PH_RANGE}
+                                     + pesticide_usage_ml / {PESTICIDE_RANGE}
+                                     + ABS(soil_moisture - {MOISTURE_OPTIMUM}) / {MOISTURE_RANGE})))
+$$;
+""",
+    "mysql": f"""
+DROP FUNCTION IF EXISTS soil_health_index;
+CREATE FUNCTION soil_health_index(soil_ph DOUBLE, pesticide_usage_ml DOUBLE, soil_moisture DOUBLE)
+RETURNS DOUBLE DETERMINISTIC NO SQL
+RETURN GREATEST(0, LEAST(1, 1 - (ABS(soil_ph - {PH_OPTIMUM}) / {PH_RANGE}
+                                 + pesticide_usage_ml / {PESTICIDE_RANGE}
+                                 + ABS(soil_moisture - {MOISTURE_OPTIMUM}) / {MOISTURE_RANGE})));
+""",
+}
+
+
+def soil_health_index(soil_pH, pesticide_usage_ml, soil_moisture):
+    """The index of scalars, arrays or pandas Series (NaN where an input is NaN)."""
+    raw = 1 - (np.abs(soil_pH - PH_OPTIMUM) / PH_RANGE + pesticide_usage_ml / PESTICIDE_RANGE
+               + np.abs(soil_moisture - MOISTURE_OPTIMUM) / MOISTURE_RANGE)
+    return np.clip(raw, 0, 1)
+
+
+def soil_health_index_frame(df):
+    """The index of every row of a pandas DataFrame with the three input columns."""
+    return soil_health_index(df["soil_pH"].astype(float), df["pesticide_usage_ml"].astype(float),
+                             df["soil_moisture"].astype(float)).rename("soil_health_index")
+
+
+def soil_health_index_column():
+    """The index as a Spark Column over soil_pH, pesticide_usage_ml and soil_moisture."""
+    from pyspark.sql import functions as F
+
+    def number(name):
+        # NaN counts as missing: Spark would order it above 1 and clip it to 1
+        c = F.col(name).cast("double")
+        return F.when(~F.isnan(c), c)
+
+    raw = 1 - (F.abs(number("soil_pH") - PH_OPTIMUM) / PH_RANGE + number("pesticide_usage_ml") / PESTICIDE_RANGE
+               + F.abs(number("soil_moisture") - MOISTURE_OPTIMUM) / MOISTURE_RANGE)
+    # not greatest/least, which skip nulls
+    return F.when(raw < 0, 0.0).when(raw > 1, 1.0).otherwise(raw).alias("soil_health_index")
+
+
+def notebook_index(df, path=NOTEBOOK):
+    """soil_health of df computed by the notebook's own target cells."""
+    with open(path, encoding="utf-8") as f:
+        cells = [("".join(c["source"])) for c in json.load(f)["cells"] if c["cell_type"] == "code"]
+    namespace = {"df": df.copy()}
+    for source in cells:
+        if 'df["soil_health"] =' in source:
+            exec(source, namespace)
+    if "soil_health" not in namespace["df"]:
+        raise ValueError(f"{path} does not compute soil_health")
+    return namespace["df"]["soil_health"]
+
+
+def sample_readings(n_rows, seed=0):
+    """Readings covering both clipping bounds, the optimum and missing values."""
+    rng = np.random.default_rng(seed)
+
+    def column(low, high, edges):
+        values = np.where(rng.random(n_rows) < 0.2, rng.choice(edges, n_rows), rng.uniform(low, high, n_rows))
+        return np.where(rng.random(n_rows) < 0.02, np.nan, values)
+
+    return pd.DataFrame({
+        "soil_pH": column(3, 10, [PH_OPTIMUM, 4.5, 8.5]),
+        "pesticide_usage_ml": column(0, 120, [0, 100]),
+        "soil_moisture": column(0, 100, [MOISTURE_OPTIMUM, 0, 100]),
+    })
+
+
+def check(df, spark=None):
+    """Count rows where the NumPy (and Spark) index differs from the notebook's."""
+    expected = notebook_index(df).to_numpy()
+    report = {"rows": len(df)}
+
+    def mismatches(values):
+        values = np.asarray(values, dtype=np.float64)
+        return int(np.sum(~((values == expected) | (np.isnan(values) & np.isnan(expected)))))
+
+    report["numpy_mismatches"] = mismatches(soil_health_index_frame(df))
+    if spark is not None:
+        frame = df[INPUTS].astype(float).assign(_row=np.arange(len(df)))
+        sdf = spark.createDataFrame(frame, schema=", ".join([f"{c} double" for c in INPUTS] + ["_row long"]))
+        rows = sdf.select("_row", soil_health_index_column()).toPandas().sort_values("_row")
+        report["spark_mismatches"] = mismatches(rows["soil_health_index"].astype(float))
+    return report
+
+
+def compare(pipeline_path, df):
+    """How far the fused forest pipeline is from the exact index, and what each costs."""
+    deployment = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Irrigation Prediction Model",
+                              "Irrigation Prediction Model -deployment")
+    sys.path.append(deployment)
+    import soil_pipeline
+
+    pipeline = soil_pipeline.SoilHealthPipeline.load(pipeline_path)
+    df = df.dropna(subset=soil_pipeline.FEATURES)
+    for name in soil_pipeline.CATEGORICAL_FEATURES:
+        df = df[df[name].isin(pipeline.categories[name])]
+    started = time.perf_counter()
+    exact = soil_health_index_frame(df).to_numpy()
+    exact_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    predicted = pipeline.predict(df)
+    model_seconds = time.perf_counter() - started
+    error = np.abs(predicted - exact)
+    same_condition = np.mean([soil_pipeline.condition(a) == soil_pipeline.condition(b)
+                              for a, b in zip(exact, predicted)])
+    return {"rows": len(df), "mae": float(error.mean()), "max_error": float(error.max()),
+            "same_condition": float(same_condition), "formula_seconds": exact_seconds,
+            "model_seconds": model_seconds}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    sql = sub.add_parser("sql", help="print the CREATE FUNCTION statement")
+    sql.add_argument("dialect", choices=sorted(SQL_FUNCTIONS))
+    chk = sub.add_parser("check", help="compare with the notebook's soil_health cells")
+    chk.add_argument("--csv", help="readings (default: generated edge cases)")
+    chk.add_argument("--rows", type=int, default=200000)
+    chk.add_argument("--spark", action="store_true", help="also check the Spark expression (local[*])")
+    cmp = sub.add_parser("compare", help="error and speed of the forest pipeline against the formula")
+    cmp.add_argument("pipeline", help="soil_health_pipeline.pkl")
+    cmp.add_argument("csv", help="readings with all eight model inputs")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "sql":
+        print(SQL_FUNCTIONS[args.dialect].strip())
+        return
+    if args.command == "compare":
+        print(json.dumps(compare(args.pipeline, pd.read_csv(args.csv)), indent=2))
+        return
+    df = pd.read_csv(args.csv, usecols=INPUTS) if args.csv else sample_readings(args.rows)
+    spark = None
+    if args.spark:
+        from pyspark.sql import SparkSession
+        spark = SparkSession.builder.master("local[*]").appName("soil_health_index_check").getOrCreate()
+    report = check(df, spark)
+    print(json.dumps(report, indent=2))
+    if report["numpy_mismatches"] or report.get("spark_mismatches"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
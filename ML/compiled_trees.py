@@ -0,0 +1,437 @@
+"""Compiled, NumPy-only form of the project's tree-ensemble models.
+
+The irrigation XGBClassifier and the soil health RandomForestRegressor are
+flattened into a few node arrays (feature, threshold, left/right child, default
+direction for missing values, leaf value) and saved as one .npz file. Loading
+and scoring that file only needs NumPy, and all trees are walked together, one
+level per step, for a whole block of rows at a time.
+
+    python compiled_trees.py export irrigation_model.pkl irrigation_model.npz
+    python compiled_trees.py export soil_health_model.pkl soil_health_model.npz
+    python compiled_trees.py benchmark irrigation_model.pkl irrigation_model.npz --rows 100000
+"""
+import argparse
+import json
+import os
+import pickle
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 1
+# rows scored per step; bounds the (rows x trees) node index matrix
+BLOCK_ROWS = 1024
+
+
+class CompiledEnsemble:
+    """A tree ensemble as flat node arrays.
+
+    Every tree's nodes live in the same arrays, and children are global node
+    indices; leaves point at themselves. A row goes left when x <= threshold,
+    or when x is missing and default_left is set.
+
+    kind is "binary_logistic" (probability = sigmoid(base_margin + sum of
+    leaves)) or "mean" (average of leaves, as in a random forest).
+
+    For scoring, trees up to PERFECT_MAX_DEPTH deep are padded to complete
+    binary trees, so a node's children are found arithmetically (2i+1, 2i+2)
+    instead of through the child arrays.
+    """
+
+    PERFECT_MAX_DEPTH = 14
+
+    def __init__(self, kind, feature, threshold, left, right, default_left, value, roots,
+                 max_depth, base_margin=0.0, feature_names=None):
+        if kind not in ("binary_logistic", "mean"):
+            raise ValueError(f"unknown ensemble kind '{kind}'")
+        self.kind = kind
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float32)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.max_depth = int(max_depth)
+        self.base_margin = float(base_margin)
+        self.feature_names = list(feature_names) if feature_names is not None else None
+        self._perfect = self._expand() if 0 < self.max_depth <= self.PERFECT_MAX_DEPTH else None
+
+    def _expand(self):
+        """Per-tree complete binary trees of depth max_depth, as flat arrays.
+
+        A leaf above the last level is repeated down to it: its copies have an
+        infinite threshold (everything goes left) and all of its bottom-level
+        descendants carry its value."""
+        level = self.roots[:, None]
+        features, thresholds, default_left = [], [], []
+        for _ in range(self.max_depth):
+            leaf = self.left[level] == level
+            features.append(np.where(leaf, 0, self.feature[level]))
+            thresholds.append(np.where(leaf, np.float32(np.inf), self.threshold[level]))
+            default_left.append(leaf | self.default_left[level])
+            level = np.stack([self.left[level], self.right[level]], axis=2).reshape(self.n_trees, -1)
+        return (
+            np.concatenate(features, axis=1).astype(np.intp).ravel(),
+            np.concatenate(thresholds, axis=1).ravel(),
+            np.concatenate(default_left, axis=1).ravel(),
+            self.value[level].ravel(),
+        )
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            format_version=FORMAT_VERSION,
+            kind=self.kind,
+            feature=self.feature,
+            threshold=self.threshold,
+            left=self.left,
+            right=self.right,
+            default_left=self.default_left,
+            value=self.value,
+            roots=self.roots,
+            max_depth=self.max_depth,
+            base_margin=self.base_margin,
+            feature_names=np.array(self.feature_names or [], dtype=str),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data["format_version"]) != FORMAT_VERSION:
+                raise ValueError(f"{path}: unsupported format version {int(data['format_version'])}")
+            names = [str(n) for n in data["feature_names"]]
+            return cls(
+                str(data["kind"]), data["feature"], data["threshold"], data["left"], data["right"],
+                data["default_left"], data["value"], data["roots"], int(data["max_depth"]),
+                float(data["base_margin"]), names or None,
+            )
+
+    def _matrix(self, X):
+        if hasattr(X, "columns") and self.feature_names:
+            X = X[self.feature_names]
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or (self.feature.size and X.shape[1] <= self.feature.max()):
+            raise ValueError(f"expected a 2-D array with {len(self.feature_names or [])} columns, got shape {X.shape}")
+        return X
+
+    def _leaf_sums(self, X):
+        out = np.empty(len(X), dtype=np.float64)
+        has_missing = bool(np.isnan(X).any())
+        walk = self._walk_perfect if self._perfect is not None else self._walk_nodes
+        for start in range(0, len(X), BLOCK_ROWS):
+            block = X[start:start + BLOCK_ROWS]
+            out[start:start + len(block)] = walk(block, has_missing)
+        return out
+
+    def _walk_perfect(self, block, has_missing):
+        feature, threshold, default_left, leaves = self._perfect
+        inner = 2 ** self.max_depth - 1
+        n, n_features = block.shape
+        flat = block.ravel()
+        row_offset = (np.arange(n) * n_features)[:, None]
+        tree_offset = (np.arange(self.n_trees) * inner)[None, :]
+        position = np.zeros((n, self.n_trees), dtype=np.intp)
+        for _ in range(self.max_depth):
+            node = tree_offset + position
+            x = flat[row_offset + feature[node]]
+            go_right = x > threshold[node]
+            if has_missing:
+                go_right |= np.isnan(x) & ~default_left[node]
+            position = 2 * position + 1 + go_right
+        # bottom-level positions run from inner to 2 * inner
+        leaf = (np.arange(self.n_trees) * (inner + 1))[None, :] + position - inner
+        return leaves[leaf].sum(axis=1)
+
+    def _walk_nodes(self, block, has_missing):
+        node = np.broadcast_to(self.roots, (len(block), self.n_trees))
+        for _ in range(self.max_depth):
+            x = np.take_along_axis(block, self.feature[node], axis=1)
+            go_left = x <= self.threshold[node]
+            if has_missing:
+                go_left |= np.isnan(x) & self.default_left[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return self.value[node].sum(axis=1)
+
+    def predict_raw(self, X):
+        """Margin (binary_logistic) or mean leaf value (mean) per row."""
+        sums = self._leaf_sums(self._matrix(X))
+        if self.kind == "mean":
+            return sums / self.n_trees
+        return sums + self.base_margin
+
+    def predict_proba(self, X):
+        """Probability of the positive class, for binary_logistic ensembles."""
+        if self.kind != "binary_logistic":
+            raise ValueError("predict_proba needs a binary_logistic ensemble")
+        return 1.0 / (1.0 + np.exp(-self.predict_raw(X)))
+
+    def predict(self, X):
+        """0/1 like XGBClassifier.predict, or the regression value like RandomForestRegressor.predict."""
+        if self.kind == "binary_logistic":
+            return (self.predict_proba(X) > 0.5).astype(np.int64)
+        return self.predict_raw(X)
+
+
+def _tree_depth(left, right, root=0):
+    depth, level = 0, [root]
+    while True:
+        children = [c for n in level if left[n] != -1 for c in (left[n], right[n])]
+        if not children:
+            return depth
+        depth, level = depth + 1, children
+
+
+def from_xgboost(model):
+    """Compile a binary:logistic XGBClassifier (or Booster) with numeric splits."""
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    learner = json.loads(booster.save_raw("json"))["learner"]
+    objective = learner["objective"]["name"]
+    if objective != "binary:logistic":
+        raise ValueError(f"only binary:logistic models are supported, got {objective}")
+    gbm = learner["gradient_booster"]
+    if gbm["name"] != "gbtree":
+        raise ValueError(f"only gbtree boosters are supported, got {gbm['name']}")
+    trees = gbm["model"]["trees"]
+    # honour early stopping the same way XGBClassifier.predict does
+    best_iteration = getattr(model, "best_iteration", None) if hasattr(model, "get_booster") else None
+    if best_iteration is not None:
+        per_round = int(gbm["model"]["gbtree_model_param"]["num_parallel_tree"])
+        trees = trees[:(best_iteration + 1) * per_round]
+
+    base_score = float(learner["learner_model_param"]["base_score"].strip("[]"))
+    base_margin = float(np.log(base_score / (1.0 - base_score)))
+
+    parts, roots, offset, max_depth = [], [], 0, 0
+    for tree in trees:
+        if any(tree["split_type"]):
+            raise ValueError("categorical splits are not supported")
+        left = np.array(tree["left_children"], dtype=np.int64)
+        right = np.array(tree["right_children"], dtype=np.int64)
+        cond = np.array(tree["split_conditions"], dtype=np.float32)
+        leaf = left == -1
+        nodes = np.arange(len(left))
+        # XGBoost goes left on x < cond; the largest float32 below cond turns
+        # that into the x <= threshold test used for every ensemble here
+        threshold = np.where(leaf, 0, np.nextafter(cond, np.float32(-np.inf)))
+        parts.append((
+            np.where(leaf, 0, tree["split_indices"]),
+            threshold,
+            np.where(leaf, nodes, left) + offset,
+            np.where(leaf, nodes, right) + offset,
+            np.array(tree["default_left"], dtype=bool),
+            # leaf weights are stored in split_conditions
+            np.where(leaf, cond, 0),
+        ))
+        roots.append(offset)
+        offset += len(left)
+        max_depth = max(max_depth, _tree_depth(left, right))
+
+    columns = [np.concatenate(col) for col in zip(*parts)]
+    return CompiledEnsemble("binary_logistic", *columns, roots, max_depth, base_margin, booster.feature_names)
+
+
+def from_sklearn_forest(model):
+    """Compile a fitted RandomForestRegressor (or any sklearn tree regressor ensemble)."""
+    parts, roots, offset, max_depth = [], [], 0, 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        left = tree.children_left.astype(np.int64)
+        right = tree.children_right.astype(np.int64)
+        leaf = left == -1
+        nodes = np.arange(tree.node_count)
+        # sklearn compares float32 inputs against float64 thresholds; rounding
+        # the threshold down to float32 keeps every x <= threshold outcome
+        threshold = tree.threshold.astype(np.float32)
+        threshold = np.where(threshold > tree.threshold, np.nextafter(threshold, np.float32(-np.inf)), threshold)
+        missing_left = getattr(tree, "missing_go_to_left", np.zeros(tree.node_count, dtype=np.uint8))
+        parts.append((
+            np.where(leaf, 0, tree.feature),
+            np.where(leaf, 0, threshold),
+            np.where(leaf, nodes, left) + offset,
+            np.where(leaf, nodes, right) + offset,
+            missing_left.astype(bool),
+            np.where(leaf, tree.value[:, 0, 0], 0),
+        ))
+        roots.append(offset)
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    names = getattr(model, "feature_names_in_", None)
+    columns = [np.concatenate(col) for col in zip(*parts)]
+    return CompiledEnsemble("mean", *columns, roots, max_depth, feature_names=names)
+
+
+def load_pickled_model(path):
+    """Load a model pickled with pickle or joblib."""
+    try:
+        import joblib
+        return joblib.load(path)
+    except ImportError:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def compile_model(model):
+    if hasattr(model, "get_booster"):
+        return from_xgboost(model)
+    if hasattr(model, "estimators_"):
+        return from_sklearn_forest(model)
+    raise TypeError(f"don't know how to compile {type(model).__name__}")
+
+
+def reference_predict(model, X):
+    """What the original model reports: probability for classifiers, value for regressors."""
+    if hasattr(model, "predict_proba"):
+        return model.predict_proba(X)[:, 1]
+    return model.predict(X)
+
+
+def compiled_predict(compiled, X):
+    return compiled.predict_proba(X) if compiled.kind == "binary_logistic" else compiled.predict(X)
+
+
+def cold_start_seconds(snippet, repeats):
+    """Median wall time of a fresh interpreter importing and loading a model."""
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-W", "ignore", "-c", snippet], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - started)
+    return float(np.median(times))
+
+
+def rows_per_second(predict, X, min_seconds=1.0):
+    predict(X[:100])  # warm-up
+    calls, started = 0, time.perf_counter()
+    while True:
+        predict(X)
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return calls * len(X) / elapsed
+
+
+def single_row_microseconds(predict, rows, calls=200):
+    predict(rows[0])  # warm-up
+    started = time.perf_counter()
+    for i in range(calls):
+        predict(rows[i % len(rows)])
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def sample_rows(compiled, n_rows, seed):
+    """Random inputs spread over the range of values the trees split on."""
+    rng = np.random.default_rng(seed)
+    n_features = int(compiled.feature.max()) + 1
+    X = np.empty((n_rows, n_features), dtype=np.float32)
+    internal = compiled.left != np.arange(compiled.n_nodes)
+    for j in range(n_features):
+        cuts = compiled.threshold[internal & (compiled.feature == j)]
+        low, high = (cuts.min(), cuts.max()) if cuts.size else (0.0, 1.0)
+        margin = (high - low) * 0.1 + 1e-3
+        X[:, j] = rng.uniform(low - margin, high + margin, n_rows)
+    return X
+
+
+def benchmark(model_path, compiled_path, n_rows=100000, seed=0, repeats=3):
+    model = load_pickled_model(model_path)
+    compiled = CompiledEnsemble.load(compiled_path)
+    X = sample_rows(compiled, n_rows, seed)
+    frame = X
+    if compiled.feature_names:
+        import pandas as pd
+        frame = pd.DataFrame(X, columns=compiled.feature_names)
+
+    expected = reference_predict(model, frame)
+    actual = compiled_predict(compiled, X)
+    frame_rows = [frame[i:i + 1] for i in range(100)]
+    array_rows = [X[i:i + 1] for i in range(100)]
+    here = os.path.dirname(os.path.abspath(__file__))
+    return {
+        "model": model_path,
+        "trees": compiled.n_trees,
+        "nodes": compiled.n_nodes,
+        "max_depth": compiled.max_depth,
+        "max_abs_diff": float(np.max(np.abs(expected - actual))),
+        "size_bytes": {"original": os.path.getsize(model_path), "compiled": os.path.getsize(compiled_path)},
+        "cold_start_s": {
+            "original": cold_start_seconds(
+                f"import sys; sys.path.insert(0, {here!r}); import compiled_trees; "
+                f"compiled_trees.load_pickled_model({os.path.abspath(model_path)!r})", repeats),
+            "compiled": cold_start_seconds(
+                f"import sys; sys.path.insert(0, {here!r}); import compiled_trees; "
+                f"compiled_trees.CompiledEnsemble.load({os.path.abspath(compiled_path)!r})", repeats),
+        },
+        "rows_per_sec": {
+            "original": rows_per_second(lambda _: reference_predict(model, frame), X),
+            "compiled": rows_per_second(lambda rows: compiled_predict(compiled, rows), X),
+        },
+        "single_row_us": {
+            "original": single_row_microseconds(lambda row: reference_predict(model, row), frame_rows),
+            "compiled": single_row_microseconds(lambda row: compiled_predict(compiled, row), array_rows),
+        },
+    }
+
+
+def print_report(r):
+    print(f"{r['model']}: {r['trees']} trees, {r['nodes']} nodes, depth {r['max_depth']}")
+    print(f"  max |original - compiled| = {r['max_abs_diff']:.2e}")
+    print(f"{'':>16}{'original':>14}{'compiled':>14}")
+    size, cold, speed = r["size_bytes"], r["cold_start_s"], r["rows_per_sec"]
+    print(f"{'size (KB)':>16}{size['original'] / 1024:>14.1f}{size['compiled'] / 1024:>14.1f}")
+    print(f"{'cold start (s)':>16}{cold['original']:>14.3f}{cold['compiled']:>14.3f}")
+    print(f"{'rows/sec':>16}{speed['original']:>14,.0f}{speed['compiled']:>14,.0f}")
+    single = r["single_row_us"]
+    print(f"{'1-row call (us)':>16}{single['original']:>14.0f}{single['compiled']:>14.0f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="compile a pickled model to .npz")
+    export.add_argument("model", help="pickled XGBClassifier or RandomForestRegressor")
+    export.add_argument("output", help="where to write the .npz file")
+    bench = sub.add_parser("benchmark", help="compare a compiled model with its original")
+    bench.add_argument("model")
+    bench.add_argument("compiled")
+    bench.add_argument("--rows", type=int, default=100000, help="rows scored per throughput call")
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--repeats", type=int, default=3, help="cold starts to time per model")
+    bench.add_argument("--tolerance", type=float, default=1e-5, help="fail if predictions differ by more")
+    bench.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "export":
+        compiled = compile_model(load_pickled_model(args.model))
+        compiled.save(args.output)
+        print(f"Wrote {args.output}: {compiled.n_trees} trees, {compiled.n_nodes} nodes, "
+              f"{os.path.getsize(args.output) / 1024:.1f} KB")
+        return 0
+    report = benchmark(args.model, args.compiled, args.rows, args.seed, args.repeats)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    if report["max_abs_diff"] > args.tolerance:
+        print(f"Predictions differ by more than {args.tolerance}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""Train both models from the Parquet archive without loading it into memory.
+
+The notebooks read farming_data.csv into pandas, which caps training at what
+fits in RAM. Here the readings are streamed from the HDFS archive written by
+the streaming job (or any Parquet dataset with the same columns) in
+column-projected record batches:
+
+- the irrigation XGBoost model is trained through an xgboost DataIter. Each
+  batch is labelled with irrigation_labels.label_pandas and handed to
+  ExtMemQuantileDMatrix, which keeps the quantized pages on disk, so memory
+  stays at about one batch whatever the archive size (--in-memory builds a
+  QuantileDMatrix instead: faster, still never holds the raw floats).
+- the soil health forest, which needs its data in memory, is trained on a
+  sample stratified by (crop_type, region): at most --per-stratum readings of
+  each pair, kept as a bottom-k sample (random priorities) while streaming.
+
+Both follow the notebooks otherwise (dropna, labels, parameters, 80/20
+evaluation) and write the files the deployment loads. The irrigation model
+is saved with a sketch of its training features
+(irrigation_model.baseline.json, see feature_sketch.py), counted on the same
+pass as the labels, which scripts/feature_drift.py compares the stream with.
+
+    python train_out_of_core.py hdfs://namenode:9000/user/smart_farming_data --output models/
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import xgboost as xgb
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, "Irrigation Prediction Model", "Model_notebook"))
+sys.path.append(os.path.join(HERE, "Irrigation Prediction Model", "Irrigation Prediction Model -deployment"))
+sys.path.append(os.path.join(HERE, "Soil_Health_Index_Model", "Model_notebook"))
+import feature_sketch  # noqa: E402
+import irrigation_labels  # noqa: E402
+import soil_health_index  # noqa: E402
+import soil_pipeline  # noqa: E402
+
+BATCH_ROWS = 262144
+IRRIGATION_FEATURES = ["soil_moisture", "temperature", "humidity", "rainfall", "sunlight_intensity", "soil_pH"]
+IRRIGATION_COLUMNS = sorted(set(IRRIGATION_FEATURES) | set(irrigation_labels.COLUMNS) | {"sensor_id"})
+SOIL_COLUMNS = soil_pipeline.FEATURES
+STRATA = ["crop_type", "region"]
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read_batches(source, columns, batch_rows=BATCH_ROWS):
+    """pandas DataFrames of `columns`, batch_rows at a time, from a Parquet file or directory (local or hdfs://)."""
+    dataset = ds.dataset(source, format="parquet")
+    # file by file, without pre-buffering: a Parquet row group can hold millions of
+    # rows, and only batch_rows of them are decoded at a time this way
+    for path in dataset.files:
+        with dataset.filesystem.open_input_file(path) as f:
+            reader = pq.ParquetFile(f, pre_buffer=False, buffer_size=1 << 20)
+            for batch in reader.iter_batches(batch_size=batch_rows, columns=columns):
+                if batch.num_rows:
+                    yield batch.to_pandas()
+
+
+def in_holdout(sensor_ids, percent):
+    """Stable split by reading id: the same readings are held out on every pass and every run."""
+    hashes = pd.util.hash_array(sensor_ids.astype(str).to_numpy(dtype=object))
+    return hashes % 100 < percent
+
+
+def irrigation_batch(frame):
+    """The notebook's preprocessing of a batch: labels, then readings without a missing feature."""
+    frame = frame.assign(irrigation_needed=irrigation_labels.label_pandas(frame))
+    return frame.dropna(subset=IRRIGATION_FEATURES)
+
+
+class ArchiveIter(xgb.DataIter):
+    """Irrigation training (or holdout) batches of the archive for xgboost, one pass per epoch."""
+
+    def __init__(self, source, holdout_percent, holdout, batch_rows=BATCH_ROWS, cache_prefix=None):
+        self.source = source
+        self.holdout_percent = holdout_percent
+        self.holdout = holdout
+        self.batch_rows = batch_rows
+        self._batches = None
+        super().__init__(cache_prefix=cache_prefix, release_data=True)
+
+    def batches(self):
+        for frame in read_batches(self.source, IRRIGATION_COLUMNS, self.batch_rows):
+            frame = irrigation_batch(frame)
+            frame = frame[in_holdout(frame["sensor_id"], self.holdout_percent) == self.holdout]
+            if len(frame):
+                yield frame[IRRIGATION_FEATURES], frame["irrigation_needed"].to_numpy()
+
+    def next(self, input_data):
+        if self._batches is None:
+            self._batches = self.batches()
+        try:
+            X, y = next(self._batches)
+        except StopIteration:
+            return False
+        input_data(data=X, label=y)
+        return True
+
+    def reset(self):
+        self._batches = None
+
+
+def count_labels(source, holdout_percent, batch_rows=BATCH_ROWS, sketches=None):
+    """(negatives, positives) of the training split, for the notebook's scale_pos_weight.
+
+    If sketches (a dict) is given, it is filled with a feature_sketch.Sketch of
+    every feature over the same readings."""
+    counts = np.zeros(2, dtype=np.int64)
+    for X, y in ArchiveIter(source, holdout_percent, False, batch_rows).batches():
+        counts += np.bincount(y, minlength=2)
+        if sketches is not None:
+            sketches.update(feature_sketch.merge_sketches(sketches, feature_sketch.sketch_frame(X)))
+    return counts
+
+
+def train_irrigation(source, output_dir, holdout_percent=20, batch_rows=BATCH_ROWS, num_boost_round=100,
+                     early_stopping_rounds=None, in_memory=False, cache_dir=None):
+    """Train the irrigation classifier from the archive; returns its holdout metrics."""
+    started = time.perf_counter()
+    sketches = {}
+    negatives, positives = count_labels(source, holdout_percent, batch_rows, sketches)
+    if not positives or not negatives:
+        raise ValueError(f"training split has {negatives} negative and {positives} positive readings")
+    cache_dir = cache_dir or tempfile.mkdtemp(prefix="xgb-extmem-")
+    if in_memory:
+        train = xgb.QuantileDMatrix(ArchiveIter(source, holdout_percent, False, batch_rows))
+        valid = xgb.QuantileDMatrix(ArchiveIter(source, holdout_percent, True, batch_rows), ref=train)
+    else:
+        train = xgb.ExtMemQuantileDMatrix(
+            ArchiveIter(source, holdout_percent, False, batch_rows, os.path.join(cache_dir, "train")))
+        valid = xgb.ExtMemQuantileDMatrix(
+            ArchiveIter(source, holdout_percent, True, batch_rows, os.path.join(cache_dir, "valid")), ref=train)
+    # XGBClassifier defaults, as in the notebook
+    params = {"objective": "binary:logistic", "tree_method": "hist", "eval_metric": ["logloss", "error"],
+              "scale_pos_weight": negatives / positives}
+    booster = xgb.train(params, train, num_boost_round=num_boost_round, evals=[(valid, "holdout")],
+                        early_stopping_rounds=early_stopping_rounds, verbose_eval=False)
+
+    model = xgb.XGBClassifier()
+    model.load_model(bytearray(booster.save_raw("ubj")))
+    path = os.path.join(output_dir, "irrigation_model.pkl")
+    joblib.dump(model, path)
+    baseline = feature_sketch.save_baseline(sketches, feature_sketch.baseline_path(path),
+                                            rows=int(negatives + positives), source=source)
+
+    # holdout metrics, streamed like the training data
+    confusion = np.zeros((2, 2), dtype=np.int64)  # [actual, predicted]
+    iteration_range = (0, booster.best_iteration + 1) if early_stopping_rounds else (0, 0)
+    for X, y in ArchiveIter(source, holdout_percent, True, batch_rows).batches():
+        predicted = booster.inplace_predict(X, iteration_range=iteration_range) > 0.5
+        np.add.at(confusion, (y, predicted.astype(np.int64)), 1)
+    (tn, fp), (fn, tp) = confusion
+    return {
+        "model": path,
+        "baseline": baseline,
+        "train_rows": int(negatives + positives),
+        "holdout_rows": int(confusion.sum()),
+        "accuracy": (tp + tn) / max(confusion.sum(), 1),
+        "precision": tp / max(tp + fp, 1),
+        "recall": tp / max(tp + fn, 1),
+        "boost_rounds": booster.num_boosted_rounds(),
+        "seconds": time.perf_counter() - started,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def soil_health_target(df):
+    """The notebook's soil health index (0-1) of raw readings."""
+    return soil_health_index.soil_health_index_frame(df)
+
+
+def stratified_sample(source, per_stratum, seed=42, batch_rows=BATCH_ROWS):
+    """At most per_stratum readings of every (crop_type, region), uniformly, in one pass.
+
+    Every reading gets a random priority and the per_stratum lowest of each
+    stratum are kept, so memory holds the sample plus one batch."""
+    rng = np.random.default_rng(seed)
+    sample = None
+    for frame in read_batches(source, SOIL_COLUMNS, batch_rows):
+        frame = frame.dropna(subset=SOIL_COLUMNS).assign(_priority=lambda f: rng.random(len(f)))
+        sample = frame if sample is None else pd.concat([sample, frame], ignore_index=True)
+        sample = sample.sort_values("_priority").groupby(STRATA, sort=False).head(per_stratum)
+    if sample is None or not len(sample):
+        raise ValueError(f"{source} has no complete soil readings")
+    return sample.drop(columns="_priority").reset_index(drop=True)
+
+
+def train_soil_health(source, output_dir, per_stratum=50000, batch_rows=BATCH_ROWS):
+    """Train the soil health forest on a stratified sample; returns its test metrics."""
+    started = time.perf_counter()
+    df = stratified_sample(source, per_stratum, batch_rows=batch_rows)
+    sampled_at = time.perf_counter()
+
+    # target, encoding and scaling as in Soil_Health_Index_Model.ipynb
+    y = soil_health_target(df)
+    X = df[SOIL_COLUMNS].copy()
+    le_crop, le_region = LabelEncoder(), LabelEncoder()
+    X["crop_type"] = le_crop.fit_transform(X["crop_type"])
+    X["region"] = le_region.fit_transform(X["region"])
+    scaler = StandardScaler()
+    num_cols = soil_pipeline.NUMERIC_FEATURES
+    X[num_cols] = scaler.fit_transform(X[num_cols])
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    model = RandomForestRegressor(n_estimators=200, max_depth=10, random_state=42, n_jobs=-1)
+    model.fit(X_train, y_train)
+    y_pred = model.predict(X_test)
+
+    joblib.dump(model, os.path.join(output_dir, "soil_health_model.pkl"))
+    joblib.dump(scaler, os.path.join(output_dir, "soil_scaler.pkl"))
+    joblib.dump(le_crop, os.path.join(output_dir, "crop_encoder.pkl"))
+    joblib.dump(le_region, os.path.join(output_dir, "region_encoder.pkl"))
+    path = os.path.join(output_dir, "soil_health_pipeline.pkl")
+    soil_pipeline.SoilHealthPipeline.from_artifacts(model, scaler, le_crop, le_region).save(path)
+    return {
+        "model": path,
+        "sample_rows": len(df),
+        "strata": int(df.groupby(STRATA).ngroups),
+        "mae": mean_absolute_error(y_test, y_pred),
+        "r2": r2_score(y_test, y_pred),
+        "sample_seconds": sampled_at - started,
+        "seconds": time.perf_counter() - started,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="Parquet file or directory (local path or hdfs://...)")
+    parser.add_argument("--output", default=".", help="directory for the model files")
+    parser.add_argument("--models", default="irrigation,soil_health", help="comma-separated models to train")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="rows per streamed batch")
+    parser.add_argument("--holdout-percent", type=int, default=20, help="irrigation readings held out")
+    parser.add_argument("--rounds", type=int, default=100, help="irrigation boosting rounds")
+    parser.add_argument("--early-stopping", type=int, help="stop after this many rounds without improvement")
+    parser.add_argument("--in-memory", action="store_true", help="QuantileDMatrix instead of external memory")
+    parser.add_argument("--cache-dir", help="external memory cache (default: a temporary directory)")
+    parser.add_argument("--per-stratum", type=int, default=50000, help="soil readings per (crop, region)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.output, exist_ok=True)
+    models = args.models.split(",")
+    report = {}
+    if "irrigation" in models:
+        report["irrigation"] = train_irrigation(
+            args.source, args.output, args.holdout_percent, args.batch_rows, args.rounds, args.early_stopping,
+            args.in_memory, args.cache_dir)
+    if "soil_health" in models:
+        report["soil_health"] = train_soil_health(args.source, args.output, args.per_stratum, args.batch_rows)
+    print(json.dumps(report, indent=2, default=float))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Hyperparameter search for both models: successive halving over a process pool.
+
+Random candidates are drawn from each model's search space and scored by
+k-fold cross-validation at a small budget (boosting rounds for the irrigation
+XGBoost model, trees for the soil health forest). The best 1/eta of them move
+on to eta times the budget, until one is left or the full budget is reached.
+XGBoost trials also stop early on their validation fold.
+
+The folds are split and written once, as .npy files that every worker
+memory-maps on first use, so a trial only sends (model, parameters, budget,
+fold) to its worker instead of re-splitting and pickling the data. Each trial
+runs single-threaded, one per worker process.
+
+    python tune_hyperparams.py irrigation farming_data.csv --candidates 27 --workers 8 --compare-sequential
+    python tune_hyperparams.py soil_health hdfs://namenode:9000/user/smart_farming_data --max-rows 500000
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import log_loss, r2_score
+from sklearn.model_selection import KFold, StratifiedKFold
+
+import train_out_of_core as ooc
+
+FOLD_PARTS = ["X_train", "y_train", "X_valid", "y_valid"]
+
+# per model: draw one candidate from the search space, given a numpy Generator
+SEARCH_SPACES = {
+    "irrigation": lambda rng: {
+        "max_depth": int(rng.integers(3, 11)),
+        "learning_rate": float(10 ** rng.uniform(-2, -0.5)),
+        "subsample": float(rng.uniform(0.6, 1.0)),
+        "colsample_bytree": float(rng.uniform(0.6, 1.0)),
+        "min_child_weight": float(10 ** rng.uniform(0, 1)),
+        "reg_lambda": float(10 ** rng.uniform(-1, 1)),
+    },
+    "soil_health": lambda rng: {
+        "max_depth": [6, 8, 10, 12, 16, 20, None][rng.integers(7)],
+        "min_samples_leaf": int(rng.integers(1, 21)),
+        "max_features": [1.0, 0.7, 0.5, "sqrt"][rng.integers(4)],
+    },
+}
+# (min budget, max budget): boosting rounds / trees
+BUDGETS = {"irrigation": (50, 800), "soil_health": (25, 200)}
+
+# fold arrays already memory-mapped in this worker, by (directory, fold)
+_folds = {}
+
+
+def load_data(model, source, max_rows=None):
+    """(X, y) of a CSV file or a Parquet archive, prepared like the training notebooks."""
+    columns = ooc.IRRIGATION_COLUMNS if model == "irrigation" else ooc.SOIL_COLUMNS
+    if source.endswith(".csv"):
+        frames = [pd.read_csv(source, usecols=lambda c: c in columns, nrows=max_rows)]
+    else:
+        frames, rows = [], 0
+        for frame in ooc.read_batches(source, columns):
+            frames.append(frame)
+            rows += len(frame)
+            if max_rows and rows >= max_rows:
+                break
+    df = pd.concat(frames, ignore_index=True).head(max_rows)
+    if model == "irrigation":
+        df = ooc.irrigation_batch(df)
+        return df[ooc.IRRIGATION_FEATURES].to_numpy(np.float32), df["irrigation_needed"].to_numpy(np.int64)
+    df = df.dropna(subset=ooc.SOIL_COLUMNS)
+    X = df[ooc.SOIL_COLUMNS].copy()
+    # label codes like LabelEncoder; the notebook's scaling does not change a forest's splits
+    for name in ooc.soil_pipeline.CATEGORICAL_FEATURES:
+        X[name] = X[name].astype("category").cat.codes
+    return X.to_numpy(np.float32), ooc.soil_health_target(df).to_numpy(np.float64)
+
+
+def materialize_folds(model, X, y, n_folds, directory, seed=42):
+    """Write every fold's train/validation arrays once; workers memory-map them."""
+    splitter = (StratifiedKFold if model == "irrigation" else KFold)(n_folds, shuffle=True, random_state=seed)
+    for fold, (train, valid) in enumerate(splitter.split(X, y)):
+        arrays = {"X_train": X[train], "y_train": y[train], "X_valid": X[valid], "y_valid": y[valid]}
+        for part in FOLD_PARTS:
+            np.save(os.path.join(directory, f"fold{fold}_{part}.npy"), arrays[part])
+    return directory
+
+
+def fold_arrays(directory, fold):
+    key = (directory, fold)
+    if key not in _folds:
+        _folds[key] = tuple(np.load(os.path.join(directory, f"fold{fold}_{part}.npy"), mmap_mode="r")
+                            for part in FOLD_PARTS)
+    return _folds[key]
+
+
+def irrigation_trial(params, budget, folds, early_stopping_rounds):
+    X_train, y_train, X_valid, y_valid = folds
+    dtrain = xgb.DMatrix(X_train, y_train, nthread=1)
+    dvalid = xgb.DMatrix(X_valid, y_valid, nthread=1)
+    positives = max(int(np.sum(y_train)), 1)
+    booster = xgb.train(
+        {"objective": "binary:logistic", "tree_method": "hist", "nthread": 1, "eval_metric": "logloss",
+         # as in the notebook
+         "scale_pos_weight": (len(y_train) - positives) / positives, **params},
+        dtrain, num_boost_round=budget, evals=[(dvalid, "valid")],
+        early_stopping_rounds=early_stopping_rounds, verbose_eval=False)
+    proba = booster.predict(dvalid, iteration_range=(0, booster.best_iteration + 1))
+    return -log_loss(y_valid, proba, labels=[0, 1]), booster.best_iteration + 1
+
+
+def soil_health_trial(params, budget, folds, early_stopping_rounds):
+    X_train, y_train, X_valid, y_valid = folds
+    model = RandomForestRegressor(n_estimators=budget, random_state=42, n_jobs=1, **params)
+    model.fit(X_train, y_train)
+    return r2_score(y_valid, model.predict(X_valid)), budget
+
+
+TRIALS = {"irrigation": irrigation_trial, "soil_health": soil_health_trial}
+
+
+def run_trial(task):
+    """One (candidate, budget, fold) fit; returns its score (higher is better) and timing."""
+    model, candidate, params, budget, directory, fold, early_stopping_rounds = task
+    started = time.perf_counter()
+    score, used_budget = TRIALS[model](params, budget, fold_arrays(directory, fold), early_stopping_rounds)
+    return {"candidate": candidate, "fold": fold, "budget": budget, "used_budget": int(used_budget),
+            "score": float(score), "seconds": time.perf_counter() - started}
+
+
+def successive_halving(model, candidates, directory, n_folds, workers=1, eta=3, budgets=None,
+                       early_stopping_rounds=20):
+    """Search over candidates; returns (best candidate index, rungs, trials, wall seconds)."""
+    min_budget, max_budget = budgets or BUDGETS[model]
+    survivors = list(range(len(candidates)))
+    budget = min_budget
+    rungs, trials = [], []
+    started = time.perf_counter()
+    # spawn: workers must not inherit an OpenMP runtime the parent already started
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) if workers > 1 else None
+    try:
+        while True:
+            tasks = [(model, c, candidates[c], budget, directory, fold, early_stopping_rounds)
+                     for c in survivors for fold in range(n_folds)]
+            results = list(pool.map(run_trial, tasks)) if pool else [run_trial(t) for t in tasks]
+            trials += results
+            scores = {c: statistics.fmean(r["score"] for r in results if r["candidate"] == c) for c in survivors}
+            survivors = sorted(survivors, key=scores.get, reverse=True)
+            rungs.append({"budget": budget, "candidates": len(scores), "best": survivors[0],
+                          "best_score": scores[survivors[0]],
+                          "mean_trial_seconds": statistics.fmean(r["seconds"] for r in results)})
+            if budget >= max_budget or len(survivors) == 1:
+                break
+            survivors = survivors[:max(1, math.ceil(len(survivors) / eta))]
+            budget = min(budget * eta, max_budget)
+    finally:
+        if pool:
+            pool.shutdown()
+    return survivors[0], rungs, trials, time.perf_counter() - started
+
+
+def print_rungs(rungs, seconds, label):
+    print(f"\n{label}: {seconds:.1f}s")
+    print(f"{'budget':>7} {'candidates':>11} {'best':>5} {'best score':>11} {'s/trial':>8}")
+    for rung in rungs:
+        print(f"{rung['budget']:>7} {rung['candidates']:>11} {rung['best']:>5} {rung['best_score']:>11.5f} "
+              f"{rung['mean_trial_seconds']:>8.2f}")
+
+
+def tune(model, source, n_candidates=27, n_folds=3, workers=None, eta=3, budgets=None, early_stopping_rounds=20,
+         max_rows=None, seed=42, compare_sequential=False, fold_dir=None):
+    """Load, split once, search; returns a report with the best parameters and timings."""
+    workers = workers or os.cpu_count()
+    X, y = load_data(model, source, max_rows)
+    rng = np.random.default_rng(seed)
+    candidates = [SEARCH_SPACES[model](rng) for _ in range(n_candidates)]
+    directory = fold_dir or tempfile.mkdtemp(prefix="tune-folds-")
+    os.makedirs(directory, exist_ok=True)
+    try:
+        started = time.perf_counter()
+        materialize_folds(model, X, y, n_folds, directory, seed)
+        fold_seconds = time.perf_counter() - started
+        del X, y
+        best, rungs, trials, seconds = successive_halving(
+            model, candidates, directory, n_folds, workers, eta, budgets, early_stopping_rounds)
+        print_rungs(rungs, seconds, f"{workers} workers")
+        report = {
+            "model": model,
+            "best_params": candidates[best],
+            "best_score": rungs[-1]["best_score"],
+            "best_budget": int(statistics.median(
+                t["used_budget"] for t in trials if t["candidate"] == best and t["budget"] == rungs[-1]["budget"])),
+            "trials": len(trials),
+            "fold_seconds": fold_seconds,
+            "seconds": seconds,
+            "trial_seconds": {"mean": statistics.fmean(t["seconds"] for t in trials),
+                              "median": statistics.median(t["seconds"] for t in trials),
+                              "max": max(t["seconds"] for t in trials)},
+            "workers": workers,
+            "rungs": rungs,
+        }
+        if compare_sequential:
+            sequential_best, sequential_rungs, _, sequential_seconds = successive_halving(
+                model, candidates, directory, n_folds, 1, eta, budgets, early_stopping_rounds)
+            print_rungs(sequential_rungs, sequential_seconds, "sequential")
+            report["sequential_seconds"] = sequential_seconds
+            report["speedup"] = sequential_seconds / seconds
+            report["same_best"] = sequential_best == best
+            print(f"\nspeedup: {report['speedup']:.2f}x on {workers} workers")
+    finally:
+        if fold_dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("model", choices=sorted(SEARCH_SPACES))
+    parser.add_argument("source", help="farming_data.csv, or a Parquet file or directory (local or hdfs://)")
+    parser.add_argument("--candidates", type=int, default=27, help="random candidates in the first rung")
+    parser.add_argument("--folds", type=int, default=3)
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--eta", type=int, default=3, help="keep 1/eta of the candidates, multiply the budget by eta")
+    parser.add_argument("--min-budget", type=int, help="rounds/trees in the first rung")
+    parser.add_argument("--max-budget", type=int, help="rounds/trees in the last rung")
+    parser.add_argument("--early-stopping", type=int, default=20, help="XGBoost rounds without improvement")
+    parser.add_argument("--max-rows", type=int, help="use only the first readings")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--fold-dir", help="keep the fold arrays here (default: a temporary directory)")
+    parser.add_argument("--compare-sequential", action="store_true",
+                        help="run the same search on one worker too and report the speedup")
+    parser.add_argument("--output", help="write the report as JSON here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    default_min, default_max = BUDGETS[args.model]
+    report = tune(args.model, args.source, args.candidates, args.folds, args.workers, args.eta,
+                  (args.min_budget or default_min, args.max_budget or default_max), args.early_stopping,
+                  args.max_rows, args.seed, args.compare_sequential, args.fold_dir)
+    print(json.dumps({k: v for k, v in report.items() if k != "rungs"}, indent=2, default=str))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""ETL benchmark on synthetic sensor data in local Spark.
+
+Generates Parquet archives shaped like the stream output (sensor_schema in
+spark_code.py) at several scales, runs the ETL DAG (etl_dag.py) end to end in
+local[*] mode and loads into SQLite through JDBC as a stand-in for MySQL.
+For every ETL stage it reports wall time, Spark jobs and stages, shuffle bytes
+and rows/sec, read from the Spark UI REST API.
+
+    spark-submit --packages org.xerial:sqlite-jdbc:3.45.3.0 etl_benchmark.py --scales 1M,10M
+    python etl_benchmark.py --scales 1M --output /tmp/etl_bench.json
+
+Late-data partition replacement goes through pymysql and is not exercised: every
+scale is a fresh first run.
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+import urllib.request
+
+import pyspark.sql.functions as F
+from pyspark.sql import SparkSession
+
+import etl_dag
+
+SQLITE_JDBC_PACKAGE = "org.xerial:sqlite-jdbc:3.45.3.0"
+DEFAULT_SCALES = "1M,10M,50M"
+
+# the ten farms of kafka_producer.ipynb
+FARMS = [
+    ("NileDelta", "Wheat"), ("NileDelta", "Rice"), ("NileDelta", "Onion"),
+    ("UpperEgypt", "Tomato"), ("UpperEgypt", "Dates"), ("UpperEgypt", "Peanuts"),
+    ("Sinai", "Corn"), ("Sinai", "Olive"), ("Sinai", "Barley"), ("Sinai", "Potato"),
+]
+
+
+def parse_scale(text):
+    units = {"K": 1_000, "M": 1_000_000, "B": 1_000_000_000}
+    text = text.strip().upper()
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def maybe_null(column, seed, fraction=0.001):
+    """A few missing readings so the mean-fill step has work to do."""
+    return F.when(F.rand(seed) < fraction, F.lit(None)).otherwise(column)
+
+
+def generate_sensor_data(spark, rows, path, start="2024-01-01 00:00:00", seconds_per_row=1):
+    """Write `rows` synthetic readings to `path` with the same columns and types as sensor_schema."""
+    farm_index = (F.col("id") % len(FARMS)).cast("int")
+    regions = F.array(*[F.lit(r) for r, _ in FARMS])
+    crops = F.array(*[F.lit(c) for _, c in FARMS])
+    ts = F.timestamp_seconds(F.unix_timestamp(F.lit(start)) + F.col("id") * seconds_per_row)
+    hour = F.hour(ts)
+    sunlight = F.when(hour.between(6, 18), 12 * F.exp(-F.pow(hour - 12, 2) / 18)).otherwise(0.0)
+    rain = F.when(F.rand(3) < 0.014, 10 + F.rand(4) * 70).otherwise(0.0)
+
+    df = spark.range(rows, numPartitions=max(1, rows // 1_000_000)).select(
+        F.expr("uuid()").alias("sensor_id"),
+        F.date_format(ts, "yyyy-MM-dd'T'HH:mm:ss").alias("timestamp"),
+        maybe_null(20 + F.rand(1) * 50, 11).alias("soil_moisture"),
+        maybe_null(5.5 + F.rand(2) * 2, 12).alias("soil_pH"),
+        maybe_null(15 + F.rand(5) * 20, 13).alias("temperature"),
+        rain.alias("rainfall"),
+        maybe_null(30 + F.rand(6) * 50, 14).alias("humidity"),
+        maybe_null(sunlight, 15).alias("sunlight_intensity"),
+        F.when(rain > 0, 5 + F.rand(7) * 15).otherwise(0.0).alias("pesticide_usage_ml"),
+        F.concat(F.lit("farm_"), (farm_index + 1).cast("string")).alias("farm_id"),
+        F.element_at(regions, farm_index + 1).alias("region"),
+        F.element_at(crops, farm_index + 1).alias("crop_type"),
+    )
+    df.write.mode("overwrite").parquet(path)
+
+
+class SparkRestMetrics:
+    """Job/stage metrics per job group from the Spark UI REST API."""
+
+    def __init__(self, spark):
+        sc = spark.sparkContext
+        self.base = f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}"
+
+    def _get(self, endpoint):
+        with urllib.request.urlopen(f"{self.base}/{endpoint}") as response:
+            return json.load(response)
+
+    def by_group(self):
+        stages = {(s["stageId"], s["attemptId"]): s for s in self._get("stages?status=complete")}
+        groups = {}
+        for job in self._get("jobs"):
+            group = groups.setdefault(job.get("jobGroup") or "<none>", {
+                "jobs": 0, "stages": 0, "shuffle_read_bytes": 0, "shuffle_write_bytes": 0, "input_records": 0})
+            group["jobs"] += 1
+            for stage_id in job["stageIds"]:
+                stage = stages.get((stage_id, 0))
+                if stage is None:
+                    continue  # skipped stage (output reused from the cache or an earlier shuffle)
+                group["stages"] += 1
+                group["shuffle_read_bytes"] += stage.get("shuffleReadBytes", 0)
+                group["shuffle_write_bytes"] += stage.get("shuffleWriteBytes", 0)
+                group["input_records"] += stage.get("inputRecords", 0)
+        return groups
+
+
+def run_scale(spark, rows, data_dir, work_dir, workers):
+    data_path = os.path.join(data_dir, f"sensors_{rows}")
+    if not os.path.exists(data_path):
+        print(f"Generating {rows:,} rows into {data_path}")
+        generate_sensor_data(spark, rows, data_path)
+
+    run_dir = os.path.join(work_dir, f"run_{rows}")
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    jdbc_url = f"jdbc:sqlite:{os.path.join(run_dir, 'farm_dwh.db')}"
+    # SQLite has a single writer; concurrent table loads wait for the lock instead of failing
+    jdbc_properties = {"driver": "org.sqlite.JDBC", "busy_timeout": "600000", "journal_mode": "WAL"}
+    stages = etl_dag.build_etl_dag(
+        spark, path=data_path, state_file=os.path.join(run_dir, "etl_state.json"),
+        jdbc_url=jdbc_url, jdbc_properties=jdbc_properties)
+
+    # job groups are prefixed with the scale so runs in the same Spark app don't mix
+    tag = etl_dag.spark_job_group(spark)
+    runner = etl_dag.DagRunner(
+        stages, state_file=os.path.join(run_dir, "dag_state.json"),
+        history_file=os.path.join(run_dir, "dag_runs.jsonl"),
+        max_workers=workers, on_stage_start=lambda name: tag(f"{rows}/{name}"))
+
+    started = time.perf_counter()
+    result = runner.run()
+    wall = time.perf_counter() - started
+    spark.sparkContext.setJobGroup("benchmark", "benchmark bookkeeping")
+
+    metrics = SparkRestMetrics(spark).by_group()
+    report = {"rows": rows, "wall_seconds": wall, "failed": result["failed"], "stages": {}}
+    for name in runner.order:
+        timing = result["timings"][name]
+        stage_metrics = metrics.get(f"{rows}/{name}", {})
+        report["stages"][name] = {
+            "seconds": timing["seconds"],
+            "status": timing["status"],
+            **stage_metrics,
+            "rows_per_sec": rows / timing["seconds"] if timing["seconds"] else None,
+        }
+    spark.catalog.clearCache()
+    return report
+
+
+def print_report(report):
+    print(f"\n=== {report['rows']:,} rows: {report['wall_seconds']:.1f}s wall, "
+          f"{report['rows'] / report['wall_seconds']:,.0f} rows/s end to end ===")
+    print(f"{'stage':<30}{'sec':>8}{'jobs':>6}{'stages':>8}{'shuffle MB':>12}{'rows/s':>14}")
+    for name, s in report["stages"].items():
+        shuffle_mb = (s.get("shuffle_read_bytes", 0) + s.get("shuffle_write_bytes", 0)) / 1e6
+        rate = f"{s['rows_per_sec']:,.0f}" if s["rows_per_sec"] else "-"
+        print(f"{name:<30}{s['seconds']:>8.1f}{s.get('jobs', 0):>6}{s.get('stages', 0):>8}{shuffle_mb:>12.1f}{rate:>14}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ETL on synthetic data in local Spark.")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="comma-separated row counts, e.g. 1M,10M,50M")
+    parser.add_argument("--data-dir", default="/tmp/etl_bench/data", help="synthetic archives (reused across runs)")
+    parser.add_argument("--work-dir", default="/tmp/etl_bench/runs", help="SQLite databases and ETL state")
+    parser.add_argument("--workers", type=int, default=4, help="ETL stages run at the same time")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    spark = SparkSession.builder \
+        .appName("ETL_SmartFarming_Benchmark") \
+        .master("local[*]") \
+        .config("spark.jars.packages", SQLITE_JDBC_PACKAGE) \
+        .config("spark.scheduler.mode", "FAIR") \
+        .config("spark.ui.retainedJobs", "100000") \
+        .config("spark.ui.retainedStages", "100000") \
+        .getOrCreate()
+
+    reports = []
+    for scale in args.scales.split(","):
+        report = run_scale(spark, parse_scale(scale), args.data_dir, args.work_dir, args.workers)
+        print_report(report)
+        reports.append(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
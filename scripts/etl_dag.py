@@ -0,0 +1,369 @@
+"""Local DAG runner for the ETL stages in etl_smartfarming.py.
+
+Stages whose dependencies are done run concurrently on a thread pool (Spark
+accepts jobs from several threads; the session uses the FAIR scheduler so the
+table writes share the executors). Each stage has a content fingerprint built
+from its own inputs and the fingerprints of its dependencies; a stage whose
+fingerprint matches its last successful run is skipped. Per-stage timings are
+kept in the state file and appended to a run history.
+
+    python etl_dag.py                 # incremental run
+    python etl_dag.py --force load_fact_sensor_data
+    python etl_dag.py --workers 8
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+import pyspark.sql.functions as F
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import col
+
+import etl_smartfarming as etl
+
+DAG_STATE_FILE = "/tmp/etl_dag_state.json"
+DAG_HISTORY_FILE = "/tmp/etl_dag_runs.jsonl"
+
+
+class Stage:
+    """A named unit of work.
+
+    func receives a dict {dependency name: value} and returns this stage's value.
+    after lists stages that must finish first without their value being needed
+    (so they are not rerun just to feed this one). fingerprint, if given,
+    returns a string describing external inputs (files, tables) so the stage
+    reruns when they change. Bump version when the stage's code changes in a
+    way that should invalidate earlier runs.
+    """
+
+    def __init__(self, name, func, deps=(), after=(), fingerprint=None, version="1"):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.after = list(after)
+        self.fingerprint = fingerprint
+        self.version = version
+
+
+class DagRunner:
+    def __init__(self, stages, state_file=DAG_STATE_FILE, history_file=DAG_HISTORY_FILE,
+                 max_workers=4, on_stage_start=None):
+        self.stages = {s.name: s for s in stages}
+        self.state_file = state_file
+        self.history_file = history_file
+        self.max_workers = max_workers
+        # hook called in the worker thread before a stage runs (e.g. to tag Spark jobs)
+        self.on_stage_start = on_stage_start
+        self.order = self._topological_order()
+
+    def _topological_order(self):
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle in DAG at stage {name}")
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps + self.stages[name].after:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def _load_state(self):
+        if os.path.exists(self.state_file):
+            with open(self.state_file, "r") as f:
+                return json.load(f)
+        return {}
+
+    def _save_state(self, state):
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2, default=str)
+        os.replace(tmp_path, self.state_file)
+
+    def fingerprints(self):
+        """Fingerprint of every stage, computed in dependency order without running anything."""
+        fps = {}
+        for name in self.order:
+            stage = self.stages[name]
+            h = hashlib.sha256()
+            h.update(f"{name}:{stage.version}".encode())
+            if stage.fingerprint is not None:
+                h.update(str(stage.fingerprint()).encode())
+            for dep in sorted(stage.deps + stage.after):
+                h.update(fps[dep].encode())
+            fps[name] = h.hexdigest()
+        return fps
+
+    def plan(self, fps, state, force=()):
+        """Stages to run: changed or forced stages, plus the upstream stages whose values they need."""
+        changed = {
+            name for name in self.order
+            if name in force
+            or state.get(name, {}).get("status") != "success"
+            or state.get(name, {}).get("fingerprint") != fps[name]
+        }
+        to_run = set()
+        stack = list(changed)
+        while stack:
+            name = stack.pop()
+            if name not in to_run:
+                to_run.add(name)
+                stack.extend(self.stages[name].deps)
+        return to_run
+
+    def _run_stage(self, name, values):
+        stage = self.stages[name]
+        if self.on_stage_start is not None:
+            self.on_stage_start(name)
+        inputs = {dep: values.get(dep) for dep in stage.deps}
+        return stage.func(inputs)
+
+    def run(self, force=()):
+        state = self._load_state()
+        fps = self.fingerprints()
+        to_run = self.plan(fps, state, force)
+        run_started = datetime.now().isoformat()
+        timings = {name: {"status": "skipped", "seconds": 0.0} for name in self.order if name not in to_run}
+
+        values, finished, failed = {}, set(), set()
+        pending = [name for name in self.order if name in to_run]
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for name in list(pending):
+                    deps = [d for d in self.stages[name].deps + self.stages[name].after if d in to_run]
+                    if any(d in failed for d in deps):
+                        pending.remove(name)
+                        failed.add(name)
+                        timings[name] = {"status": "upstream_failed", "seconds": 0.0}
+                    elif all(d in finished for d in deps):
+                        pending.remove(name)
+                        running[pool.submit(self._run_stage, name, values)] = (name, time.perf_counter())
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, started = running.pop(future)
+                    seconds = time.perf_counter() - started
+                    try:
+                        values[name] = future.result()
+                    except Exception as e:
+                        failed.add(name)
+                        timings[name] = {"status": "failed", "seconds": seconds, "error": str(e)}
+                        print(f"✗ {name} failed after {seconds:.1f}s: {e}")
+                        status = "failed"
+                    else:
+                        finished.add(name)
+                        timings[name] = {"status": "success", "seconds": seconds}
+                        print(f"✓ {name} ({seconds:.1f}s)")
+                        status = "success"
+                    state[name] = {"fingerprint": fps[name], "status": status,
+                                   "seconds": round(seconds, 3), "finished_at": datetime.now().isoformat()}
+                    self._save_state(state)
+
+        self._record(run_started, timings)
+        return {"values": values, "timings": timings, "failed": sorted(failed)}
+
+    def _record(self, run_started, timings):
+        with open(self.history_file, "a") as f:
+            f.write(json.dumps({"started_at": run_started, "stages": timings}) + "\n")
+        print(f"\n{'stage':<32}{'status':<18}{'seconds':>8}")
+        for name in self.order:
+            t = timings[name]
+            print(f"{name:<32}{t['status']:<18}{t['seconds']:>8.1f}")
+
+
+# ---------------------------------------------------------------------------
+# ETL stages
+# ---------------------------------------------------------------------------
+
+def build_etl_dag(spark, path=etl.HDFS_INPUT_PATH, state_file=etl.STATE_FILE, extra_stages=(),
+                  jdbc_url=etl.MYSQL_URL, jdbc_properties=etl.MYSQL_PROPERTIES):
+    """Stages: read -> clean -> late -> dims / facts / one per aggregate -> one load per table -> checkpoint.
+
+    The files a run loads are pinned in the ETL state (pending_files) until
+    checkpoint succeeds. A rerun after a failure loads the same files, so its
+    fingerprints match and the loads that succeeded are not repeated; files
+    that arrived in between wait for the next run."""
+    pinned = {}
+
+    def archive_fingerprint():
+        state = etl.load_state(state_file)
+        if state.get("pending_files") is None:
+            state["pending_files"] = etl.find_new_files(etl.list_archive_files(spark, path), state)
+            if state["pending_files"]:
+                etl.save_state(state, state_file)
+        pinned["state"] = state
+        return hashlib.sha256(json.dumps(sorted(map(list, state["pending_files"]))).encode()).hexdigest()
+
+    def read(inputs):
+        if "state" not in pinned:
+            archive_fingerprint()
+        state = pinned["state"]
+        new_files = [tuple(f) for f in state["pending_files"]]
+        batch = {"state": state, "new_files": new_files, "watermark": state.get("watermark"), "df": None}
+        if not new_files:
+            print("No new data.")
+            return batch
+        df = etl.read_sensor_data(spark, [p for p, _ in new_files])
+        if state.get("arrival_watermark") is None and batch["watermark"]:
+            # first run after the timestamp-only checkpoint
+            df = df.filter(col("timestamp") > F.lit(batch["watermark"]).cast("timestamp"))
+            batch["watermark"] = None
+        if df.limit(1).count():
+            batch["df"] = df
+        return batch
+
+    def clean(inputs):
+        batch = dict(inputs["read"])
+        if batch["df"] is not None:
+            batch["df"] = etl.clean(batch["df"]).cache()
+            batch["max_timestamp"] = batch["df"].agg(F.max("timestamp")).collect()[0][0]
+        return batch
+
+    def late(inputs):
+        batch = inputs["clean"]
+        if batch["df"] is None:
+            return {"keys": [], "on_time": None, "partitions": None}
+        keys = etl.late_partitions(batch["df"], batch["watermark"])
+        partitions = None
+        if keys:
+            print(f"Late readings touch {len(keys)} (date, region) partitions")
+            arrival_cutoff = max(m for _, m in batch["new_files"])
+            partitions = etl.clean(etl.read_partitions(spark, keys, arrival_cutoff, path), verbose=False).cache()
+        return {"keys": keys, "on_time": etl.on_time_rows(spark, batch["df"], keys), "partitions": partitions}
+
+    def dims(inputs):
+        df = inputs["clean"]["df"]
+        return None if df is None else etl.build_dimensions(df)
+
+    def facts(inputs):
+        df = inputs["clean"]["df"]
+        return None if df is None else etl.build_fact(df).orderBy("timestamp").coalesce(1)
+
+    def aggregate_stage(name):
+        def aggregate(inputs):
+            late_batch = inputs["late"]
+            if late_batch["on_time"] is None:
+                return None
+            recomputed = None
+            if late_batch["partitions"] is not None:
+                recomputed = etl.build_aggregate(late_batch["partitions"], name)
+            return {"append": etl.build_aggregate(late_batch["on_time"], name),
+                    "keys": late_batch["keys"], "replace": recomputed}
+        return aggregate
+
+    def load_dim_stage(name):
+        def load(inputs):
+            if inputs["dims"] is not None:
+                etl.write_table(inputs["dims"][name], name, url=jdbc_url, properties=jdbc_properties)
+        return load
+
+    def load_fact(inputs):
+        if inputs["facts"] is not None:
+            etl.write_table(inputs["facts"], "fact_sensor_data", url=jdbc_url, properties=jdbc_properties)
+
+    def load_aggregate_stage(name):
+        def load(inputs):
+            result = inputs[f"agg_{name}"]
+            if result is not None:
+                etl.write_table(result["append"], name, url=jdbc_url, properties=jdbc_properties)
+        return load
+
+    def replace_aggregate_stage(name):
+        # a stage of its own, so a failed replace is retried without appending the rows again
+        def replace(inputs):
+            result = inputs[f"agg_{name}"]
+            if result is not None and result["replace"] is not None:
+                etl.replace_partitions(name, result["keys"], result["replace"])
+        return replace
+
+    def release_late(inputs):
+        # the partition replaces were the last to read the re-read partitions
+        partitions = inputs["late"]["partitions"]
+        if partitions is not None:
+            partitions.unpersist()
+
+    def checkpoint(inputs):
+        batch = inputs["clean"]
+        if not batch["new_files"]:
+            return None
+        # the new state has no pending_files: the next run lists the archive again
+        new_state = etl.advance_state(batch["state"], batch["new_files"], batch.get("max_timestamp"))
+        etl.save_state(new_state, state_file)
+        if batch["df"] is not None:
+            batch["df"].unpersist()
+        print(f"Checkpoint saved. Watermark {new_state['watermark']}")
+        return new_state
+
+    stages = [
+        Stage("read", read, fingerprint=archive_fingerprint),
+        Stage("clean", clean, ["read"]),
+        Stage("late", late, ["clean"]),
+        Stage("dims", dims, ["clean"]),
+        Stage("facts", facts, ["clean"]),
+        Stage("load_fact_sensor_data", load_fact, ["facts"]),
+    ]
+    load_stages = ["load_fact_sensor_data"]
+    for name in ("dim_farm", "dim_crop", "dim_time"):
+        stages.append(Stage(f"load_{name}", load_dim_stage(name), ["dims"]))
+        load_stages.append(f"load_{name}")
+    for name in etl.AGGREGATES:
+        stages.append(Stage(f"agg_{name}", aggregate_stage(name), ["late"]))
+        stages.append(Stage(f"load_{name}", load_aggregate_stage(name), [f"agg_{name}"]))
+        stages.append(Stage(f"replace_{name}", replace_aggregate_stage(name), [f"agg_{name}"],
+                            after=[f"load_{name}"]))
+        load_stages += [f"load_{name}", f"replace_{name}"]
+    stages.append(Stage("release_late", release_late, ["late"],
+                        after=[f"replace_{name}" for name in etl.AGGREGATES]))
+    stages.append(Stage("checkpoint", checkpoint, ["clean"], after=load_stages))
+    stages.extend(extra_stages)
+    return stages
+
+
+def spark_job_group(spark):
+    """on_stage_start hook that tags the Spark jobs of each stage with its name."""
+    def tag(name):
+        spark.sparkContext.setJobGroup(name, f"ETL stage {name}")
+        spark.sparkContext.setLocalProperty("spark.scheduler.pool", name)
+    return tag
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the smart farming ETL as a DAG of stages.")
+    parser.add_argument("--workers", type=int, default=4, help="stages run at the same time")
+    parser.add_argument("--force", action="append", default=[], help="run this stage even if unchanged (repeatable)")
+    parser.add_argument("--state-file", default=DAG_STATE_FILE)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    spark = SparkSession.builder \
+        .appName("ETL_SmartFarming_DAG") \
+        .config("spark.scheduler.mode", "FAIR") \
+        .getOrCreate()
+    runner = DagRunner(build_etl_dag(spark), state_file=args.state_file,
+                       max_workers=args.workers, on_stage_start=spark_job_group(spark))
+    result = runner.run(force=set(args.force))
+    spark.stop()
+    if result["failed"]:
+        raise SystemExit(f"Failed stages: {', '.join(result['failed'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+"""ETL stages for the smart farming warehouse, used by ETL_SmartFarming.ipynb.
+
+Reads the Parquet archive written by spark_code.py, cleans it, builds the star
+schema and the daily aggregates and loads everything into MySQL (farm_dwh).
+
+Incremental loading is tracked per arrival file: every run only reads the
+archive files that landed since the previous run. Readings in those files whose
+timestamp is not newer than the event-time watermark are late (a sensor buffered
+them through a connectivity gap). Late readings are appended to the fact table
+like any other, and only the (date, region) aggregate partitions they touch are
+recomputed from the archive and replaced in MySQL.
+"""
+import json
+import os
+import sys
+from datetime import timedelta
+
+import pymysql
+import pyspark.sql.functions as F
+from pyspark.sql.functions import (
+    col, dayofmonth, hour, minute, month, regexp_extract, to_date, to_timestamp, trim, weekofyear, year
+)
+from pyspark.sql.types import IntegerType
+
+# soil_health_index.py lives next to the soil health notebook (the Spark image copies it next to this script)
+SOIL_NOTEBOOK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ML", "Soil_Health_Index_Model",
+                                 "Model_notebook")
+if os.path.isdir(SOIL_NOTEBOOK_DIR):
+    sys.path.append(SOIL_NOTEBOOK_DIR)
+from soil_health_index import soil_health_index_column  # noqa: E402
+
+# HDFS path
+HDFS_INPUT_PATH = "hdfs://namenode:9000/user/smart_farming_data"
+
+# to track what has been processed: event-time watermark + arrival (file mtime) watermark
+STATE_FILE = "/tmp/etl_smartfarming_state.json"
+# watermark file used by earlier versions of the notebook
+LEGACY_CHECKPOINT_FILE = "/tmp/last_processed_timestamp.txt"
+
+MYSQL_URL = "jdbc:mysql://mysql:3306/farm_dwh"
+MYSQL_PROPERTIES = {"user": "root", "password": "root", "driver": "com.mysql.cj.jdbc.Driver"}
+MYSQL_CONNECTION = {"host": "mysql", "port": 3306, "user": "root", "password": "root", "database": "farm_dwh"}
+
+# columns whose missing values are filled with the batch mean
+NUMERIC_COLS = ["soil_moisture", "soil_pH", "temperature", "humidity", "sunlight_intensity"]
+# columns cleaned with the IQR rule
+OUTLIER_COLS = ["soil_moisture", "soil_pH", "temperature", "humidity", "sunlight_intensity"]
+TEXT_COLS = ["region", "crop_type"]
+
+# Aggregate tables: grouping columns + aggregations. Every aggregate is grouped
+# by (date, region), which is the unit late data is reprocessed in.
+AGGREGATES = {
+    # Moisture trend over time, average soil moisture for each farm and region per day
+    "moisture_trend": (["date", "region", "farm_id"], lambda: [
+        F.avg("soil_moisture").alias("avg_soil_moisture")]),
+    # rainfall vs soil moisture per region per day
+    "rain_moisture": (["date", "region"], lambda: [
+        F.sum("rainfall").alias("total_rainfall"),
+        F.avg("soil_moisture").alias("avg_soil_moisture")]),
+    # effect of temperature and sunlight on soil moisture per region per day
+    "climate_effect": (["date", "region"], lambda: [
+        F.avg("soil_moisture").alias("avg_soil_moisture"),
+        F.avg("temperature").alias("avg_temperature"),
+        F.avg("sunlight_intensity").alias("avg_sunlight")]),
+    # average soil pH over time for each crop and region
+    "ph_trend": (["date", "region", "crop_type"], lambda: [
+        F.avg("soil_pH").alias("avg_soil_pH")]),
+    # rainfall impact on pesticide application
+    "rain_pesticide": (["date", "region"], lambda: [
+        F.sum("rainfall").alias("total_rainfall"),
+        F.sum("pesticide_usage_ml").alias("total_pesticide_usage")]),
+    # daily sunlight hours per region
+    "sunlight_daily": (["date", "region"], lambda: [
+        F.sum("sunlight_intensity").alias("total_sunlight_hours")]),
+    # total pesticide usage per crop and region over time
+    "pesticide_trend": (["date", "region", "crop_type"], lambda: [
+        F.sum("pesticide_usage_ml").alias("total_pesticide_usage")]),
+}
+
+TABLE_SCHEMAS = {
+    "dim_farm": "farm_id INT, region VARCHAR(100)",
+    "dim_crop": "crop_type VARCHAR(50)",
+    "dim_time": "date DATE, year INT, month INT, day INT, week INT, hour INT, minute INT",
+    "fact_sensor_data": """
+        sensor_id VARCHAR(50),
+        timestamp TIMESTAMP,
+        soil_moisture DOUBLE,
+        soil_pH DOUBLE,
+        temperature DOUBLE,
+        rainfall DOUBLE,
+        humidity DOUBLE,
+        sunlight_intensity DOUBLE,
+        pesticide_usage_ml DOUBLE,
+        farm_id INT,
+        crop_type VARCHAR(50),
+        date DATE,
+        hour INT,
+        minute INT,
+        soil_health_index DOUBLE
+    """,
+    "moisture_trend": "date DATE, region VARCHAR(100), farm_id INT, avg_soil_moisture DOUBLE",
+    "rain_moisture": "date DATE, region VARCHAR(100), total_rainfall DOUBLE, avg_soil_moisture DOUBLE",
+    "climate_effect": "date DATE, region VARCHAR(100), avg_soil_moisture DOUBLE, avg_temperature DOUBLE, avg_sunlight DOUBLE",
+    "ph_trend": "date DATE, region VARCHAR(100), crop_type VARCHAR(50), avg_soil_pH DOUBLE",
+    "rain_pesticide": "date DATE, region VARCHAR(100), total_rainfall DOUBLE, total_pesticide_usage DOUBLE",
+    "sunlight_daily": "date DATE, region VARCHAR(100), total_sunlight_hours DOUBLE",
+    "pesticide_trend": "date DATE, region VARCHAR(100), crop_type VARCHAR(50), total_pesticide_usage DOUBLE",
+}
+
+
+# ---------------------------------------------------------------------------
+# Incremental state
+# ---------------------------------------------------------------------------
+
+def load_state(path=STATE_FILE):
+    """Return the ETL state, starting from the legacy timestamp checkpoint if needed."""
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    state = {"watermark": None, "arrival_watermark": None, "boundary_files": []}
+    if os.path.exists(LEGACY_CHECKPOINT_FILE):
+        with open(LEGACY_CHECKPOINT_FILE, "r") as f:
+            state["watermark"] = f.read().strip() or None
+    return state
+
+
+def save_state(state, path=STATE_FILE):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def list_archive_files(spark, path=HDFS_INPUT_PATH):
+    """List the Parquet files of the archive as (path, modification time in ms)."""
+    jvm = spark._jvm
+    root = jvm.org.apache.hadoop.fs.Path(path)
+    fs = root.getFileSystem(spark._jsc.hadoopConfiguration())
+    files = []
+    iterator = fs.listFiles(root, False)
+    while iterator.hasNext():
+        status = iterator.next()
+        name = status.getPath().getName()
+        if name.endswith(".parquet") and not name.startswith(("_", ".")):
+            files.append((status.getPath().toString(), status.getModificationTime()))
+    return files
+
+
+def find_new_files(files, state):
+    """Files that arrived after the last run (by modification time)."""
+    arrival_watermark = state.get("arrival_watermark")
+    if arrival_watermark is None:
+        return sorted(files, key=lambda f: f[1])
+    # files sharing the boundary mtime may have arrived after the last listing
+    seen = set(state.get("boundary_files", []))
+    return sorted(
+        [(p, m) for p, m in files if m > arrival_watermark or (m == arrival_watermark and p not in seen)],
+        key=lambda f: f[1],
+    )
+
+
+def advance_state(state, new_files, max_timestamp):
+    """State after new_files (with max event time max_timestamp) were loaded."""
+    arrival_watermark = max(m for _, m in new_files)
+    boundary = [p for p, m in new_files if m == arrival_watermark]
+    if arrival_watermark == state.get("arrival_watermark"):
+        boundary += state.get("boundary_files", [])
+    watermark = state.get("watermark")
+    if max_timestamp is not None and (watermark is None or str(max_timestamp) > watermark):
+        watermark = str(max_timestamp)
+    return {"watermark": watermark, "arrival_watermark": arrival_watermark, "boundary_files": sorted(set(boundary))}
+
+
+# ---------------------------------------------------------------------------
+# Extract + clean
+# ---------------------------------------------------------------------------
+
+def prepare(df):
+    """Parse timestamps and turn 'farm_7' into 7."""
+    df = df.withColumn("timestamp", to_timestamp("timestamp"))
+    return df.withColumn("farm_id", regexp_extract("farm_id", r"(\d+)", 1).cast(IntegerType()))
+
+
+def read_sensor_data(spark, paths):
+    return prepare(spark.read.parquet(*paths))
+
+
+def fill_missing(df):
+    """Fill missing numeric readings with the batch mean."""
+    mean_exprs = [F.mean(c).alias(c) for c in NUMERIC_COLS]
+    means = df.select(mean_exprs).collect()[0]
+    fill_dict = {c: means[c] for c in NUMERIC_COLS if means[c] is not None}
+    return df.fillna(fill_dict)
+
+
+def remove_outliers(df, verbose=True):
+    """Drop rows outside the 1.5 * IQR range of any outlier column."""
+    bounds = {}
+    for col_name in OUTLIER_COLS:
+        Q1, Q3 = df.approxQuantile(col_name, [0.25, 0.75], 0.01)
+        IQR = Q3 - Q1
+        bounds[col_name] = (Q1 - 1.5 * IQR, Q3 + 1.5 * IQR)
+        if verbose:
+            print(f"{col_name}: Range=[{bounds[col_name][0]:.2f}, {bounds[col_name][1]:.2f}]")
+
+    combined_filter = None
+    for col_name, (lower, upper) in bounds.items():
+        condition = F.col(col_name).between(lower, upper)
+        combined_filter = condition if combined_filter is None else combined_filter & condition
+    return df.filter(combined_filter)
+
+
+def trim_text(df):
+    for c in TEXT_COLS:
+        df = df.withColumn(c, trim(col(c)))
+    return df
+
+
+def add_date_parts(df):
+    return df.withColumn("date", to_date("timestamp")) \
+        .withColumn("year", year("timestamp")) \
+        .withColumn("month", month("timestamp")) \
+        .withColumn("day", dayofmonth("timestamp")) \
+        .withColumn("week", weekofyear("timestamp")) \
+        .withColumn("hour", hour("timestamp")) \
+        .withColumn("minute", minute("timestamp"))
+
+
+def cast_numeric(df):
+    for c in NUMERIC_COLS:
+        df = df.withColumn(c, F.col(c).cast("double"))
+    return df
+
+
+def clean(df, verbose=True):
+    """All cleaning steps of the notebook in order."""
+    df = fill_missing(df)
+    df = remove_outliers(df, verbose)
+    df = trim_text(df)
+    df = add_date_parts(df)
+    return cast_numeric(df)
+
+
+# ---------------------------------------------------------------------------
+# Transform
+# ---------------------------------------------------------------------------
+
+def build_aggregate(df, name):
+    keys, aggs = AGGREGATES[name]
+    return df.groupBy(*keys).agg(*aggs())
+
+
+def build_aggregates(df):
+    return {name: build_aggregate(df, name) for name in AGGREGATES}
+
+
+def build_dimensions(df):
+    dim_farm = df.select(
+        col("farm_id").cast("int").alias("farm_id"),
+        trim(col("region")).alias("region")
+    ).dropDuplicates(["farm_id"])
+
+    dim_crop = df.select(
+        col("crop_type").substr(1, 50).alias("crop_type")
+    ).dropDuplicates(["crop_type"])
+
+    dim_time = df.select(
+        col("date").cast("date").alias("date"),
+        col("year").cast("int").alias("year"),
+        col("month").cast("int").alias("month"),
+        col("day").cast("int").alias("day"),
+        col("week").cast("int").alias("week"),
+        col("hour").cast("int").alias("hour"),
+        col("minute").cast("int").alias("minute")
+    ).dropDuplicates(["date", "hour", "minute"])
+
+    return {"dim_farm": dim_farm, "dim_crop": dim_crop, "dim_time": dim_time}
+
+
+def build_fact(df):
+    return df.select(
+        col("sensor_id").substr(1, 50).alias("sensor_id"),
+        col("timestamp").alias("timestamp"),
+        col("soil_moisture").cast("double").alias("soil_moisture"),
+        col("soil_pH").cast("double").alias("soil_pH"),
+        col("temperature").cast("double").alias("temperature"),
+        col("rainfall").cast("double").alias("rainfall"),
+        col("humidity").cast("double").alias("humidity"),
+        col("sunlight_intensity").cast("double").alias("sunlight_intensity"),
+        col("pesticide_usage_ml").cast("double").alias("pesticide_usage_ml"),
+        col("farm_id").cast("int").alias("farm_id"),
+        col("crop_type").substr(1, 50).alias("crop_type"),
+        col("date").cast("date").alias("date"),
+        col("hour").cast("int").alias("hour"),
+        col("minute").cast("int").alias("minute"),
+        soil_health_index_column()
+    ).dropDuplicates(["sensor_id", "timestamp"])
+
+
+# ---------------------------------------------------------------------------
+# Late data
+# ---------------------------------------------------------------------------
+
+def late_partitions(df, watermark):
+    """(date, region) pairs touched by readings at or before the watermark."""
+    if watermark is None:
+        return []
+    late = df.filter(col("timestamp") <= F.lit(watermark).cast("timestamp"))
+    return [(r["date"], r["region"]) for r in late.select("date", "region").distinct().collect()]
+
+
+def on_time_rows(spark, df, keys):
+    """Rows outside the late (date, region) partitions; those are appended as usual."""
+    if not keys:
+        return df
+    keys_df = spark.createDataFrame(keys, "date DATE, region STRING")
+    return df.join(F.broadcast(keys_df), ["date", "region"], "left_anti")
+
+
+def read_partitions(spark, keys, arrival_cutoff, path=HDFS_INPUT_PATH):
+    """Read every archived reading of the given (date, region) partitions.
+
+    Only files that arrived up to arrival_cutoff (ms) are used, so files landing
+    while the ETL runs are left for the next run. The raw ISO timestamp string
+    is filtered by day range first so Parquet statistics can skip row groups.
+    """
+    dates = sorted({d for d, _ in keys})
+    regions = sorted({r for _, r in keys})
+    day_filter = None
+    for d in dates:
+        start, end = d.isoformat(), (d + timedelta(days=1)).isoformat()
+        condition = (col("timestamp") >= start) & (col("timestamp") < end)
+        day_filter = condition if day_filter is None else day_filter | condition
+
+    raw = spark.read.parquet(path) \
+        .filter(col("_metadata.file_modification_time") <= F.timestamp_millis(F.lit(arrival_cutoff))) \
+        .filter(day_filter & trim(col("region")).isin(regions))
+    df = add_date_parts(prepare(raw).withColumn("region", trim(col("region"))))
+    wanted = spark.createDataFrame([(d, r) for d, r in keys], "date DATE, region STRING")
+    # clean() adds the date parts again
+    return df.join(F.broadcast(wanted), ["date", "region"], "left_semi") \
+        .drop("date", "year", "month", "day", "week", "hour", "minute")
+
+
+# ---------------------------------------------------------------------------
+# Load
+# ---------------------------------------------------------------------------
+
+def write_table(df, table_name, mode="append", url=MYSQL_URL, properties=MYSQL_PROPERTIES):
+    df.write.jdbc(
+        url=url,
+        table=table_name,
+        mode=mode,
+        properties={**properties, "createTableColumnTypes": TABLE_SCHEMAS[table_name]}
+    )
+
+
+def replace_partitions(table_name, keys, df, connection=MYSQL_CONNECTION):
+    """Replace the (date, region) partitions of an aggregate table in one transaction.
+
+    Recomputed partitions are small (one row per group of a few days), so they
+    are collected and written together with the delete.
+    """
+    rows = df.collect()
+    columns = df.columns
+    conn = pymysql.connect(**connection)
+    try:
+        with conn.cursor() as cur:
+            cur.executemany(
+                f"DELETE FROM {table_name} WHERE date = %s AND region = %s",
+                [(d, r) for d, r in keys]
+            )
+            if rows:
+                placeholders = ", ".join(["%s"] * len(columns))
+                cur.executemany(
+                    f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})",
+                    [tuple(row[c] for c in columns) for row in rows]
+                )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def run(spark, path=HDFS_INPUT_PATH, state_file=STATE_FILE):
+    """One incremental ETL run. Returns a small summary dict, or None if nothing arrived."""
+    state = load_state(state_file)
+    new_files = find_new_files(list_archive_files(spark, path), state)
+    if not new_files:
+        print("No new data. Exiting.")
+        return None
+    print(f"Found {len(new_files)} new archive files")
+
+    df = read_sensor_data(spark, [p for p, _ in new_files])
+    watermark = state.get("watermark")
+    if state.get("arrival_watermark") is None and watermark:
+        # first run after the timestamp-only checkpoint: keep its semantics once
+        df = df.filter(col("timestamp") > F.lit(watermark).cast("timestamp"))
+        watermark = None
+    if df.limit(1).count() == 0:
+        print("No new readings in the new files.")
+        save_state(advance_state(state, new_files, None), state_file)
+        return None
+    df = clean(df)
+    df.cache()
+    max_timestamp = df.agg(F.max("timestamp")).collect()[0][0]
+
+    keys = late_partitions(df, watermark)
+    if keys:
+        print(f"Late readings touch {len(keys)} (date, region) partitions: {keys}")
+
+    tables = dict(build_dimensions(df))
+    tables["fact_sensor_data"] = build_fact(df).orderBy("timestamp").coalesce(1)
+
+    # aggregates of partitions without late data are appended as usual
+    tables.update(build_aggregates(on_time_rows(spark, df, keys)))
+
+    for table_name, table_df in tables.items():
+        print(f"Loading data into {table_name}")
+        write_table(table_df, table_name)
+
+    # partitions with late data are recomputed from the archive and replaced
+    if keys:
+        arrival_cutoff = max(m for _, m in new_files)
+        recomputed = build_aggregates(clean(read_partitions(spark, keys, arrival_cutoff, path), verbose=False))
+        for table_name, table_df in recomputed.items():
+            print(f"Replacing {len(keys)} partitions of {table_name}")
+            replace_partitions(table_name, keys, table_df)
+
+    new_state = advance_state(state, new_files, max_timestamp)
+    save_state(new_state, state_file)
+    df.unpersist()
+    print(f"✓ Checkpoint saved. Watermark {new_state['watermark']}")
+    return {"files": len(new_files), "late_partitions": keys, "max_timestamp": max_timestamp}
@@ -0,0 +1,329 @@
+"""Streaming anomaly detection per farm: running statistics in Spark state, anomalies to Postgres.
+
+Every farm keeps, for each metric, an exponentially weighted mean and
+variance of its readings (plain running ones during the first --warmup
+readings), the last value and how many readings it has stayed the same.
+Each reading is checked against its farm's state before the state is updated.
+That is O(1) time and memory per reading, whatever the farm's history. A
+reading is flagged as:
+
+    zscore        |value - mean| / std above --z for its metric
+    drop          soil moisture fell by more than --z standard deviations of
+                  the farm's reading-to-reading changes (rain and irrigation
+                  raise moisture in steps, so only falls are flagged)
+    out_of_range  outside the metric's physical range (a faulty sensor)
+    stuck         the same value for --stuck readings in a row
+
+Flagged readings go to the Postgres table sensor_anomalies, one row per
+reading and metric. Replayed micro-batches do not add duplicates.
+
+    python farm_anomalies.py ddl | psql -h postgres -U admin smart_farming
+    python farm_anomalies.py check          # injected faults: how many are found, false alarms
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+from farm_features import ReplayState
+
+METRICS = ["soil_moisture", "soil_pH", "temperature", "humidity", "sunlight_intensity"]
+# tracked statistics: the metrics, plus the change in soil moisture since the farm's previous reading
+TRACKED = METRICS + ["soil_moisture_change"]
+MOISTURE, CHANGE = TRACKED.index("soil_moisture"), TRACKED.index("soil_moisture_change")
+# physically possible values; anything outside is a sensor fault whatever the farm's history
+RANGES = {
+    "soil_moisture": (0, 100),
+    "soil_pH": (0, 14),
+    "temperature": (-40, 70),
+    "humidity": (0, 100),
+    "sunlight_intensity": (0, np.inf),
+}
+# sunlight is legitimately 0 all night
+STUCK_METRICS = ["soil_moisture", "soil_pH", "temperature", "humidity"]
+# rain and irrigation raise moisture in steps: its level is not z-scored, only its falls (drop)
+ZSCORE_METRICS = ["soil_pH", "temperature", "humidity", "sunlight_intensity"]
+# rain moves these legitimately: they are not z-scored for RAIN_HOLDOFF readings after rain
+RAIN_AFFECTED = ["soil_pH", "humidity"]
+# smallest standard deviation a z-score is taken against, so a metric that has been flat for a
+# while (sunlight at night, humidity indoors) doesn't flag its first ordinary change
+MIN_STD = {
+    "soil_pH": 0.05,
+    "temperature": 1.0,
+    "humidity": 1.0,
+    "sunlight_intensity": 1.0,
+    "soil_moisture_change": 0.5,
+}
+
+Z_THRESHOLD = 4.0
+ALPHA = 0.02   # EWMA weight of a new reading (about the last 50 readings)
+WARMUP = 30    # readings before anything but range faults is flagged
+STUCK_READINGS = 30
+RAIN_HOLDOFF = 60  # readings (10 minutes at one reading per farm every 10 s)
+
+ANOMALY_TABLE = "sensor_anomalies"
+ANOMALY_DDL = f"""
+CREATE TABLE IF NOT EXISTS {ANOMALY_TABLE} (
+    sensor_id UUID NOT NULL,
+    farm_id VARCHAR(50) NOT NULL,
+    "timestamp" TIMESTAMP NOT NULL,
+    metric VARCHAR(30) NOT NULL,
+    kind VARCHAR(20) NOT NULL,
+    value DOUBLE PRECISION,
+    expected DOUBLE PRECISION,
+    z_score DOUBLE PRECISION,
+    detected_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (sensor_id, metric, kind)
+);
+CREATE INDEX IF NOT EXISTS sensor_anomalies_farm_time ON {ANOMALY_TABLE} (farm_id, "timestamp");
+"""
+ANOMALY_COLUMNS = ["sensor_id", "farm_id", "timestamp", "metric", "kind", "value", "expected", "z_score"]
+ANOMALY_SCHEMA = ("sensor_id string, farm_id string, timestamp timestamp, metric string, kind string, "
+                  "value double, expected double, z_score double")
+# per tracked statistic: count, mean, variance, last value, readings unchanged; then readings since rain
+STATE_SCHEMA = ("count array<long>, mean array<double>, variance array<double>, last array<double>, "
+                "run array<long>, since_rain long")
+
+
+class Detector:
+    """Per-farm running statistics and the checks made against them."""
+
+    def __init__(self, z=Z_THRESHOLD, alpha=ALPHA, warmup=WARMUP, stuck=STUCK_READINGS):
+        self.z = z
+        self.alpha = alpha
+        self.warmup = warmup
+        self.stuck = stuck
+        self.low = np.array([RANGES.get(m, (-np.inf, np.inf))[0] for m in TRACKED], dtype=np.float64)
+        self.high = np.array([RANGES.get(m, (-np.inf, np.inf))[1] for m in TRACKED], dtype=np.float64)
+        self.stuck_checked = np.isin(TRACKED, STUCK_METRICS)
+        self.zscored = np.isin(TRACKED, ZSCORE_METRICS)
+        self.rain_affected = np.isin(TRACKED, RAIN_AFFECTED)
+        self.min_std = np.array([MIN_STD.get(m, 0.0) for m in TRACKED])
+
+    @staticmethod
+    def empty_state():
+        n = len(TRACKED)
+        return (np.zeros(n, dtype=np.int64), np.zeros(n), np.zeros(n), np.full(n, np.nan), np.zeros(n, dtype=np.int64),
+                RAIN_HOLDOFF)
+
+    def update(self, state, readings):
+        """Check readings (sorted by time) one by one against `state`, updating it; returns the anomalies."""
+        count, mean, variance, last, run, since_rain = state
+        values = readings[METRICS].to_numpy(dtype=np.float64, na_value=np.nan)
+        rain = readings["rainfall"].to_numpy(dtype=np.float64, na_value=0.0) > 0
+        anomalies = []
+        for i, row in enumerate(values):
+            since_rain = 0 if rain[i] else since_rain + 1
+            x = np.append(row, row[MOISTURE] - last[MOISTURE])
+            known = ~np.isnan(x)
+            std = np.maximum(np.sqrt(variance), self.min_std)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                z = (x - mean) / std
+            ready = known & (count >= self.warmup) & (std > 0)
+            out_of_range = known & ((x < self.low) | (x > self.high))
+            run = np.where(known & (x == last), run + 1, np.where(known, 1, run))
+            flags = {
+                "out_of_range": out_of_range,
+                "zscore": ready & self.zscored & ~out_of_range & (np.abs(z) > self.z)
+                & ~(self.rain_affected & (since_rain < RAIN_HOLDOFF)),
+                "stuck": known & self.stuck_checked & (run == self.stuck),
+            }
+            flags["drop"] = np.zeros(len(TRACKED), dtype=bool)
+            flags["drop"][MOISTURE] = ready[CHANGE] and z[CHANGE] < -self.z
+            for kind, flagged in flags.items():
+                for j in np.flatnonzero(flagged):
+                    j_value = MOISTURE if kind == "drop" else j
+                    j_stats = CHANGE if kind == "drop" else j
+                    anomalies.append((i, TRACKED[j_value], kind, x[j_value],
+                                      mean[j_stats] if count[j_stats] else np.nan,
+                                      z[j_stats] if ready[j_stats] else np.nan))
+
+            # faulty values would poison the statistics: they are not learned from
+            learn = known & ~out_of_range
+            count = count + learn
+            weight = np.where(learn, np.maximum(self.alpha, 1 / np.maximum(count, 1)), 0.0)
+            delta = np.where(learn, x - mean, 0.0)
+            mean = mean + weight * delta
+            variance = (1 - weight) * (variance + weight * delta ** 2)
+            last = np.where(known, x, last)
+            # the change of the next reading is from this moisture, even an out-of-range one
+            last[CHANGE] = np.nan
+        return (count, mean, variance, last, run, since_rain), anomalies
+
+
+def anomaly_frame(readings, anomalies):
+    """Rows of sensor_anomalies for the anomalies Detector.update returned."""
+    if not anomalies:
+        return pd.DataFrame({c: pd.Series(dtype=object) for c in ANOMALY_COLUMNS})
+    index, metric, kind, value, expected, z = zip(*anomalies)
+    rows = readings.iloc[list(index)]
+    return pd.DataFrame({
+        "sensor_id": rows["sensor_id"].to_numpy(),
+        "farm_id": rows["farm_id"].to_numpy(),
+        "timestamp": rows["timestamp"].to_numpy(),
+        "metric": metric,
+        "kind": kind,
+        "value": np.array(value, dtype=np.float64),
+        "expected": np.array(expected, dtype=np.float64),
+        "z_score": np.array(z, dtype=np.float64),
+    })
+
+
+def detect_farm(detector):
+    """applyInPandasWithState function: check a micro-batch of one farm's readings, emit its anomalies."""
+
+    def detect(key, batches, state):
+        readings = pd.concat(list(batches), ignore_index=True) \
+            .sort_values("timestamp", kind="stable").reset_index(drop=True)
+        if state.exists:
+            *arrays, since_rain = state.get
+            current = (*[np.asarray(v) for v in arrays], since_rain)
+        else:
+            current = detector.empty_state()
+        updated, anomalies = detector.update(current, readings)
+        *arrays, since_rain = updated
+        state.update((*[v.tolist() for v in arrays], int(since_rain)))
+        yield anomaly_frame(readings, anomalies)
+
+    return detect
+
+
+def with_anomalies(readings, z=Z_THRESHOLD, alpha=ALPHA, warmup=WARMUP, stuck=STUCK_READINGS):
+    """Streaming DataFrame of anomalous (reading, metric) pairs, as in sensor_anomalies."""
+    from pyspark.sql import functions as F
+    from pyspark.sql.streaming.state import GroupStateTimeout
+
+    readings = readings.select("sensor_id", "farm_id", F.to_timestamp("timestamp").alias("timestamp"),
+                               *[F.col(name).cast("double") for name in METRICS + ["rainfall"]]) \
+        .dropna(subset=["sensor_id", "farm_id", "timestamp"])
+    return readings.groupBy("farm_id").applyInPandasWithState(
+        detect_farm(Detector(z, alpha, warmup, stuck)), ANOMALY_SCHEMA, STATE_SCHEMA, "append",
+        GroupStateTimeout.NoTimeout)
+
+
+def anomaly_writer(**connection):
+    """foreachBatch function inserting anomalies into sensor_anomalies (psycopg2 connect kwargs)."""
+    statement = f"""
+        INSERT INTO {ANOMALY_TABLE} ({", ".join(f'"{c}"' for c in ANOMALY_COLUMNS)}) VALUES %s
+        ON CONFLICT (sensor_id, metric, kind) DO NOTHING
+    """
+
+    def write(batch_df, epoch_id):
+        import psycopg2
+        from psycopg2.extras import execute_values
+
+        rows = [tuple(None if isinstance(v, float) and np.isnan(v) else v for v in row)
+                for row in batch_df.select(*ANOMALY_COLUMNS).collect()]
+        if not rows:
+            return
+        try:
+            conn = psycopg2.connect(**connection)
+            with conn, conn.cursor() as cur:
+                execute_values(cur, statement, rows, template="(%s::uuid, %s, %s, %s, %s, %s, %s, %s)")
+            conn.close()
+            print(f"Batch {epoch_id}: {len(rows)} anomalies to PostgreSQL")
+        except Exception as e:
+            print(f"Error batch {epoch_id} (anomalies): {str(e)}")
+
+    return write
+
+
+def sample_readings(farms=10, readings=4320, seed=0):
+    """Readings following kafka_producer.ipynb's model (one per farm every 10 s), with faults injected.
+
+    Returns (readings, faults): faults holds the (sensor_id, metric, kind) injected.
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-06-01 04:00:00")
+    frames, faults = [], []
+    for farm in range(farms):
+        moisture, ph, temperature = rng.uniform(30, 45), rng.uniform(6.0, 7.0), rng.uniform(20, 30)
+        rows = []
+        for i in range(readings):
+            timestamp = start + pd.Timedelta(seconds=10 * i)
+            sunlight = 12 * np.exp(-((timestamp.hour - 12) ** 2) / 18) if 6 <= timestamp.hour <= 18 else 0.0
+            temperature += (18 + 1.4 * sunlight - temperature) * 0.3 + rng.uniform(-0.3, 0.3)
+            rainfall = rng.uniform(10, 80) if rng.random() < 0.014 else 0.0
+            moisture += -0.15 * temperature / 25 + rng.uniform(-0.3, 0.3) + 0.6 * rainfall
+            if moisture < 20:
+                moisture += rng.uniform(20, 30)  # irrigated
+            moisture = min(max(moisture, 0), 100)
+            humidity = min(max(55 - 0.8 * (temperature - 20) + 0.25 * rainfall + rng.uniform(-3, 3), 10), 100)
+            ph += rng.uniform(-0.02, 0.02) - (0.2 if rainfall > 50 else 0.1 if rainfall > 0 else 0) \
+                + (0.1 if moisture > 60 else 0) - (0.2 if rainfall > 0 and rng.random() < 0.7 else 0)
+            # the producer's stability corrections
+            if abs(temperature - 25) > 15:
+                temperature = 0.7 * temperature + 0.3 * 25
+            if moisture < 10 or moisture > 90:
+                moisture += 0.4 * (40 - moisture)
+            if humidity < 15 or humidity > 90:
+                humidity += 0.4 * (55 - humidity)
+            if ph < 5.0 or ph > 8.0:
+                ph += 0.4 * (6.5 - ph)
+            rows.append((f"{farm}-{i}", timestamp,
+                         *np.round([moisture, ph, temperature, humidity, sunlight, rainfall], 2)))
+        df = pd.DataFrame(rows, columns=["sensor_id", "timestamp"] + METRICS + ["rainfall"]) \
+            .assign(farm_id=f"farm_{farm + 1}")
+
+        spike, drop, fault, stuck = rng.choice(np.arange(WARMUP * 3, readings - 2 * STUCK_READINGS), 4,
+                                               replace=False)
+        df.loc[spike, "temperature"] += 15
+        faults.append((df.at[spike, "sensor_id"], "temperature", "zscore"))
+        df.loc[drop, "soil_moisture"] -= 15
+        faults.append((df.at[drop, "sensor_id"], "soil_moisture", "drop"))
+        df.loc[fault, "soil_pH"] = -1.0
+        faults.append((df.at[fault, "sensor_id"], "soil_pH", "out_of_range"))
+        df.loc[stuck:stuck + STUCK_READINGS + 5, "humidity"] = df.at[stuck, "humidity"]
+        faults.append((df.at[stuck + STUCK_READINGS - 1, "sensor_id"], "humidity", "stuck"))
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True), faults
+
+
+def check(readings, faults, batches=20, **options):
+    """Replay readings as micro-batches: injected faults found, and other flags (false alarms)."""
+    detect = detect_farm(Detector(**options))
+    readings = readings.sort_values("timestamp", kind="stable").reset_index(drop=True)
+    states = {farm_id: ReplayState() for farm_id in readings["farm_id"].unique()}
+    edges = np.linspace(0, len(readings), batches + 1).astype(int)
+    found = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        for farm_id, farm in readings.iloc[lo:hi].groupby("farm_id"):
+            anomalies = next(detect((farm_id,), iter([farm]), states[farm_id]))
+            if len(anomalies):
+                found.append(anomalies)
+    found = pd.concat(found, ignore_index=True) if found else anomaly_frame(readings, [])
+    flagged = set(zip(found["sensor_id"], found["metric"], found["kind"]))
+    detected = sum(fault in flagged for fault in faults)
+    return {"readings": len(readings), "injected": len(faults), "detected": detected,
+            "false_alarms": len(flagged - set(faults)),
+            "by_kind": found["kind"].value_counts().to_dict()}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("ddl", help="print the CREATE TABLE statement of the anomalies table")
+    chk = sub.add_parser("check", help="replay generated readings with injected faults")
+    chk.add_argument("--farms", type=int, default=10)
+    chk.add_argument("--readings", type=int, default=4320, help="per farm (one every 10 s)")
+    chk.add_argument("--z", type=float, default=Z_THRESHOLD)
+    chk.add_argument("--alpha", type=float, default=ALPHA)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "ddl":
+        print(ANOMALY_DDL.strip())
+        return
+    readings, faults = sample_readings(args.farms, args.readings)
+    report = check(readings, faults, z=args.z, alpha=args.alpha)
+    print(json.dumps(report, indent=2))
+    if report["detected"] < report["injected"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""Rolling per-farm features: an online table fed by the stream, point-in-time snapshots for training.
+
+Irrigation need depends on recent history, not only on the current reading.
+For every farm, as of a reading at time t, the features are computed over the
+farm's readings in the event-time windows (t - 24h, t] and (t - 1h, t]:
+
+    rain_24h             rainfall summed over the last 24 hours
+    sunlight_24h         sunlight intensity summed over the last 24 hours
+    moisture_slope_1h    least-squares slope of soil moisture over the last hour, per hour
+    moisture_mean_1h     mean soil moisture over the last hour
+    temperature_mean_1h  mean temperature over the last hour
+    readings_1h, readings_24h
+
+They are defined once, by rolling_features, and both sides call it, so
+training and serving see the same values:
+
+- the stream (spark_code.py) keeps each farm's last 24 hours of readings in
+  Spark state and, every micro-batch, upserts the farm's features as of its
+  newest reading into the Postgres table farm_features (one row per farm,
+  primary key farm_id). The Flask app reads a farm with one key lookup.
+- `snapshot` writes, for every archived reading, the features as of its
+  timestamp to Parquet partitioned by date. Only readings at or before it are
+  used, so training joins them on sensor_id without leaking the future.
+
+    python farm_features.py ddl | psql -h postgres -U admin smart_farming
+    spark-submit farm_features.py snapshot --output hdfs://namenode:9000/user/farm_features
+    spark-submit farm_features.py snapshot --since 2024-06-01     # recompute these dates only
+    python farm_features.py check                                  # stream updates == snapshot
+"""
+import argparse
+import datetime
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+DAY, HOUR = pd.Timedelta(hours=24), pd.Timedelta(hours=1)
+INPUTS = ["rainfall", "sunlight_intensity", "soil_moisture", "temperature"]
+FEATURES = ["rain_24h", "sunlight_24h", "moisture_slope_1h", "moisture_mean_1h", "temperature_mean_1h",
+            "readings_1h", "readings_24h"]
+COUNTS = ["readings_1h", "readings_24h"]
+
+ONLINE_TABLE = "farm_features"
+ONLINE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {ONLINE_TABLE} (
+    farm_id VARCHAR(50) PRIMARY KEY,
+    as_of TIMESTAMP NOT NULL,
+{"".join(f"    {name} {'INTEGER' if name in COUNTS else 'DOUBLE PRECISION'},{chr(10)}" for name in FEATURES)}\
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+"""
+ONLINE_SCHEMA = ", ".join(["farm_id string", "as_of timestamp"]
+                          + [f"{name} {'int' if name in COUNTS else 'double'}" for name in FEATURES])
+# a farm's readings of the last 24 hours, as parallel arrays (timestamps in microseconds)
+STATE_SCHEMA = ", ".join(["timestamp array<long>"] + [f"{name} array<double>" for name in INPUTS])
+
+SNAPSHOT_PATH = "hdfs://namenode:9000/user/farm_features"
+SNAPSHOT_SCHEMA = ", ".join(["sensor_id string", "farm_id string", "timestamp timestamp", "date date"]
+                            + [f"{name} {'int' if name in COUNTS else 'double'}" for name in FEATURES])
+
+
+def rolling_features(readings):
+    """Features of one farm as of each of its readings, in timestamp order (index: timestamp).
+
+    Windows are in event time and include every reading at or before the
+    reading's timestamp; missing values are skipped.
+    """
+    r = readings.sort_values("timestamp", kind="stable").set_index("timestamp")
+    moisture = r["soil_moisture"].astype(float)
+    # hours since the first reading, only where moisture is known (the slope is shift-invariant)
+    hours = pd.Series((r.index - r.index[0]) / HOUR, index=r.index).where(moisture.notna())
+    one = pd.Series(1, index=r.index)
+    variance = hours.rolling(HOUR).var()
+    features = pd.DataFrame({
+        "rain_24h": r["rainfall"].astype(float).rolling(DAY).sum(),
+        "sunlight_24h": r["sunlight_intensity"].astype(float).rolling(DAY).sum(),
+        "moisture_slope_1h": (moisture.rolling(HOUR).cov(hours) / variance).where(variance > 0),
+        "moisture_mean_1h": moisture.rolling(HOUR).mean(),
+        "temperature_mean_1h": r["temperature"].astype(float).rolling(HOUR).mean(),
+        "readings_1h": one.rolling(HOUR).sum(),
+        "readings_24h": one.rolling(DAY).sum(),
+    }, index=r.index)
+    # readings sharing a timestamp all see each other, as the last of them does
+    features = features.groupby(level=0, sort=False).transform("last")
+    return features.astype({name: "int32" for name in COUNTS})
+
+
+def update_farm(key, batches, state):
+    """applyInPandasWithState function: add a micro-batch of one farm's readings, emit its features."""
+    new = pd.concat(list(batches), ignore_index=True)
+    new = pd.DataFrame({
+        "timestamp": new["timestamp"].to_numpy(dtype="datetime64[us]").astype(np.int64),
+        **{name: new[name].astype(float) for name in INPUTS},
+    })
+    if state.exists:
+        history = pd.DataFrame(dict(zip(["timestamp"] + INPUTS, state.get)))
+        new = pd.concat([history, new], ignore_index=True)
+    newest = new["timestamp"].max()
+    # older readings can't be in any window of the newest one (or of later ones)
+    readings = new[new["timestamp"] > newest - DAY // pd.Timedelta(microseconds=1)]
+    state.update(tuple(readings[c].tolist() for c in ["timestamp"] + INPUTS))
+
+    features = rolling_features(readings.assign(timestamp=pd.to_datetime(readings["timestamp"], unit="us")))
+    latest = features.iloc[[-1]].reset_index().rename(columns={"timestamp": "as_of"})
+    yield latest.assign(farm_id=key[0])[["farm_id", "as_of"] + FEATURES]
+
+
+def with_farm_features(readings):
+    """Streaming DataFrame of (farm_id, as_of, features...), one row per farm updated in each micro-batch."""
+    from pyspark.sql import functions as F
+    from pyspark.sql.streaming.state import GroupStateTimeout
+
+    readings = readings.select("farm_id", F.to_timestamp("timestamp").alias("timestamp"),
+                               *[F.col(name).cast("double") for name in INPUTS]) \
+        .dropna(subset=["farm_id", "timestamp"])
+    return readings.groupBy("farm_id").applyInPandasWithState(
+        update_farm, ONLINE_SCHEMA, STATE_SCHEMA, "update", GroupStateTimeout.NoTimeout)
+
+
+def online_writer(**connection):
+    """foreachBatch function upserting the updated farms into farm_features (psycopg2 connect kwargs)."""
+    columns = ["farm_id", "as_of"] + FEATURES
+    statement = f"""
+        INSERT INTO {ONLINE_TABLE} ({", ".join(columns)}) VALUES %s
+        ON CONFLICT (farm_id) DO UPDATE SET
+            {", ".join(f"{c} = EXCLUDED.{c}" for c in columns[1:])}, updated_at = now()
+        WHERE {ONLINE_TABLE}.as_of <= EXCLUDED.as_of
+    """
+
+    def write(batch_df, epoch_id):
+        import psycopg2
+        from psycopg2.extras import execute_values
+
+        rows = [tuple(None if isinstance(v, float) and np.isnan(v) else v for v in row)
+                for row in batch_df.select(*columns).collect()]
+        if not rows:
+            return
+        try:
+            conn = psycopg2.connect(**connection)
+            with conn, conn.cursor() as cur:
+                execute_values(cur, statement, rows)
+            conn.close()
+            print(f"Batch {epoch_id}: features of {len(rows)} farms to PostgreSQL")
+        except Exception as e:
+            print(f"Error batch {epoch_id} (farm features): {str(e)}")
+
+    return write
+
+
+def day_snapshot(pdf):
+    """applyInPandas function over one (farm_id, date): the day's readings, plus the day before as context."""
+    pdf = pdf.sort_values(["timestamp", "sensor_id"], kind="stable").reset_index(drop=True)
+    features = rolling_features(pdf).reset_index(drop=True)
+    keep = ~pdf["context"].to_numpy()
+    return pd.concat([pdf.loc[keep, ["sensor_id", "farm_id", "timestamp", "date"]].reset_index(drop=True),
+                      features[keep].reset_index(drop=True)], axis=1)
+
+
+def snapshot_features(readings, since=None):
+    """Point-in-time features of every reading of a batch DataFrame (date >= since when given)."""
+    from pyspark.sql import functions as F
+
+    readings = readings.select("sensor_id", "farm_id", F.to_timestamp("timestamp").alias("timestamp"),
+                               *[F.col(name).cast("double") for name in INPUTS]) \
+        .dropna(subset=["farm_id", "timestamp"]) \
+        .withColumn("date", F.to_date("timestamp"))
+    if since is not None:
+        readings = readings.filter(F.col("date") >= F.date_sub(F.lit(since), 1))
+    # a day's windows reach 24 hours back: each day's group also gets the previous day's readings
+    days = readings.withColumn("context", F.lit(False)).unionByName(
+        readings.withColumn("date", F.date_add("date", 1)).withColumn("context", F.lit(True)))
+    if since is not None:
+        days = days.filter(F.col("date") >= F.lit(since))
+    return days.groupBy("farm_id", "date").applyInPandas(day_snapshot, SNAPSHOT_SCHEMA)
+
+
+def write_snapshot(spark, path, output=SNAPSHOT_PATH, since=None):
+    import etl_smartfarming as etl
+
+    features = snapshot_features(etl.trim_text(spark.read.parquet(path)), since)
+    # with --since only the recomputed dates are replaced
+    spark.conf.set("spark.sql.sources.partitionOverwriteMode", "dynamic" if since else "static")
+    features.write.mode("overwrite").partitionBy("date").parquet(output)
+
+
+class ReplayState:
+    """The part of GroupState the state functions use, to replay a stream without Spark."""
+
+    def __init__(self):
+        self.get = None
+
+    @property
+    def exists(self):
+        return self.get is not None
+
+    def update(self, value):
+        self.get = value
+
+
+def sample_readings(farms=5, days=3, seed=0):
+    """Irregularly spaced readings with shared timestamps and missing values."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for farm in range(farms):
+        n = days * 24 * 40
+        seconds = np.sort(rng.integers(0, days * 86400, n)) // 30 * 30  # some readings share a timestamp
+        values = {name: rng.uniform(0, 100, n) for name in INPUTS}
+        for name in INPUTS:
+            values[name][rng.random(n) < 0.02] = np.nan
+        frames.append(pd.DataFrame({"farm_id": f"farm_{farm}",
+                                    "timestamp": pd.Timestamp("2024-01-01") + pd.to_timedelta(seconds, unit="s"),
+                                    **values}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def check(readings, batches=20):
+    """Replay readings as micro-batches through update_farm and compare with the snapshot's features."""
+    readings = readings.assign(timestamp=pd.to_datetime(readings["timestamp"])) \
+        .sort_values("timestamp", kind="stable").reset_index(drop=True)
+    expected = {farm_id: rolling_features(farm) for farm_id, farm in readings.groupby("farm_id")}
+    states = {farm_id: ReplayState() for farm_id in expected}
+    report = {"readings": len(readings), "farms": len(expected), "updates": 0, "mismatches": 0}
+    # cut between timestamps: a reading still to arrive at the newest timestamp would be missing online
+    edges = readings["timestamp"].searchsorted(readings["timestamp"].iloc[
+        np.linspace(0, len(readings) - 1, batches + 1).astype(int)[1:-1]])
+    edges = np.concatenate([[0], edges, [len(readings)]])
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        # arrival order within a micro-batch doesn't matter
+        for farm_id, farm in readings.iloc[lo:hi].sample(frac=1, random_state=0).groupby("farm_id"):
+            online = next(update_farm((farm_id,), iter([farm]), states[farm_id])).iloc[0]
+            offline = expected[farm_id].loc[[online["as_of"]]].iloc[-1]
+            report["updates"] += 1
+            for name in FEATURES:
+                a, b = online[name], offline[name]
+                if not (np.isclose(a, b, rtol=1e-9, atol=1e-9) or (pd.isna(a) and pd.isna(b))):
+                    report["mismatches"] += 1
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("ddl", help="print the CREATE TABLE statement of the online table")
+    snap = sub.add_parser("snapshot", help="write point-in-time features of the archive to Parquet")
+    snap.add_argument("--path", default="hdfs://namenode:9000/user/smart_farming_data", help="sensor archive")
+    snap.add_argument("--output", default=SNAPSHOT_PATH)
+    snap.add_argument("--since", type=datetime.date.fromisoformat,
+                      help="only recompute dates from this one (YYYY-MM-DD); older partitions are kept")
+    chk = sub.add_parser("check", help="replay readings as a stream and compare with the snapshot features")
+    chk.add_argument("--parquet", help="readings (default: generated)")
+    chk.add_argument("--batches", type=int, default=20)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "ddl":
+        print(ONLINE_DDL.strip())
+        return
+    if args.command == "snapshot":
+        from pyspark.sql import SparkSession
+        spark = SparkSession.builder.appName("SmartFarming_FarmFeatureSnapshot").getOrCreate()
+        write_snapshot(spark, args.path, args.output, args.since)
+        spark.stop()
+        return
+    report = check(pd.read_parquet(args.parquet, columns=["farm_id", "timestamp"] + INPUTS) if args.parquet
+                   else sample_readings(), args.batches)
+    print(json.dumps(report, indent=2))
+    if report["mismatches"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
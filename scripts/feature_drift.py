@@ -0,0 +1,377 @@
+"""Drift of the streamed readings away from the irrigation model's training data.
+
+The stream (spark_code.py) sketches the model's six input features every
+micro-batch: per farm and day, each feature's readings are counted in the
+logarithmic bins of feature_sketch.py, and the counts are added to the
+Postgres table feature_sketches. Since all sketches share the same bins, a
+farm's week is the sum of its days and a region is the sum of its farms, so
+the drift job never reads a raw reading:
+
+- training saves the same sketch of its training readings next to the model
+  (irrigation_model.pkl -> irrigation_model.baseline.json), from
+  ML/train_out_of_core.py and train_irrigation_spark.py, or from a CSV or
+  Parquet file with `baseline` for a model trained elsewhere;
+- `drift` sums the last --days days of feature_sketches per farm, then per
+  region and overall, and scores every feature against the baseline with PSI
+  and the Kolmogorov-Smirnov statistic. The scores are printed and appended
+  to feature_drift; a PSI above 0.2 is marked as drifted.
+
+Each micro-batch is recorded in feature_sketch_batches, keyed by the
+streaming query's id and the batch id, in the same transaction as its counts,
+so a batch Spark replays after a restart is not counted twice. The query id
+is kept in the checkpoint, which must therefore survive restarts; a new
+checkpoint reads the topic again as a new query, so empty feature_sketches
+and feature_sketch_batches first.
+
+    python feature_drift.py ddl | psql -h postgres -U admin smart_farming
+    python feature_drift.py drift --days 7
+    python feature_drift.py baseline farming_data.csv --output models/irrigation_model.baseline.json
+    python feature_drift.py check                  # stream-side sums == one sketch, shifted farms found
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# feature_sketch.py lives next to the model in ML/ (the Spark image copies it next to this script)
+DEPLOYMENT_DIR = os.path.join(HERE, "..", "ML", "Irrigation Prediction Model", "Irrigation Prediction Model -deployment")
+if os.path.isdir(DEPLOYMENT_DIR):
+    sys.path.append(DEPLOYMENT_DIR)
+import feature_sketch  # noqa: E402
+from feature_sketch import FEATURES, Sketch  # noqa: E402
+
+POSTGRES = {"dbname": "smart_farming", "user": "admin", "password": "password", "host": "postgres"}
+MODEL_PATH = os.environ.get("IRRIGATION_MODEL_PATH", os.path.join(DEPLOYMENT_DIR, "irrigation_model.pkl"))
+SCOPES = ["overall", "region", "farm"]
+
+SKETCH_TABLE = "feature_sketches"
+BATCH_TABLE = "feature_sketch_batches"
+DRIFT_TABLE = "feature_drift"
+DDL = f"""
+CREATE TABLE IF NOT EXISTS {SKETCH_TABLE} (
+    farm_id VARCHAR(50) NOT NULL,
+    region VARCHAR(50),
+    day DATE NOT NULL,
+    feature VARCHAR(30) NOT NULL,
+    bin INTEGER NOT NULL,
+    readings BIGINT NOT NULL,
+    PRIMARY KEY (farm_id, day, feature, bin)
+);
+CREATE TABLE IF NOT EXISTS {BATCH_TABLE} (
+    run_id VARCHAR(36) NOT NULL,
+    epoch_id BIGINT NOT NULL,
+    written_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (run_id, epoch_id)
+);
+CREATE TABLE IF NOT EXISTS {DRIFT_TABLE} (
+    computed_at TIMESTAMP NOT NULL,
+    scope VARCHAR(10) NOT NULL,
+    name VARCHAR(50) NOT NULL,
+    feature VARCHAR(30) NOT NULL,
+    readings BIGINT NOT NULL,
+    psi DOUBLE PRECISION,
+    ks DOUBLE PRECISION,
+    baseline_median DOUBLE PRECISION,
+    median DOUBLE PRECISION,
+    drifted BOOLEAN NOT NULL,
+    PRIMARY KEY (computed_at, scope, name, feature)
+);
+"""
+# the last `days` days of sketches, summed per farm and bin
+SKETCH_QUERY = f"""
+    SELECT farm_id, MAX(region) AS region, feature, bin, SUM(readings)::BIGINT AS readings
+    FROM {SKETCH_TABLE}
+    WHERE day > (SELECT MAX(day) FROM {SKETCH_TABLE}) - %s
+    GROUP BY farm_id, feature, bin
+"""
+REPORT_COLUMNS = ["scope", "name", "feature", "readings", "psi", "ks", "baseline_median", "median", "drifted"]
+
+
+def bin_column(value):
+    """feature_sketch.bins as a Spark expression (value must not be null or NaN)."""
+    from pyspark.sql import functions as F
+
+    magnitude = F.abs(value)
+    index = F.when(magnitude >= feature_sketch.MIN_VALUE,
+                   F.ceil(F.log(magnitude) / feature_sketch.LOG_GAMMA) - feature_sketch.OFFSET).otherwise(0)
+    return F.when(value < 0, -index).otherwise(index)
+
+
+def sketch_counts(df, keys=()):
+    """Readings per (*keys, feature, bin) of a Spark DataFrame with the model's features."""
+    from pyspark.sql import functions as F
+
+    pairs = ", ".join(f"'{feature}', CAST(`{feature}` AS DOUBLE)" for feature in FEATURES)
+    values = df.selectExpr(*keys, f"stack({len(FEATURES)}, {pairs}) AS (feature, value)") \
+        .filter(F.col("value").isNotNull() & ~F.isnan("value"))
+    return values.groupBy(*keys, "feature", bin_column(F.col("value")).alias("bin")) \
+        .agg(F.count("*").alias("readings"))
+
+
+def spark_sketches(df):
+    """{feature: Sketch} of a Spark DataFrame, counted on the executors."""
+    return sketches_by(pd.DataFrame(sketch_counts(df).collect(), columns=["feature", "bin", "readings"]))[()]
+
+
+def save_spark_baseline(df, model_path, **info):
+    """Sketch the training readings of a Spark DataFrame as the baseline of model_path; returns its path."""
+    return feature_sketch.save_baseline(spark_sketches(df), feature_sketch.baseline_path(model_path), **info)
+
+
+def sketch_writer(checkpoint, **connection):
+    """foreachBatch function adding the micro-batch's counts to feature_sketches (psycopg2 connect kwargs).
+
+    checkpoint is the query's checkpointLocation: the query id Spark keeps in
+    it identifies the query's batches across restarts."""
+    from pyspark.sql import functions as F
+
+    columns = ["farm_id", "region", "day", "feature", "bin", "readings"]
+    statement = f"""
+        INSERT INTO {SKETCH_TABLE} ({", ".join(columns)}) VALUES %s
+        ON CONFLICT (farm_id, day, feature, bin) DO UPDATE SET
+            readings = {SKETCH_TABLE}.readings + EXCLUDED.readings, region = EXCLUDED.region
+    """
+    query = {}
+
+    def run_id(spark):
+        # {"id": "..."}, written when the query first starts and read back on every restart
+        if "id" not in query:
+            query["id"] = json.loads(spark.read.text(f"{checkpoint}/metadata").first()[0])["id"]
+        return query["id"]
+
+    def write(batch_df, epoch_id):
+        import psycopg2
+        from psycopg2.extras import execute_values
+
+        readings = batch_df.filter(F.col("farm_id").isNotNull()) \
+            .withColumn("day", F.to_date("timestamp")).filter(F.col("day").isNotNull())
+        rows = [tuple(row) for row in sketch_counts(readings, ["farm_id", "region", "day"]).select(*columns).collect()]
+        if not rows:
+            return
+        try:
+            conn = psycopg2.connect(**connection)
+            with conn, conn.cursor() as cur:
+                cur.execute(f"INSERT INTO {BATCH_TABLE} (run_id, epoch_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                            (run_id(batch_df.sparkSession), epoch_id))
+                if cur.rowcount:
+                    execute_values(cur, statement, rows)
+            conn.close()
+            print(f"Batch {epoch_id}: {len(rows)} sketch bins to PostgreSQL")
+        except Exception as e:
+            print(f"Error batch {epoch_id} (feature sketches): {str(e)}")
+
+    return write
+
+
+def sketches_by(counts, keys=()):
+    """{key: {feature: Sketch}} of rows of (*keys, feature, bin, readings), summed by bin; keys are tuples."""
+    keys = list(keys)
+    counts = counts.groupby(keys + ["feature", "bin"], as_index=False)["readings"].sum()
+    sketches = {}
+    for group, rows in counts.groupby(keys + ["feature"], sort=False):
+        *key, feature = group
+        sketches.setdefault(tuple(key), {})[feature] = Sketch(rows["bin"].to_numpy(), rows["readings"].to_numpy())
+    if not keys and not sketches:
+        sketches[()] = {}
+    return sketches
+
+
+def drift_report(baseline, counts):
+    """PSI and KS of every feature against the baseline, per farm, per region and overall.
+
+    counts has a row per (farm_id, region, feature, bin); regions and the
+    overall distribution are merged from the farms' sketches."""
+    farms = {farm_id: sketches for (farm_id,), sketches in sketches_by(counts, ["farm_id"]).items()}
+    region_of = counts.groupby("farm_id")["region"].first().fillna("unknown")
+    regions = {}
+    for farm_id, sketches in farms.items():
+        region = region_of[farm_id]
+        regions[region] = feature_sketch.merge_sketches(regions.get(region, {}), sketches)
+    overall = {}
+    for sketches in regions.values():
+        overall = feature_sketch.merge_sketches(overall, sketches)
+
+    frames = []
+    for scope, groups in zip(SCOPES, [{"all": overall}, regions, farms]):
+        for name, sketches in sorted(groups.items()):
+            frames.append(feature_sketch.drift(baseline, sketches).assign(scope=scope, name=name))
+    if not frames:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)[REPORT_COLUMNS]
+
+
+def read_counts(days, connection=POSTGRES):
+    import psycopg2
+
+    with psycopg2.connect(**connection) as conn:
+        return pd.read_sql_query(SKETCH_QUERY, conn, params=(days,))
+
+
+def write_report(report, connection=POSTGRES):
+    """Append a drift report to feature_drift, stamped with the time it was computed."""
+    import psycopg2
+    from psycopg2.extras import execute_values
+
+    computed_at = pd.Timestamp.now().to_pydatetime()
+    rows = [(computed_at, *(v.item() if isinstance(v, np.generic) else v for v in row))
+            for row in report.astype(object).where(report.notna(), None).itertuples(index=False, name=None)]
+    conn = psycopg2.connect(**connection)
+    with conn, conn.cursor() as cur:
+        execute_values(cur, f"INSERT INTO {DRIFT_TABLE} (computed_at, {', '.join(REPORT_COLUMNS)}) VALUES %s", rows)
+    conn.close()
+
+
+def read_features(source, batch_rows=262144):
+    """Batches of the model's features from a CSV or Parquet file (or Parquet directory)."""
+    if source.endswith(".csv"):
+        yield from pd.read_csv(source, usecols=FEATURES, chunksize=batch_rows)
+        return
+    import pyarrow.dataset as ds
+
+    for batch in ds.dataset(source, format="parquet").to_batches(columns=FEATURES, batch_size=batch_rows):
+        yield batch.to_pandas()
+
+
+def build_baseline(source, output, batch_rows=262144):
+    """Sketch the readings of a training file as a model's baseline; returns the readings counted."""
+    sketches, rows = {}, 0
+    for frame in read_features(source, batch_rows):
+        # as in training: readings with a missing feature are dropped
+        frame = frame.dropna(subset=FEATURES)
+        sketches = feature_sketch.merge_sketches(sketches, feature_sketch.sketch_frame(frame))
+        rows += len(frame)
+    if not rows:
+        raise ValueError(f"{source} has no complete readings")
+    feature_sketch.save_baseline(sketches, output, rows=rows, source=source)
+    return rows
+
+
+REGIONS = ["NileDelta"] * 3 + ["UpperEgypt"] * 3 + ["Sinai"] * 4
+
+
+def sample_readings(farms=10, readings=17280, seed=0, shifts=None):
+    """Readings in the producer's ranges, one per farm every 10 s; shifts {(farm_id, feature): delta} are added."""
+    rng = np.random.default_rng(seed)
+    n = farms * readings
+    timestamps = pd.date_range("2024-06-01", periods=readings, freq="10s")
+    hour = np.tile(np.asarray(timestamps.hour), farms)
+    sunlight = np.where((hour >= 6) & (hour <= 18), 12 * np.exp(-((hour - 12) ** 2) / 18), 0.0)
+    temperature = 18 + 1.4 * sunlight + rng.normal(0, 1.5, n)
+    rainfall = np.where(rng.random(n) < 0.014, rng.uniform(10, 80, n), 0.0)
+    frame = pd.DataFrame({
+        "farm_id": np.repeat([f"farm_{i + 1}" for i in range(farms)], readings),
+        "region": np.repeat([REGIONS[i % len(REGIONS)] for i in range(farms)], readings),
+        "timestamp": np.tile(timestamps, farms),
+        "soil_moisture": np.clip(rng.normal(40, 10, n), 10, 90),
+        "temperature": temperature,
+        "humidity": np.clip(55 - 0.8 * (temperature - 20) + 0.25 * rainfall + rng.uniform(-3, 3, n), 10, 100),
+        "rainfall": rainfall,
+        "sunlight_intensity": sunlight,
+        "soil_pH": rng.normal(6.5, 0.3, n),
+    })
+    for (farm_id, feature), delta in (shifts or {}).items():
+        frame.loc[frame["farm_id"] == farm_id, feature] += delta
+    frame[FEATURES] = frame[FEATURES].round(2)
+    return frame
+
+
+def stream_counts(readings, batches):
+    """The rows feature_sketches would hold after the readings arrive in `batches` micro-batches."""
+    readings = readings.assign(day=readings["timestamp"].dt.date).sort_values("timestamp", kind="stable")
+    edges = np.linspace(0, len(readings), batches + 1).astype(int)
+    added = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        for (farm_id, region, day), rows in readings.iloc[lo:hi].groupby(["farm_id", "region", "day"]):
+            for feature, sketch in feature_sketch.sketch_frame(rows).items():
+                added.append(pd.DataFrame({"farm_id": farm_id, "region": region, "day": day, "feature": feature,
+                                           "bin": sketch.index, "readings": sketch.counts}))
+    table = pd.concat(added, ignore_index=True).groupby(["farm_id", "region", "day", "feature", "bin"],
+                                                        as_index=False)["readings"].sum()
+    # SKETCH_QUERY: days summed per farm
+    return table.groupby(["farm_id", "region", "feature", "bin"], as_index=False)["readings"].sum()
+
+
+def check(farms=10, readings=17280, batches=50, shifts=None):
+    """Baseline and serving readings from the same model, a few farm features shifted in serving.
+
+    Stream-side sums must equal a sketch of all serving readings at once, and
+    the drifted farm features must be exactly the shifted ones."""
+    shifts = shifts if shifts is not None else {("farm_2", "temperature"): 3.0, ("farm_8", "humidity"): -8.0,
+                                                ("farm_9", "soil_moisture"): 10.0}
+    train = sample_readings(farms, readings, seed=1)
+    serving = sample_readings(farms, readings, seed=2, shifts=shifts)
+    started = time.perf_counter()
+    baseline = feature_sketch.sketch_frame(train)
+    sketch_seconds = time.perf_counter() - started
+
+    counts = stream_counts(serving, batches)
+    direct = feature_sketch.sketch_frame(serving)
+    merged = sketches_by(counts)[()]
+    exact = all(np.array_equal(merged[f].index, direct[f].index) and np.array_equal(merged[f].counts, direct[f].counts)
+                for f in FEATURES)
+    q = np.array([0.01, 0.25, 0.5, 0.75, 0.99])
+    quantile_error = max(float(np.max(np.abs(direct[f].quantile(q) - np.quantile(serving[f], q, method="lower"))
+                                      / np.maximum(np.abs(np.quantile(serving[f], q, method="lower")), 1e-9)))
+                         for f in FEATURES if f not in ("rainfall", "sunlight_intensity"))
+
+    started = time.perf_counter()
+    report = drift_report(baseline, counts)
+    drift_seconds = time.perf_counter() - started
+    flagged = set(report.loc[(report["scope"] == "farm") & report["drifted"], ["name", "feature"]]
+                  .itertuples(index=False, name=None))
+    return {"readings": len(serving), "sketch_readings_per_second": len(train) / sketch_seconds,
+            "stream_sums_exact": exact, "max_quantile_relative_error": quantile_error,
+            "bins_stored": len(counts), "drift_seconds": drift_seconds,
+            "shifted": sorted(shifts), "drifted_farms": sorted(flagged),
+            "drifted_regions": sorted(set(report.loc[(report["scope"] == "region") & report["drifted"], "name"])),
+            "max_psi_unshifted": float(report.loc[(report["scope"] == "farm") & ~report["drifted"], "psi"].max())}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("ddl", help="print the CREATE TABLE statements of the sketch and drift tables")
+    drift = sub.add_parser("drift", help="score the last days of sketches against the model's baseline")
+    drift.add_argument("--days", type=int, default=1, help="days of sketches, up to the newest")
+    drift.add_argument("--baseline", default=feature_sketch.baseline_path(MODEL_PATH))
+    drift.add_argument("--no-write", action="store_true", help=f"print only, don't append to {DRIFT_TABLE}")
+    base = sub.add_parser("baseline", help="sketch a training file as a model's baseline")
+    base.add_argument("source", help="CSV file, or Parquet file or directory")
+    base.add_argument("--output", default=feature_sketch.baseline_path(MODEL_PATH))
+    chk = sub.add_parser("check", help="stream-side sketches and drift scores on generated readings")
+    chk.add_argument("--farms", type=int, default=10)
+    chk.add_argument("--readings", type=int, default=17280, help="per farm (one every 10 s)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "ddl":
+        print(DDL.strip())
+    elif args.command == "baseline":
+        rows = build_baseline(args.source, args.output)
+        print(f"Baseline of {rows} readings in {args.output}")
+        print(feature_sketch.describe(feature_sketch.load_baseline(args.output)).to_string(index=False))
+    elif args.command == "drift":
+        if not os.path.exists(args.baseline):
+            sys.exit(f"No baseline at {args.baseline}: train the model again, or run `baseline` on its training data")
+        report = drift_report(feature_sketch.load_baseline(args.baseline), read_counts(args.days))
+        shown = report[(report["scope"] != "farm") | report["drifted"]]
+        print(shown.to_string(index=False, float_format="{:.4f}".format))
+        print(f"{int(report['drifted'].sum())} of {len(report)} (scope, feature) pairs drifted")
+        if not args.no_write:
+            write_report(report)
+    else:
+        report = check(args.farms, args.readings)
+        print(json.dumps(report, indent=2, default=str))
+        if not report["stream_sums_exact"] or set(report["drifted_farms"]) != set(report["shifted"]):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Irrigation model scoring for Spark DataFrames, used by the streaming job in spark_code.py.
+
+The XGBoost model is broadcast once as its raw (UBJSON) bytes. Each Python
+worker rebuilds the booster from them once and keeps it, and readings are
+scored a whole Arrow batch at a time by an iterator pandas UDF using the
+booster's inplace_predict, the same call the Flask fast path makes.
+"""
+import os
+import pickle
+import uuid
+from typing import Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+from pyspark.sql import functions as F
+from pyspark.sql.functions import pandas_udf
+
+MODEL_PATH = os.environ.get(
+    "IRRIGATION_MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ML", "Irrigation Prediction Model",
+                 "Irrigation Prediction Model -deployment", "irrigation_model.pkl")
+)
+# model input columns, in training order
+FEATURES = ["soil_moisture", "temperature", "humidity", "rainfall", "sunlight_intensity", "soil_pH"]
+PREDICTION_SCHEMA = "irrigation_needed boolean, irrigation_probability double"
+
+# boosters already rebuilt in this Python worker, by broadcast token
+_boosters = {}
+
+
+def broadcast_model(spark, path=MODEL_PATH):
+    """Ship the model to the executors once, as raw booster bytes (no pickle on the workers)."""
+    with open(path, "rb") as f:
+        model = pickle.load(f)
+    booster = model.get_booster()
+    names = booster.feature_names
+    if names is not None and list(names) != FEATURES:
+        raise ValueError(f"model features {names} do not match {FEATURES}")
+    # same trees as model.predict when the model was trained with early stopping
+    best_iteration = getattr(model, "best_iteration", None)
+    iteration_range = (0, best_iteration + 1) if best_iteration is not None else (0, 0)
+    # the token identifies this model in the workers' booster cache
+    return spark.sparkContext.broadcast((uuid.uuid4().hex, bytes(booster.save_raw("ubj")), iteration_range))
+
+
+def _booster(model_bc):
+    token, raw, _ = model_bc.value
+    booster = _boosters.get(token)
+    if booster is None:
+        import xgboost as xgb
+        booster = xgb.Booster()
+        booster.load_model(bytearray(raw))
+        booster.set_param({"nthread": 1})  # one task per core already
+        _boosters[token] = booster
+    return booster
+
+
+def irrigation_udf(model_bc):
+    """pandas UDF taking the six feature columns and returning (irrigation_needed, irrigation_probability)."""
+    iteration_range = model_bc.value[2]
+
+    @pandas_udf(PREDICTION_SCHEMA)
+    def predict(batches: Iterator[Tuple[pd.Series, ...]]) -> Iterator[pd.DataFrame]:
+        booster = _booster(model_bc)
+        for columns in batches:
+            X = np.column_stack([c.to_numpy(dtype=np.float32, na_value=np.nan) for c in columns])
+            # missing readings stay NaN and follow each split's default branch
+            proba = booster.inplace_predict(X, iteration_range=iteration_range, validate_features=False)
+            yield pd.DataFrame({
+                "irrigation_needed": proba > 0.5,  # same threshold as model.predict
+                "irrigation_probability": proba.astype(np.float64),
+            })
+
+    return predict
+
+
+def with_irrigation_prediction(df, model_bc):
+    """df with irrigation_needed and irrigation_probability appended."""
+    # nondeterministic keeps the optimizer from inlining the UDF into both
+    # field projections below, which would score every row twice
+    prediction = irrigation_udf(model_bc).asNondeterministic()(*[F.col(c) for c in FEATURES])
+    return df.withColumn("_irrigation", prediction) \
+        .select("*", "_irrigation.irrigation_needed", "_irrigation.irrigation_probability") \
+        .drop("_irrigation")
@@ -0,0 +1,377 @@
+"""Soil moisture forecasts for every farm at once, and the irrigation schedule they imply.
+
+The irrigation model answers "irrigate now or not" for one reading. This job
+looks ahead instead: it takes each farm's hourly history of the last
+--history hours and forecasts its soil moisture for the next --horizon hours.
+It then ranks the farms by how soon the forecast drops below the crop's
+threshold, the same per-crop threshold and weather adjustments as the
+irrigation labels.
+
+All farms are fitted together, as array operations over a (farms, hours)
+panel, with no loop over farms:
+
+- a ridge autoregression of the hourly change in moisture on the previous
+  --lags changes, the hour's rain and the time of day (drying follows the
+  sun), solved for every farm in one batched np.linalg.solve
+- damped Holt smoothing, run over the hours for all farms and a small grid of
+  smoothing constants at once
+
+Each farm gets the model with the lower error on its own last --horizon
+hours (a backtest), refitted on the full history. Future rain is unknown, so
+the forecasts assume none, and a schedule ranks the driest case first.
+
+    python moisture_forecast.py                                   # sensor_data in Postgres
+    python moisture_forecast.py --postgres-output                 # also replace irrigation_schedule
+    python moisture_forecast.py --source archive --path /data/smart_farming_data --output schedule.csv
+    python moisture_forecast.py --synthetic 5000                  # timing on generated farms
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NOTEBOOK_DIR = os.path.join(HERE, "..", "ML", "Irrigation Prediction Model", "Model_notebook")
+# irrigation_labels.py lives next to the notebook (the Spark image copies it next to this script)
+if os.path.isdir(NOTEBOOK_DIR):
+    sys.path.append(NOTEBOOK_DIR)
+import irrigation_labels  # noqa: E402
+
+POSTGRES = {"dbname": "smart_farming", "user": "admin", "password": "password", "host": "postgres"}
+ARCHIVE_PATH = "hdfs://namenode:9000/user/smart_farming_data"
+WEATHER = ["temperature", "humidity", "sunlight_intensity"]
+HOLT_ALPHAS = np.array([0.2, 0.4, 0.6, 0.8])
+HOLT_BETA, HOLT_PHI = 0.1, 0.9
+RIDGE = 1e-2
+
+# hourly means per farm, aggregated in Postgres (sensor_data has one row per reading)
+HOURLY_QUERY = """
+    SELECT farm_id, date_trunc('hour', "timestamp") AS hour,
+           MAX(region) AS region, MAX(crop_type) AS crop_type,
+           AVG(soil_moisture) AS soil_moisture, SUM(rainfall) AS rainfall,
+           AVG(temperature) AS temperature, AVG(humidity) AS humidity,
+           AVG(sunlight_intensity) AS sunlight_intensity
+    FROM public.sensor_data
+    WHERE "timestamp" >= (SELECT date_trunc('hour', MAX("timestamp")) FROM public.sensor_data) - %s * INTERVAL '1 hour'
+    GROUP BY 1, 2
+"""
+SCHEDULE_TABLE = "irrigation_schedule"
+SCHEDULE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {SCHEDULE_TABLE} (
+    rank INTEGER PRIMARY KEY,
+    farm_id VARCHAR(50) NOT NULL,
+    region VARCHAR(100),
+    crop_type VARCHAR(100),
+    current_moisture DOUBLE PRECISION,
+    threshold DOUBLE PRECISION,
+    forecast_min DOUBLE PRECISION,
+    hours_until_below INTEGER,
+    irrigate_by TIMESTAMP,
+    deficit DOUBLE PRECISION,
+    model VARCHAR(20),
+    backtest_mae DOUBLE PRECISION,
+    forecast DOUBLE PRECISION[],
+    generated_at TIMESTAMP NOT NULL
+);
+"""
+
+
+class Panel:
+    """Hourly arrays of every farm on one shared time axis (rows: farms, columns: hours, oldest first)."""
+
+    def __init__(self, farms, hours, moisture, rainfall, weather):
+        self.farms = farms          # DataFrame: farm_id, region, crop_type
+        self.hours = hours          # DatetimeIndex of the columns
+        self.moisture = moisture
+        self.rainfall = rainfall
+        self.weather = weather      # {name: array}, gaps filled like moisture
+
+
+def fill_gaps(values):
+    """Carry the last known value forward along each row (the first known one back); all-NaN rows stay NaN."""
+    known = ~np.isnan(values)
+    last = np.where(known, np.arange(values.shape[1]), 0)
+    np.maximum.accumulate(last, axis=1, out=last)
+    rows = np.arange(values.shape[0])[:, None]
+    filled = values[rows, last]
+    first = values[rows[:, 0], np.argmax(known, axis=1)]
+    return np.where(np.isnan(filled), first[:, None], filled)
+
+
+def hourly_panel(hourly, history):
+    """Panel of the last `history` hours from rows of (farm_id, hour, region, crop_type, means...)."""
+    hourly = hourly.dropna(subset=["farm_id", "hour"])
+    hour = pd.to_datetime(hourly["hour"]).dt.tz_localize(None) if hasattr(hourly["hour"].dtype, "tz") \
+        else pd.to_datetime(hourly["hour"])
+    end = hour.max()
+    hours = pd.date_range(end=end, periods=history, freq="h")
+    keep = (hour >= hours[0]).to_numpy()
+    hourly, hour = hourly[keep], hour[keep]
+    codes, farm_ids = pd.factorize(hourly["farm_id"], sort=True)
+    columns = ((hour - hours[0]) // pd.Timedelta(hours=1)).to_numpy()
+
+    def array(name, fill=np.nan):
+        out = np.full((len(farm_ids), history), fill)
+        out[codes, columns] = pd.to_numeric(hourly[name]).to_numpy(dtype=np.float64, na_value=np.nan)
+        return out
+
+    farms = hourly.assign(_code=codes).sort_values("hour").groupby("_code")[["region", "crop_type"]].last()
+    farms.insert(0, "farm_id", farm_ids)
+    moisture = fill_gaps(array("soil_moisture"))
+    rainfall = np.nan_to_num(array("rainfall", 0.0))
+    weather = {name: fill_gaps(array(name)) for name in WEATHER}
+    usable = ~np.isnan(moisture).all(axis=1)
+    return Panel(farms[usable].reset_index(drop=True), hours, moisture[usable], rainfall[usable],
+                 {name: values[usable] for name, values in weather.items()})
+
+
+def _time_of_day(hours):
+    angle = 2 * np.pi * np.asarray(hours.hour) / 24
+    return np.sin(angle), np.cos(angle)
+
+
+def fit_autoregression(moisture, rainfall, hours, lags):
+    """Ridge coefficients of the hourly change on [1, previous changes..., rain, sin, cos] per farm."""
+    change = np.diff(moisture, axis=1)
+    n_farms, n = change.shape
+    sin, cos = _time_of_day(hours[1 + lags:])
+    X = np.concatenate([
+        np.ones((n_farms, n - lags, 1)),
+        np.stack([change[:, lags - i:n - i] for i in range(1, lags + 1)], axis=2).reshape(n_farms, n - lags, lags),
+        rainfall[:, 1 + lags:, None],
+        np.broadcast_to(np.stack([sin, cos], axis=1), (n_farms, n - lags, 2)),
+    ], axis=2)
+    y = change[:, lags:]
+    # normal equations of every farm, solved as one batch
+    A = np.einsum("fnk,fnj->fkj", X, X) + RIDGE * (n - lags) * np.eye(X.shape[2])
+    b = np.einsum("fnk,fn->fk", X, y)
+    return np.linalg.solve(A, b[..., None])[..., 0]
+
+
+def forecast_autoregression(coef, moisture, hours, horizon, lags):
+    """Recursive forecasts of the next `horizon` hours, with no rain after the last observed hour."""
+    future = pd.date_range(hours[-1], periods=horizon + 1, freq="h")[1:]
+    sin, cos = _time_of_day(future)
+    recent = np.diff(moisture[:, -lags - 1:], axis=1)[:, ::-1].copy()  # newest first, like the lag columns
+    level = moisture[:, -1].copy()
+    out = np.empty((len(moisture), horizon))
+    for step in range(horizon):
+        change = coef[:, 0] + np.einsum("fk,fk->f", coef[:, 1:lags + 1], recent) \
+            + coef[:, lags + 2] * sin[step] + coef[:, lags + 3] * cos[step]
+        level = level + change
+        out[:, step] = level
+        recent = np.concatenate([change[:, None], recent[:, :-1]], axis=1)
+    return np.clip(out, 0, 100)
+
+
+def forecast_holt(moisture, horizon):
+    """Damped Holt forecasts, with alpha picked per farm from HOLT_ALPHAS by one-step-ahead error."""
+    alpha = HOLT_ALPHAS[:, None]  # (alphas, 1) against (farms,): every combination at once
+    level = np.broadcast_to(moisture[:, 0], (len(HOLT_ALPHAS), len(moisture))).copy()
+    trend = np.broadcast_to(moisture[:, 1] - moisture[:, 0], level.shape).copy()
+    sse = np.zeros_like(level)
+    for t in range(1, moisture.shape[1]):
+        predicted = level + HOLT_PHI * trend
+        sse += (moisture[:, t] - predicted) ** 2
+        previous = level
+        level = alpha * moisture[:, t] + (1 - alpha) * predicted
+        trend = HOLT_BETA * (level - previous) + (1 - HOLT_BETA) * HOLT_PHI * trend
+    best = np.argmin(sse, axis=0)
+    farms = np.arange(len(moisture))
+    damping = np.cumsum(HOLT_PHI ** np.arange(1, horizon + 1))
+    return np.clip(level[best, farms][:, None] + damping * trend[best, farms][:, None], 0, 100)
+
+
+def forecast(panel, horizon, lags):
+    """Forecasts (farms, horizon), the model name of every farm and its backtest MAE."""
+    moisture, rainfall, hours = panel.moisture, panel.rainfall, panel.hours
+    if moisture.shape[1] - horizon < 2 * (lags + 5):
+        raise ValueError(f"{moisture.shape[1]} hours of history are too few for a {horizon}h horizon")
+    # backtest: fit without the last `horizon` hours and forecast them
+    fit, actual = slice(None, -horizon), moisture[:, -horizon:]
+    ar_test = forecast_autoregression(fit_autoregression(moisture[:, fit], rainfall[:, fit], hours[fit], lags),
+                                      moisture[:, fit], hours[fit], horizon, lags)
+    holt_test = forecast_holt(moisture[:, fit], horizon)
+    errors = np.stack([np.abs(ar_test - actual).mean(axis=1), np.abs(holt_test - actual).mean(axis=1)])
+    use_holt = errors[1] < errors[0]
+
+    ar = forecast_autoregression(fit_autoregression(moisture, rainfall, hours, lags), moisture, hours, horizon, lags)
+    holt = forecast_holt(moisture, horizon)
+    models = np.where(use_holt, "holt", "autoregression")
+    return np.where(use_holt[:, None], holt, ar), models, errors.min(axis=0), errors
+
+
+def thresholds(panel):
+    """The labels' moisture threshold of every farm, adjusted for its last hour's weather."""
+    values = panel.farms["crop_type"].map(irrigation_labels.CROP_THRESHOLDS) \
+        .fillna(irrigation_labels.DEFAULT_THRESHOLD).to_numpy(dtype=np.float64)
+    for name, direction, limit, points in irrigation_labels.ADJUSTMENTS:
+        latest = panel.weather[name][:, -1]
+        values = values + np.where(latest > limit if direction == ">" else latest < limit, points, 0)
+    return values
+
+
+def schedule(panel, forecasts, models, backtest_mae, generated_at=None):
+    """Farms ranked by how soon their forecast drops below the threshold (sooner, then drier, first)."""
+    threshold = thresholds(panel)
+    current = panel.moisture[:, -1]
+    # column 0 is now, then the forecast hours
+    path = np.concatenate([current[:, None], forecasts], axis=1)
+    below = path < threshold[:, None]
+    hours_until = np.where(below.any(axis=1), np.argmax(below, axis=1), -1)
+    forecast_min = forecasts.min(axis=1)
+    table = panel.farms.assign(
+        current_moisture=current,
+        threshold=threshold,
+        forecast_min=forecast_min,
+        hours_until_below=pd.array(np.where(hours_until >= 0, hours_until, None), dtype="Int64"),
+        irrigate_by=pd.Series(panel.hours[-1] + pd.to_timedelta(np.maximum(hours_until, 0), unit="h"))
+        .where(hours_until >= 0),
+        deficit=threshold - np.minimum(forecast_min, current),
+        model=models,
+        backtest_mae=backtest_mae,
+        forecast=np.round(forecasts, 3).tolist(),
+        generated_at=generated_at or pd.Timestamp.now().floor("s"),
+    )
+    order = np.lexsort((-table["deficit"].to_numpy(), np.where(hours_until >= 0, hours_until, np.iinfo(int).max)))
+    table = table.iloc[order].reset_index(drop=True)
+    table.insert(0, "rank", np.arange(1, len(table) + 1))
+    return table
+
+
+def read_postgres(history, connection=POSTGRES):
+    import psycopg2
+
+    with psycopg2.connect(**connection) as conn:
+        return pd.read_sql_query(HOURLY_QUERY, conn, params=(history,))
+
+
+def read_archive(path, history):
+    """Hourly means of the archive's last `history` hours (only the needed columns are read)."""
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format="parquet")
+    newest = pc.max(dataset.to_table(columns=["timestamp"])["timestamp"]).as_py()
+    # timestamps are ISO strings: compared as text, with the archive's separator, they are in time order
+    since = (pd.Timestamp(newest).floor("h") - pd.Timedelta(hours=history)) \
+        .strftime("%Y-%m-%d" + ("T" if "T" in newest else " ") + "%H:%M:%S")
+    table = dataset.to_table(
+        columns=["farm_id", "region", "crop_type", "timestamp", "soil_moisture", "rainfall"] + WEATHER,
+        filter=pc.field("timestamp") >= since)
+    readings = table.to_pandas()
+    readings["hour"] = pd.to_datetime(readings["timestamp"].str.replace("T", " ")).dt.floor("h")
+    aggregations = {"region": "last", "crop_type": "last", "soil_moisture": "mean", "rainfall": "sum",
+                    **{name: "mean" for name in WEATHER}}
+    return readings.sort_values("hour").groupby(["farm_id", "hour"], as_index=False).agg(aggregations)
+
+
+def synthetic_hourly(farms, history, seed=0):
+    """Hourly rows of `farms` farms: moisture drying by day at a farm-specific rate, raised by rain."""
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range(end=pd.Timestamp.now().floor("h"), periods=history, freq="h")
+    daylight = np.clip(np.sin(np.pi * (np.asarray(hours.hour) - 6) / 12), 0, None)
+    rain = np.where(rng.random((farms, history)) < 0.02, rng.uniform(5, 40, (farms, history)), 0.0)
+    drying = rng.uniform(0.1, 0.6, (farms, 1)) * (0.3 + daylight)
+    moisture = np.clip(rng.uniform(30, 70, (farms, 1)) + np.cumsum(0.8 * rain - drying, axis=1)
+                       + rng.normal(0, 0.5, (farms, history)), 0, 100)
+    crops = list(irrigation_labels.CROP_THRESHOLDS)
+    farm_ids = np.array([f"farm_{i + 1}" for i in range(farms)])
+    return pd.DataFrame({
+        "farm_id": np.repeat(farm_ids, history),
+        "hour": np.tile(hours, farms),
+        "region": "Synthetic",
+        "crop_type": np.repeat(np.array(crops)[np.arange(farms) % len(crops)], history),
+        "soil_moisture": moisture.ravel(),
+        "rainfall": rain.ravel(),
+        "temperature": np.tile(20 + 12 * daylight, farms),
+        "humidity": np.tile(60 - 20 * daylight, farms),
+        "sunlight_intensity": np.tile(900 * daylight, farms),
+    })
+
+
+def write_postgres(table, connection=POSTGRES):
+    """Replace irrigation_schedule with this run's table in one transaction."""
+    import psycopg2
+    from psycopg2.extras import execute_values
+
+    columns = list(table.columns)
+    # missing values as NULL, NumPy scalars as Python ones; forecast lists become DOUBLE PRECISION[]
+    rows = [tuple(v.item() if isinstance(v, np.generic) else v for v in row)
+            for row in table.astype(object).where(table.notna(), None).itertuples(index=False, name=None)]
+    conn = psycopg2.connect(**connection)
+    with conn, conn.cursor() as cur:
+        cur.execute(SCHEDULE_DDL)
+        cur.execute(f"TRUNCATE {SCHEDULE_TABLE}")
+        execute_values(cur, f"INSERT INTO {SCHEDULE_TABLE} ({', '.join(columns)}) VALUES %s", rows)
+    conn.close()
+
+
+def run(hourly, history=72, horizon=12, lags=2):
+    """Panel, forecasts and schedule from hourly rows; returns (schedule, timings and backtest errors)."""
+    started = time.perf_counter()
+    panel = hourly_panel(hourly, history)
+    panel_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    forecasts, models, backtest_mae, errors = forecast(panel, horizon, lags)
+    table = schedule(panel, forecasts, models, backtest_mae)
+    forecast_seconds = time.perf_counter() - started
+    # persistence (moisture stays where it is) as the yardstick for the backtest errors
+    persistence = np.abs(panel.moisture[:, -horizon:] - panel.moisture[:, -horizon - 1:-horizon]).mean(axis=1)
+    report = {"farms": len(panel.farms), "hours": history, "horizon": horizon,
+              "panel_seconds": panel_seconds, "forecast_seconds": forecast_seconds,
+              "mae_autoregression": float(errors[0].mean()), "mae_holt": float(errors[1].mean()),
+              "mae_selected": float(backtest_mae.mean()), "mae_persistence": float(persistence.mean()),
+              "holt_farms": int((models == "holt").sum())}
+    return table, report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", choices=["postgres", "archive"], default="postgres",
+                        help="sensor_data in Postgres, or the Parquet archive")
+    parser.add_argument("--path", default=ARCHIVE_PATH, help="archive path (--source archive)")
+    parser.add_argument("--synthetic", type=int, metavar="FARMS", help="forecast generated farms instead")
+    parser.add_argument("--history", type=int, default=72, help="hours of history per farm")
+    parser.add_argument("--horizon", type=int, default=12, help="hours to forecast")
+    parser.add_argument("--lags", type=int, default=2, help="autoregression lags (hours)")
+    parser.add_argument("--output", help="also write the schedule here (.csv or .parquet)")
+    parser.add_argument("--postgres-output", action="store_true", help=f"replace {SCHEDULE_TABLE} in Postgres")
+    parser.add_argument("--top", type=int, default=10, help="schedule rows to print")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.perf_counter()
+    if args.synthetic:
+        hourly = synthetic_hourly(args.synthetic, args.history)
+    elif args.source == "archive":
+        hourly = read_archive(args.path, args.history)
+    else:
+        hourly = read_postgres(args.history)
+    read_seconds = time.perf_counter() - started
+
+    table, report = run(hourly, args.history, args.horizon, args.lags)
+    if args.output:
+        if args.output.endswith(".csv"):
+            table.to_csv(args.output, index=False)
+        else:
+            table.to_parquet(args.output, index=False)
+    if args.postgres_output:
+        write_postgres(table)
+
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(table.drop(columns=["forecast", "generated_at"]).head(args.top).to_string(index=False))
+    print(f"\n{report['farms']} farms: read {read_seconds:.2f}s, panel {report['panel_seconds']:.2f}s, "
+          f"fit + forecast + schedule {report['forecast_seconds']:.2f}s")
+    print(f"backtest MAE over the last {args.horizon}h: autoregression {report['mae_autoregression']:.3f}, "
+          f"holt {report['mae_holt']:.3f}, selected {report['mae_selected']:.3f} "
+          f"(persistence {report['mae_persistence']:.3f}); holt chosen for {report['holt_farms']} farms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Command-line query tool over the Parquet sensor archive written by spark_code.py.
+
+Filters on farm, region and time range are pushed down to the Parquet reader,
+so whole files and row groups are skipped using their column statistics, and
+only the requested columns are read. Results are streamed batch by batch.
+
+Examples:
+    python query_hdfs.py --farm farm_1 --start 2025-11-01 --end 2025-11-02 \
+        --columns timestamp,soil_moisture,rainfall --format csv
+    python query_hdfs.py --region Sinai --sample 0.01 --format jsonl --limit 500
+    python query_hdfs.py --count
+    python query_hdfs.py --count --farm farm_3 --start 2025-11-01
+"""
+import argparse
+import json
+import sys
+from datetime import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+HDFS_ARCHIVE_PATH = "hdfs://namenode:9000/user/smart_farming_data"
+
+
+def open_archive(path=HDFS_ARCHIVE_PATH):
+    """Open the archive as a pyarrow dataset (Spark's _spark_metadata is ignored)."""
+    if "://" in path:
+        filesystem, root = fs.FileSystem.from_uri(path)
+    else:
+        filesystem, root = fs.LocalFileSystem(), path
+    return ds.dataset(root, format="parquet", filesystem=filesystem)
+
+
+def to_iso(value):
+    """Normalize a date or datetime argument to the ISO format the producer writes."""
+    return datetime.fromisoformat(value).isoformat()
+
+
+def build_filter(farms=None, regions=None, start=None, end=None):
+    """Build a pushdown filter expression, or None when nothing is filtered."""
+    conditions = []
+    if farms:
+        conditions.append(ds.field("farm_id").isin(farms))
+    if regions:
+        conditions.append(ds.field("region").isin(regions))
+    # timestamps are stored as ISO strings, so string ordering is time ordering
+    if start:
+        conditions.append(ds.field("timestamp") >= to_iso(start))
+    if end:
+        conditions.append(ds.field("timestamp") < to_iso(end))
+    if not conditions:
+        return None
+    expr = conditions[0]
+    for condition in conditions[1:]:
+        expr = expr & condition
+    return expr
+
+
+def count_rows(dataset, expr=None):
+    """Count rows from Parquet footers.
+
+    Without a filter this only reads the file footers. With a filter, row groups
+    whose min/max statistics fully include or exclude the predicate are counted
+    from metadata as well; only the undecided ones are scanned (filter columns only).
+    """
+    if expr is None:
+        return sum(fragment.metadata.num_rows for fragment in dataset.get_fragments())
+    return dataset.count_rows(filter=expr)
+
+
+def iter_batches(dataset, columns=None, expr=None, sample=None, limit=None, seed=None, batch_size=65536):
+    """Yield record batches matching the query, optionally sampled and limited."""
+    scanner = dataset.scanner(columns=columns, filter=expr, batch_size=batch_size)
+    rng = np.random.default_rng(seed)
+    remaining = limit
+    for batch in scanner.to_batches():
+        if sample is not None:
+            batch = batch.filter(pa.array(rng.random(batch.num_rows) < sample))
+        if remaining is not None:
+            batch = batch.slice(0, remaining)
+            remaining -= batch.num_rows
+        if batch.num_rows:
+            yield batch
+        if remaining == 0:
+            break
+
+
+def write_csv(batches, schema, out):
+    with pa_csv.CSVWriter(out, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+def write_jsonl(batches, schema, out):
+    for batch in batches:
+        lines = [json.dumps(row, default=str) for row in batch.to_pylist()]
+        out.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+def write_arrow(batches, schema, out):
+    with pa.ipc.new_stream(out, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "arrow": write_arrow}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Query the smart farming Parquet archive.")
+    parser.add_argument("--path", default=HDFS_ARCHIVE_PATH, help="archive location (hdfs:// or local path)")
+    parser.add_argument("--farm", action="append", help="farm_id to keep, e.g. farm_1 (repeatable)")
+    parser.add_argument("--region", action="append", help="region to keep (repeatable)")
+    parser.add_argument("--start", help="inclusive start time, ISO date or datetime")
+    parser.add_argument("--end", help="exclusive end time, ISO date or datetime")
+    parser.add_argument("--columns", help="comma-separated columns to return (default: all)")
+    parser.add_argument("--sample", type=float, help="fraction of matching rows to return, e.g. 0.01")
+    parser.add_argument("--seed", type=int, help="random seed for --sample")
+    parser.add_argument("--limit", type=int, help="stop after this many rows")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument("--count", action="store_true", help="only print the number of matching rows")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    dataset = open_archive(args.path)
+    expr = build_filter(args.farm, args.region, args.start, args.end)
+
+    if args.count:
+        print(count_rows(dataset, expr))
+        return
+
+    columns = args.columns.split(",") if args.columns else None
+    unknown = set(columns or []) - set(dataset.schema.names)
+    if unknown:
+        raise SystemExit(f"Unknown columns: {', '.join(sorted(unknown))}")
+    schema = pa.schema([dataset.schema.field(c) for c in columns]) if columns else dataset.schema
+
+    batches = iter_batches(dataset, columns, expr, args.sample, args.limit, args.seed)
+    try:
+        WRITERS[args.format](batches, schema, sys.stdout.buffer)
+    except BrokenPipeError:
+        # e.g. piped into `head`
+        pass
+
+
+if __name__ == "__main__":
+    main()
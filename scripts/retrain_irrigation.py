@@ -0,0 +1,218 @@
+"""Incremental retraining of the irrigation model after each ETL run.
+
+Instead of retraining on the whole history, the model currently promoted in
+the model registry keeps boosting: a few more trees are fit on the readings
+the ETL run just loaded, with the model's own training parameters. The cost
+follows the size of the new slice, not of the history.
+
+A share of every slice (by a hash of sensor_id) is never trained on and is
+kept in a rolling holdout of the last --holdout-slices slices. The current
+and the retrained model are both scored on that window. The new version is
+registered either way, and promoted only if its log loss and accuracy hold
+(within --tolerance). The Flask app then picks it up through its registry
+watcher.
+
+    spark-submit scripts/retrain_irrigation.py --dag               # ETL DAG + retrain stage
+    python scripts/retrain_irrigation.py --slice new_readings.parquet
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# model_registry.py and irrigation_labels.py live in ML/ (the Spark image copies them next to this script)
+for directory in (os.path.join(HERE, "..", "ML", "Irrigation Prediction Model", "Irrigation Prediction Model -deployment"),
+                  os.path.join(HERE, "..", "ML", "Irrigation Prediction Model", "Model_notebook")):
+    if os.path.isdir(directory):
+        sys.path.append(directory)
+import irrigation_labels  # noqa: E402
+from irrigation_scoring import FEATURES  # noqa: E402
+from model_registry import ModelRegistry  # noqa: E402
+
+MODEL_NAME = "irrigation"
+REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR", "registry")
+HOLDOUT_DIR = "/tmp/irrigation_holdout"
+SLICE_COLUMNS = ["sensor_id"] + sorted(set(FEATURES) | set(irrigation_labels.COLUMNS))
+
+
+def prepare_slice(df):
+    """Labelled readings of a new slice, without a missing feature (as in the notebook)."""
+    df = df.assign(irrigation_needed=irrigation_labels.label_pandas(df))
+    return df.dropna(subset=FEATURES).reset_index(drop=True)
+
+
+def split_slice(df, holdout_percent):
+    """(train, holdout) by a hash of sensor_id, so a reading never moves between the two."""
+    hashes = pd.util.hash_array(df["sensor_id"].astype(str).to_numpy(dtype=object))
+    holdout = hashes % 100 < holdout_percent
+    return df[~holdout], df[holdout]
+
+
+def update_holdout(holdout, directory, keep):
+    """Add this slice's holdout to the window and drop the oldest slices; returns the window."""
+    os.makedirs(directory, exist_ok=True)
+    if len(holdout):
+        name = f"slice-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.parquet"
+        holdout[FEATURES + ["irrigation_needed"]].to_parquet(os.path.join(directory, name), index=False)
+    files = sorted(glob.glob(os.path.join(directory, "slice-*.parquet")))
+    for old in files[:-keep]:
+        os.remove(old)
+    files = files[-keep:]
+    if not files:
+        return None
+    return pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+
+
+def served_booster(model):
+    """The trees model.predict uses (up to best_iteration for a model trained with early stopping)."""
+    booster = model.get_booster()
+    best_iteration = getattr(model, "best_iteration", None)
+    if best_iteration is not None and best_iteration + 1 < booster.num_boosted_rounds():
+        booster = booster[:best_iteration + 1]
+    return booster
+
+
+def training_params(booster):
+    """The parameters a booster was trained with, to keep boosting it the same way."""
+    config = json.loads(booster.save_config())
+    learner = config["learner"]
+    params = dict(learner["gradient_booster"]["tree_train_param"])
+    params["objective"] = learner["objective"]["name"]
+    params["scale_pos_weight"] = learner["objective"].get("reg_loss_param", {}).get("scale_pos_weight", "1")
+    params["tree_method"] = "hist"
+    return params
+
+
+def evaluate(booster, window):
+    X = window[FEATURES].to_numpy(np.float32)
+    y = window["irrigation_needed"].to_numpy()
+    proba = np.clip(booster.inplace_predict(X, validate_features=False), 1e-7, 1 - 1e-7)
+    predicted = proba > 0.5
+    tp = int(np.sum(predicted & (y == 1)))
+    return {
+        "logloss": float(-np.mean(y * np.log(proba) + (1 - y) * np.log(1 - proba))),
+        "accuracy": float(np.mean(predicted == y)),
+        "precision": tp / max(int(predicted.sum()), 1),
+        "recall": tp / max(int((y == 1).sum()), 1),
+    }
+
+
+def holds(new, old, tolerance):
+    return new["logloss"] <= old["logloss"] * (1 + tolerance) and new["accuracy"] >= old["accuracy"] - tolerance
+
+
+def retrain(df, registry_dir=REGISTRY_DIR, name=MODEL_NAME, rounds=10, holdout_percent=20, holdout_dir=HOLDOUT_DIR,
+            holdout_slices=7, tolerance=0.0):
+    """Warm-start the current model on a new slice of readings; returns what was done."""
+    registry = ModelRegistry(registry_dir)
+    base_version = registry.current(name)
+    if base_version is None:
+        raise ValueError(f"no {name} model is promoted in {registry_dir}")
+    current = served_booster(joblib.load(registry.model_path(name, base_version)))
+
+    train, holdout = split_slice(prepare_slice(df), holdout_percent)
+    window = update_holdout(holdout, holdout_dir, holdout_slices)
+    if len(train) == 0 or window is None:
+        print("Nothing new to train on.")
+        return {"base_version": base_version, "promoted": False, "train_rows": len(train)}
+
+    started = time.perf_counter()
+    dtrain = xgb.DMatrix(train[FEATURES], train["irrigation_needed"])
+    # xgb_model: continue from the current trees instead of starting over
+    booster = xgb.train(training_params(current), dtrain, num_boost_round=rounds, xgb_model=current)
+    # a best_iteration inherited from the base model would hide the new trees
+    booster.set_attr(best_iteration=None, best_score=None)
+    train_seconds = time.perf_counter() - started
+
+    old_metrics, new_metrics = evaluate(current, window), evaluate(booster, window)
+    promote = holds(new_metrics, old_metrics, tolerance)
+
+    model = xgb.XGBClassifier()
+    model.load_model(bytearray(booster.save_raw("ubj")))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "model.pkl")
+        joblib.dump(model, path)
+        version = registry.register(
+            name, path, metrics={**new_metrics, "holdout_rows": len(window)},
+            params={"base_version": base_version, "added_rounds": rounds, "train_rows": len(train),
+                    "trees": booster.num_boosted_rounds()},
+            description=f"warm start of {base_version} on {len(train)} new readings"
+                        + ("" if promote else " (not promoted)"))
+    if promote:
+        registry.promote(name, version)
+    print(f"{name} {version} from {base_version} on {len(train)} readings in {train_seconds:.1f}s: "
+          f"logloss {old_metrics['logloss']:.4f} -> {new_metrics['logloss']:.4f}, "
+          f"accuracy {old_metrics['accuracy']:.4f} -> {new_metrics['accuracy']:.4f} on {len(window)} held out; "
+          + ("promoted" if promote else "kept " + base_version))
+    return {"base_version": base_version, "version": version, "promoted": promote, "train_rows": len(train),
+            "holdout_rows": len(window), "old": old_metrics, "new": new_metrics, "train_seconds": train_seconds}
+
+
+def retrain_stage(**options):
+    """ETL DAG stage retraining on the fact rows of the run, once they are loaded."""
+    from etl_dag import Stage
+
+    def run(inputs):
+        facts = inputs["facts"]
+        if facts is None:
+            return None
+        return retrain(facts.select(*SLICE_COLUMNS).toPandas(), **options)
+
+    return Stage("retrain_irrigation", run, ["facts"], after=["load_fact_sensor_data"])
+
+
+def read_slice(path):
+    if path.endswith(".csv"):
+        return pd.read_csv(path, usecols=lambda c: c in SLICE_COLUMNS)
+    return pd.read_parquet(path, columns=SLICE_COLUMNS)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dag", action="store_true", help="run the ETL DAG with the retrain stage at the end")
+    source.add_argument("--slice", help="retrain on these readings instead (Parquet or CSV)")
+    parser.add_argument("--registry", default=REGISTRY_DIR)
+    parser.add_argument("--rounds", type=int, default=10, help="trees added per retraining")
+    parser.add_argument("--holdout-percent", type=int, default=20, help="share of every slice held out")
+    parser.add_argument("--holdout-dir", default=HOLDOUT_DIR)
+    parser.add_argument("--holdout-slices", type=int, default=7, help="slices kept in the rolling holdout")
+    parser.add_argument("--tolerance", type=float, default=0.0,
+                        help="promote if log loss is at most this much (relative) worse and accuracy this much lower")
+    parser.add_argument("--workers", type=int, default=4, help="ETL stages run at the same time (--dag)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = {"registry_dir": args.registry, "rounds": args.rounds, "holdout_percent": args.holdout_percent,
+               "holdout_dir": args.holdout_dir, "holdout_slices": args.holdout_slices, "tolerance": args.tolerance}
+    if args.slice:
+        retrain(read_slice(args.slice), **options)
+        return
+
+    from pyspark.sql import SparkSession
+    import etl_dag
+    spark = SparkSession.builder \
+        .appName("ETL_SmartFarming_DAG") \
+        .config("spark.scheduler.mode", "FAIR") \
+        .getOrCreate()
+    runner = etl_dag.DagRunner(etl_dag.build_etl_dag(spark, extra_stages=[retrain_stage(**options)]),
+                               max_workers=args.workers, on_stage_start=etl_dag.spark_job_group(spark))
+    result = runner.run()
+    spark.stop()
+    if result["failed"]:
+        raise SystemExit(f"Failed stages: {', '.join(result['failed'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""Batch soil health scoring of the warehouse readings.
+
+Every reading of fact_sensor_data (or of the HDFS archive) is scored with the
+fused soil health pipeline (soil_pipeline.py, next to the Flask app) and the
+score is stored in fact_soil_health in farm_dwh, keyed like the fact table by
+(sensor_id, timestamp), for Power BI to join on.
+
+Runs are incremental. From the warehouse, MySQL itself returns only the
+readings that have no score yet (an anti-join on the unique key) and Spark
+reads them in date ranges over parallel JDBC connections. From the archive,
+only the files that arrived since the last run are read, tracked like the ETL
+does. The pipeline is broadcast once and applied by a pandas UDF to whole
+Arrow batches. Scores land in a staging table first and are copied over with
+INSERT IGNORE, so a rerun after a failure never duplicates a score.
+
+    spark-submit scripts/score_soil_health.py                     # from fact_sensor_data
+    spark-submit scripts/score_soil_health.py --source archive    # from the HDFS archive
+"""
+import argparse
+import hashlib
+import os
+import sys
+from typing import Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+import pymysql
+import pyspark.sql.functions as F
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import col, pandas_udf
+
+import etl_smartfarming as etl
+
+DEPLOYMENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ML", "Irrigation Prediction Model",
+                              "Irrigation Prediction Model -deployment")
+PIPELINE_PATH = os.environ.get("SOIL_HEALTH_PIPELINE_PATH", os.path.join(DEPLOYMENT_DIR, "soil_health_pipeline.pkl"))
+STATE_FILE = "/tmp/score_soil_health_state.json"
+TARGET_TABLE = "fact_soil_health"
+STAGING_TABLE = "fact_soil_health_staging"
+
+TARGET_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {TARGET_TABLE} (
+        sensor_id VARCHAR(50) NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        farm_id INT,
+        date DATE,
+        soil_health DOUBLE,
+        soil_condition VARCHAR(10),
+        model_version VARCHAR(16),
+        scored_at TIMESTAMP NULL,
+        UNIQUE KEY uq_soil_health_reading (sensor_id, timestamp)
+    )
+"""
+STAGING_SCHEMA = ("sensor_id VARCHAR(50), timestamp TIMESTAMP, farm_id INT, date DATE, soil_health DOUBLE, "
+                  "soil_condition VARCHAR(10), model_version VARCHAR(16), scored_at TIMESTAMP")
+OUTPUT_COLUMNS = ["sensor_id", "timestamp", "farm_id", "date", "soil_health", "soil_condition", "model_version",
+                  "scored_at"]
+
+# fact rows without a score; dim_farm may hold a farm more than once (it is appended every ETL run)
+UNSCORED_QUERY = f"""(
+    SELECT f.sensor_id, f.timestamp, f.farm_id, f.date, f.crop_type, d.region,
+           f.soil_pH, f.soil_moisture, f.temperature, f.humidity, f.rainfall, f.pesticide_usage_ml
+    FROM fact_sensor_data f
+    LEFT JOIN (SELECT farm_id, MIN(region) AS region FROM dim_farm GROUP BY farm_id) d ON d.farm_id = f.farm_id
+    LEFT JOIN {TARGET_TABLE} s ON s.sensor_id = f.sensor_id AND s.timestamp = f.timestamp
+    WHERE s.sensor_id IS NULL
+) AS unscored"""
+
+# soil_pipeline.py lives with the Flask app (the Spark image copies it next to this script)
+if os.path.isdir(DEPLOYMENT_DIR):
+    sys.path.append(DEPLOYMENT_DIR)
+import soil_pipeline  # noqa: E402
+
+
+def load_pipeline(spark, path=PIPELINE_PATH):
+    """Broadcast the fused pipeline once; returns (broadcast, model version)."""
+    spark.sparkContext.addPyFile(soil_pipeline.__file__)
+    with open(path, "rb") as f:
+        model_version = hashlib.sha256(f.read()).hexdigest()[:16]
+    pipeline = soil_pipeline.SoilHealthPipeline.load(path)
+    return spark.sparkContext.broadcast(pipeline), model_version
+
+
+def soil_health_udf(pipeline_bc):
+    """pandas UDF over the eight raw feature columns returning the soil health index.
+
+    Readings the pipeline cannot score (a missing measurement, or a crop or
+    region the encoders never saw) get null instead of failing the batch."""
+
+    @pandas_udf("double")
+    def score(batches: Iterator[Tuple[pd.Series, ...]]) -> Iterator[pd.Series]:
+        pipeline = pipeline_bc.value
+        for columns in batches:
+            frame = pd.DataFrame(dict(zip(soil_pipeline.FEATURES, columns)))
+            valid = frame[soil_pipeline.NUMERIC_FEATURES].notna().all(axis=1)
+            for name in soil_pipeline.CATEGORICAL_FEATURES:
+                valid &= frame[name].isin(pipeline.categories[name])
+            scores = np.full(len(frame), np.nan)
+            if valid.any():
+                scores[valid.to_numpy()] = pipeline.predict(frame[valid])
+            yield pd.Series(scores)
+
+    return score
+
+
+def score(df, pipeline_bc, model_version):
+    """Rows of df (sensor_id, timestamp, farm_id, date + the eight features) as fact_soil_health rows."""
+    raw = soil_health_udf(pipeline_bc)(*[col(c) for c in soil_pipeline.FEATURES])
+    scored = df.withColumn("soil_health", F.when(~F.isnan(raw), raw))
+    return scored.select(
+        col("sensor_id").substr(1, 50).alias("sensor_id"),
+        "timestamp",
+        col("farm_id").cast("int").alias("farm_id"),
+        col("date").cast("date").alias("date"),
+        "soil_health",
+        # soil_pipeline.condition as a column expression
+        F.when(col("soil_health") > 0.7, "Healthy")
+         .when(col("soil_health") > 0.4, "Moderate")
+         .when(col("soil_health").isNotNull(), "Poor").alias("soil_condition"),
+        F.lit(model_version).alias("model_version"),
+        F.current_timestamp().alias("scored_at"),
+    )
+
+
+def read_unscored_facts(spark, partitions, url=etl.MYSQL_URL, properties=etl.MYSQL_PROPERTIES):
+    """Unscored fact rows, read over `partitions` JDBC connections split by date; None if there are none."""
+    bounds = spark.read.jdbc(url, f"(SELECT MIN(date) AS lo, MAX(date) AS hi FROM {UNSCORED_QUERY}) AS b",
+                             properties=properties).collect()[0]
+    if bounds["lo"] is None:
+        return None
+    return spark.read.jdbc(
+        url, UNSCORED_QUERY, column="date", lowerBound=str(bounds["lo"]), upperBound=str(bounds["hi"]),
+        numPartitions=partitions, properties=properties)
+
+
+def read_new_archive_rows(spark, path, state):
+    """Readings of the archive files that arrived since the last run, and those files."""
+    new_files = etl.find_new_files(etl.list_archive_files(spark, path), state)
+    if not new_files:
+        return None, []
+    df = etl.trim_text(etl.read_sensor_data(spark, [p for p, _ in new_files]))
+    return df.withColumn("date", F.to_date("timestamp")).filter(col("sensor_id").isNotNull()), new_files
+
+
+def ensure_target_table(connection=etl.MYSQL_CONNECTION):
+    conn = pymysql.connect(**connection)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(TARGET_DDL)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def publish(staged_rows, connection=etl.MYSQL_CONNECTION):
+    """Copy the staging table into fact_soil_health, skipping readings scored already."""
+    columns = ", ".join(OUTPUT_COLUMNS)
+    conn = pymysql.connect(**connection)
+    try:
+        with conn.cursor() as cur:
+            inserted = cur.execute(
+                f"INSERT IGNORE INTO {TARGET_TABLE} ({columns}) SELECT {columns} FROM {STAGING_TABLE}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    print(f"Scored {staged_rows} readings, {inserted} new rows in {TARGET_TABLE}")
+    return inserted
+
+
+def run(spark, source="warehouse", path=etl.HDFS_INPUT_PATH, state_file=STATE_FILE, partitions=8,
+        pipeline_path=PIPELINE_PATH):
+    """One incremental scoring run. Returns the number of new scores."""
+    ensure_target_table()
+    state, new_files = None, []
+    if source == "warehouse":
+        df = read_unscored_facts(spark, partitions)
+    else:
+        state = etl.load_state(state_file)
+        df, new_files = read_new_archive_rows(spark, path, state)
+    if df is None:
+        print("Nothing to score.")
+        return 0
+
+    pipeline_bc, model_version = load_pipeline(spark, pipeline_path)
+    scores = score(df, pipeline_bc, model_version).cache()
+    staged_rows = scores.count()
+    scores.write.jdbc(url=etl.MYSQL_URL, table=STAGING_TABLE, mode="overwrite",
+                      properties={**etl.MYSQL_PROPERTIES, "createTableColumnTypes": STAGING_SCHEMA})
+    inserted = publish(staged_rows)
+    scores.unpersist()
+    pipeline_bc.unpersist()
+
+    if source == "archive":
+        etl.save_state(etl.advance_state(state, new_files, None), state_file)
+    return inserted
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", choices=["warehouse", "archive"], default="warehouse",
+                        help="score fact_sensor_data rows without a score, or newly arrived archive files")
+    parser.add_argument("--path", default=etl.HDFS_INPUT_PATH, help="archive path (--source archive)")
+    parser.add_argument("--state-file", default=STATE_FILE, help="arrival state (--source archive)")
+    parser.add_argument("--partitions", type=int, default=8, help="parallel JDBC reads (--source warehouse)")
+    parser.add_argument("--pipeline", default=PIPELINE_PATH, help="fused soil health pipeline file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    spark = SparkSession.builder.appName("SmartFarming_SoilHealthScoring").getOrCreate()
+    try:
+        run(spark, args.source, args.path, args.state_file, args.partitions, args.pipeline)
+    finally:
+        spark.stop()
+
+
+if __name__ == "__main__":
+    main()
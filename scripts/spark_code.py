@@ -27,6 +27,18 @@ from pyspark.sql.types import StructType, StringType, DoubleType
 import psycopg2
 import os
 import shutil
+import sys
+import irrigation_scoring
+import farm_features
+import farm_anomalies
+import feature_drift
+# soil_health_index.py lives next to the soil health notebook (the Spark image has it in /app);
+# run as the notebook there is no __file__, but Jupyter starts in scripts/
+HERE = os.path.dirname(os.path.abspath(__file__)) if "__file__" in globals() else os.getcwd()
+SOIL_NOTEBOOK_DIR = os.path.join(HERE, "..", "ML", "Soil_Health_Index_Model", "Model_notebook")
+if os.path.isdir(SOIL_NOTEBOOK_DIR):
+    sys.path.append(SOIL_NOTEBOOK_DIR)
+from soil_health_index import soil_health_index_column
 
 # Stop all active streaming queries first
 spark = SparkSession.getActiveSession()
@@ -40,8 +52,13 @@ if spark:
 checkpoint_paths = [
     "/tmp/checkpoints/kafka_to_hdfs_smartfarming",
     "/tmp/checkpoints/postgres_checkpoint",
-    "/tmp/checkpoints/hdfs_checkpoint"
+    "/tmp/checkpoints/hdfs_checkpoint",
+    "/tmp/checkpoints/farm_features_checkpoint",
+    "/tmp/checkpoints/anomalies_checkpoint"
 ]
+# not cleared: the drift sketches add up across restarts, and this checkpoint's query id
+# is how a batch replayed after a restart is recognised (see feature_drift.py)
+sketches_checkpoint = "/tmp/checkpoints/feature_sketches_checkpoint"
 
 for path in checkpoint_paths:
     if os.path.exists(path):
@@ -94,6 +111,16 @@ df_parsed = df_raw.selectExpr("CAST(value AS STRING) AS json_str") \
     .withColumn("data", from_json(col("json_str"), sensor_schema)) \
     .select("data.*")
 
+# Score every reading with the irrigation model: the model is broadcast once and
+# each micro-batch is scored by a vectorized pandas UDF over Arrow batches
+spark.sparkContext.addPyFile(irrigation_scoring.__file__)
+irrigation_model = irrigation_scoring.broadcast_model(spark)
+df_scored = irrigation_scoring.with_irrigation_prediction(df_parsed, irrigation_model)
+
+# The soil health index is a closed-form expression of pH, pesticide and moisture:
+# computed exactly as a column, no model needed
+df_scored = df_scored.withColumn("soil_health_index", soil_health_index_column())
+
 # PostgreSQL writer function
 def write_to_postgres(batch_df, epoch_id):
     if batch_df.isEmpty():
@@ -115,9 +142,10 @@ def write_to_postgres(batch_df, epoch_id):
                 INSERT INTO public.sensor_data (
                     sensor_id, timestamp, soil_moisture, soil_ph, 
                     temperature, rainfall, humidity, sunlight_intensity, 
-                    pesticide_usage_ml, farm_id, region, crop_type
+                    pesticide_usage_ml, farm_id, region, crop_type,
+                    irrigation_needed, irrigation_probability, soil_health_index
                 )
-                VALUES (%s::uuid, %s::timestamp, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                VALUES (%s::uuid, %s::timestamp, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 ON CONFLICT (sensor_id) DO NOTHING;
             """, (
                 row.sensor_id, 
@@ -131,7 +159,10 @@ def write_to_postgres(batch_df, epoch_id):
                 row.pesticide_usage_ml,
                 row.farm_id,
                 row.region,
-                row.crop_type
+                row.crop_type,
+                row.irrigation_needed,
+                row.irrigation_probability,
+                row.soil_health_index
             ))
             rows_written += 1
         
@@ -143,7 +174,7 @@ def write_to_postgres(batch_df, epoch_id):
         print(f"Error batch {epoch_id}: {str(e)}")
 
 # Start streaming to PostgreSQL
-postgres_query = df_parsed.writeStream \
+postgres_query = df_scored.writeStream \
     .foreachBatch(write_to_postgres) \
     .outputMode("append") \
     .option("checkpointLocation", "/tmp/checkpoints/postgres_checkpoint") \
@@ -153,7 +184,7 @@ postgres_query = df_parsed.writeStream \
 # Start streaming to HDFS
 hdfs_output_path = "hdfs://namenode:9000/user/smart_farming_data"
 
-hdfs_query = df_parsed.writeStream \
+hdfs_query = df_scored.writeStream \
     .format("parquet") \
     .option("path", hdfs_output_path) \
     .option("checkpointLocation", "/tmp/checkpoints/hdfs_checkpoint") \
@@ -161,9 +192,58 @@ hdfs_query = df_parsed.writeStream \
     .trigger(processingTime='10 seconds') \
     .start()
 
+# Rolling per-farm features (rain over 24h, moisture slope over 1h, ...): each farm's
+# last 24 hours of readings stay in Spark state, and its row in farm_features is upserted
+spark.sparkContext.addPyFile(farm_features.__file__)
+features_query = farm_features.with_farm_features(df_parsed).writeStream \
+    .foreachBatch(farm_features.online_writer(
+        dbname="smart_farming",
+        user="admin",
+        password="password",
+        host="postgres"
+    )) \
+    .outputMode("update") \
+    .option("checkpointLocation", "/tmp/checkpoints/farm_features_checkpoint") \
+    .trigger(processingTime='10 seconds') \
+    .start()
+
+# Anomalies per farm: running (EWMA) mean and variance of every metric in Spark state,
+# O(1) per reading; z-score outliers, sudden moisture drops, impossible values and stuck sensors
+spark.sparkContext.addPyFile(farm_anomalies.__file__)
+anomalies_query = farm_anomalies.with_anomalies(df_parsed, z=4.0).writeStream \
+    .foreachBatch(farm_anomalies.anomaly_writer(
+        dbname="smart_farming",
+        user="admin",
+        password="password",
+        host="postgres"
+    )) \
+    .outputMode("append") \
+    .option("checkpointLocation", "/tmp/checkpoints/anomalies_checkpoint") \
+    .trigger(processingTime='10 seconds') \
+    .start()
+
+# Drift sketches: per farm and day, the model's input features are counted in shared
+# logarithmic bins and added to feature_sketches; feature_drift.py compares them with the
+# sketch saved with the model, without reading the raw readings again
+sketches_query = df_parsed.writeStream \
+    .foreachBatch(feature_drift.sketch_writer(
+        sketches_checkpoint,
+        dbname="smart_farming",
+        user="admin",
+        password="password",
+        host="postgres"
+    )) \
+    .outputMode("append") \
+    .option("checkpointLocation", sketches_checkpoint) \
+    .trigger(processingTime='10 seconds') \
+    .start()
+
 print("Streaming started:")
 print(f"  PostgreSQL: smart_farming.sensor_data")
 print(f"  HDFS: {hdfs_output_path}")
+print(f"  PostgreSQL: smart_farming.{farm_features.ONLINE_TABLE}")
+print(f"  PostgreSQL: smart_farming.{farm_anomalies.ANOMALY_TABLE}")
+print(f"  PostgreSQL: smart_farming.{feature_drift.SKETCH_TABLE}")
 
 # Wait for termination
 spark.streams.awaitAnyTermination()
@@ -0,0 +1,207 @@
+"""Distributed training of the irrigation model on the Spark cluster.
+
+Readings come from fact_sensor_data in farm_dwh (parallel JDBC reads split by
+date) or from the HDFS archive. They are labelled with the notebook's rule as
+a Spark expression (irrigation_labels.label_column), and the classifier is
+trained with xgboost's SparkXGBClassifier: one xgboost worker per Spark task,
+each on its partition of the readings, synchronised through Rabit. The holdout
+is scored and counted on the executors too, so the driver only receives the
+final model and a handful of sums.
+
+The trained booster is saved as the same pickled XGBClassifier the notebook
+writes, so the Flask app, the streaming job and the model registry load it
+as before. Next to it goes the sketch of the training features that
+feature_drift.py compares the stream with (irrigation_model.baseline.json),
+also counted on the executors.
+
+    spark-submit scripts/train_irrigation_spark.py --output /app/models/irrigation_model.pkl
+    spark-submit scripts/train_irrigation_spark.py --source archive --scaling 1,2,4,8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import joblib
+import pyspark.sql.functions as F
+import xgboost as xgb
+from pyspark.ml.evaluation import BinaryClassificationEvaluator
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import col
+from xgboost.spark import SparkXGBClassifier
+
+import etl_smartfarming as etl
+import feature_drift
+from irrigation_scoring import FEATURES
+
+NOTEBOOK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ML", "Irrigation Prediction Model",
+                            "Model_notebook")
+LABEL = "irrigation_needed"
+
+# irrigation_labels.py lives next to the notebook (the Spark image copies it next to this script)
+if os.path.isdir(NOTEBOOK_DIR):
+    sys.path.append(NOTEBOOK_DIR)
+import irrigation_labels  # noqa: E402
+
+
+def read_warehouse(spark, partitions, url=etl.MYSQL_URL, properties=etl.MYSQL_PROPERTIES):
+    """fact_sensor_data over `partitions` JDBC connections split by date."""
+    bounds = spark.read.jdbc(url, "(SELECT MIN(date) AS lo, MAX(date) AS hi FROM fact_sensor_data) AS b",
+                             properties=properties).collect()[0]
+    if bounds["lo"] is None:
+        raise ValueError("fact_sensor_data is empty")
+    return spark.read.jdbc(url, "fact_sensor_data", column="date", lowerBound=str(bounds["lo"]),
+                           upperBound=str(bounds["hi"]), numPartitions=partitions, properties=properties)
+
+
+def read_readings(spark, source, path=etl.HDFS_INPUT_PATH, partitions=8):
+    if source == "warehouse":
+        return read_warehouse(spark, partitions)
+    return etl.trim_text(spark.read.parquet(path))
+
+
+def build_features(df, holdout_percent=20):
+    """Labelled readings without a missing feature, with a stable holdout flag (by a hash of sensor_id)."""
+    df = df.select("sensor_id", *[col(c).cast("double") for c in FEATURES], "crop_type")
+    df = df.withColumn(LABEL, irrigation_labels.label_column()).dropna(subset=FEATURES)
+    return df.withColumn("holdout", F.abs(F.xxhash64("sensor_id")) % 100 < holdout_percent) \
+        .select(*FEATURES, LABEL, "holdout")
+
+
+def train(train_df, num_workers, num_boost_round=100):
+    """Fit SparkXGBClassifier with the notebook's scale_pos_weight; returns the Spark model."""
+    counts = {row[LABEL]: row["count"] for row in train_df.groupBy(LABEL).count().collect()}
+    if not counts.get(0) or not counts.get(1):
+        raise ValueError(f"training split has label counts {counts}")
+    classifier = SparkXGBClassifier(
+        features_col=FEATURES,
+        label_col=LABEL,
+        num_workers=num_workers,
+        n_estimators=num_boost_round,
+        tree_method="hist",
+        scale_pos_weight=counts[0] / counts[1],
+    )
+    return classifier.fit(train_df.repartition(num_workers))
+
+
+def evaluate(model, test_df):
+    """Holdout metrics, computed on the executors."""
+    scored = model.transform(test_df).cache()
+    sums = scored.agg(
+        F.count("*").alias("rows"),
+        F.sum(((col(LABEL) == 1) & (col("prediction") == 1)).cast("long")).alias("tp"),
+        F.sum(((col(LABEL) == 0) & (col("prediction") == 1)).cast("long")).alias("fp"),
+        F.sum(((col(LABEL) == 1) & (col("prediction") == 0)).cast("long")).alias("fn"),
+    ).collect()[0]
+    auc = BinaryClassificationEvaluator(rawPredictionCol="rawPrediction", labelCol=LABEL).evaluate(scored)
+    scored.unpersist()
+    rows, tp, fp, fn = sums["rows"], sums["tp"] or 0, sums["fp"] or 0, sums["fn"] or 0
+    return {
+        "holdout_rows": rows,
+        "accuracy": (rows - fp - fn) / max(rows, 1),
+        "precision": tp / max(tp + fp, 1),
+        "recall": tp / max(tp + fn, 1),
+        "auc": auc,
+    }
+
+
+def save_model(model, path):
+    """Save the trained booster as the pickled XGBClassifier the deployment loads."""
+    classifier = xgb.XGBClassifier()
+    classifier.load_model(bytearray(model.get_booster().save_raw("ubj")))
+    joblib.dump(classifier, path)
+
+
+def run(spark, source="warehouse", path=etl.HDFS_INPUT_PATH, partitions=8, num_workers=None,
+        num_boost_round=100, holdout_percent=20, output=None):
+    """Read, train and evaluate once; returns timings and metrics."""
+    num_workers = num_workers or spark.sparkContext.defaultParallelism
+    started = time.perf_counter()
+    df = build_features(read_readings(spark, source, path, partitions), holdout_percent).cache()
+    train_df = df.filter(~col("holdout")).drop("holdout")
+    test_df = df.filter(col("holdout")).drop("holdout")
+    train_rows = train_df.count()
+    read_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    model = train(train_df, num_workers, num_boost_round)
+    train_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    metrics = evaluate(model, test_df)
+    evaluate_seconds = time.perf_counter() - started
+
+    baseline = None
+    if output:
+        save_model(model, output)
+        baseline = feature_drift.save_spark_baseline(train_df, output, rows=train_rows, source=source)
+    df.unpersist()
+    return {"num_workers": num_workers, "train_rows": train_rows, **metrics, "read_seconds": read_seconds,
+            "train_seconds": train_seconds, "evaluate_seconds": evaluate_seconds, "baseline": baseline}
+
+
+def session(master=None):
+    builder = SparkSession.builder.appName("SmartFarming_IrrigationTraining")
+    if master:
+        builder = builder.master(master)
+    return builder.getOrCreate()
+
+
+def scaling_report(cores, **kwargs):
+    """Run the same training on local[N] for every N in cores; one result per N, with speedups."""
+    results = []
+    for n in cores:
+        spark = session(f"local[{n}]")
+        try:
+            result = run(spark, num_workers=n, **kwargs)
+        finally:
+            spark.stop()
+        results.append(result)
+        print(f"local[{n}]: read {result['read_seconds']:.1f}s, train {result['train_seconds']:.1f}s, "
+              f"evaluate {result['evaluate_seconds']:.1f}s, accuracy {result['accuracy']:.4f}")
+    base = results[0]["train_seconds"] + results[0]["evaluate_seconds"]
+    print(f"\n{'cores':>6} {'train s':>9} {'eval s':>8} {'speedup':>8} {'efficiency':>11}")
+    for n, r in zip(cores, results):
+        speedup = base / (r["train_seconds"] + r["evaluate_seconds"])
+        r["speedup"] = speedup
+        print(f"{n:>6} {r['train_seconds']:>9.1f} {r['evaluate_seconds']:>8.1f} {speedup:>7.2f}x "
+              f"{speedup * cores[0] / n:>10.0%}")
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", choices=["warehouse", "archive"], default="warehouse",
+                        help="fact_sensor_data in MySQL, or the Parquet archive")
+    parser.add_argument("--path", default=etl.HDFS_INPUT_PATH, help="archive path (--source archive)")
+    parser.add_argument("--partitions", type=int, default=8, help="parallel JDBC reads (--source warehouse)")
+    parser.add_argument("--workers", type=int, help="xgboost workers (default: the cluster's parallelism)")
+    parser.add_argument("--rounds", type=int, default=100, help="boosting rounds")
+    parser.add_argument("--holdout-percent", type=int, default=20)
+    parser.add_argument("--output", help="where to save the pickled model")
+    parser.add_argument("--scaling", help="comma-separated core counts: train on local[N] for each, report speedup")
+    parser.add_argument("--report", help="also write the results as JSON here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = {"source": args.source, "path": args.path, "partitions": args.partitions,
+               "num_boost_round": args.rounds, "holdout_percent": args.holdout_percent}
+    if args.scaling:
+        results = scaling_report([int(n) for n in args.scaling.split(",")], **options)
+    else:
+        spark = session()
+        try:
+            results = run(spark, num_workers=args.workers, output=args.output, **options)
+        finally:
+            spark.stop()
+        print(json.dumps(results, indent=2))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()